@@ -0,0 +1,152 @@
+"""
+Machine-readable views of the latest sample.
+
+/api/current is JSON and /metrics is the Prometheus text format. Both are
+rendered from the samplers' cached samples, never from the sensors, into
+preallocated buffers: the JSON once per sample, the metrics on every
+scrape as they carry the server counters too. The sensor metrics have a
+'sensor' label per sensor. /api/stats is JSON of the rolling statistics
+and /api/sensors lists the sensors.
+"""
+
+import gc
+from micropython import const
+
+_CURRENT_SIZE = const(512)
+_METRICS_SIZE = const(1024)
+_SENSOR_METRICS_SIZE = const(640)  # More for every sensor after the first
+
+_current = bytearray(_CURRENT_SIZE)
+_current_mv = memoryview(_current)
+_current_len = 0
+_current_key = None
+_metrics = bytearray(_METRICS_SIZE)
+_metrics_mv = memoryview(_metrics)
+
+
+# Copy 'data' into 'buf' at 'offset', returns the new end
+def _put(buf, offset, data):
+    end = offset + len(data)
+    if end > len(buf):
+        raise ValueError('api buffer too small')
+    buf[offset:end] = data
+    return end
+
+
+def current(sample, key, sensor, gas_steps=(), extremes=None):
+    """JSON for 'sample', the (timestamp, temperature, humidity, pressure, gas, aqi) tuple
+       of the sampler of 'sensor', by name, with the gas of every heater step in
+       'gas_steps' when the profile has several. 'extremes' adds the (mins, maxs) of the
+       sample values as "min" and "max" lists. Rendered again only when 'key' changes,
+       returns a memoryview of the shared buffer."""
+    global _current_len, _current_key
+    if key != _current_key:
+        timestamp, temperature, humidity, pressure, gas, aqi = sample
+        steps = (',"gas_steps":[%s]' % ','.join('%.2f' % step for step in gas_steps)
+                 if len(gas_steps) > 1 else '')
+        window = (',"min":[%s],"max":[%s]' % tuple(
+            ','.join('%.2f' % value for value in values) for values in extremes)
+                  if extremes else '')
+        _current_len = _put(_current, 0, (
+            '{"sensor":"%s","timestamp":%d,"temperature":%.2f,"temperature_f":%.2f,'
+            '"humidity":%.2f,"pressure":%.2f,"gas":%.2f%s,"aqi":%.2f%s}' % (
+                sensor, timestamp, temperature, temperature * 9 / 5 + 32, humidity, pressure,
+                gas, steps, aqi, window)).encode('ascii'))
+        _current_key = key
+    return _current_mv[:_current_len]
+
+
+# Name, type and the lead-in of the sample line, built once
+def _metric(name, kind):
+    return f'# TYPE {name} {kind}\n{name} '.encode('ascii')
+
+
+# Type line and the lead-in of a sample line up to the sensor name, for labelled metrics
+def _sensor_metric(name, kind):
+    return f'# TYPE {name} {kind}\n'.encode('ascii'), f'{name}{{sensor="'.encode('ascii')
+
+
+# Per sample field, then the sample count
+_SENSOR_METRICS = (
+    _sensor_metric('bme680_sample_timestamp_seconds', 'gauge'),
+    _sensor_metric('bme680_temperature_celsius', 'gauge'),
+    _sensor_metric('bme680_humidity_percent', 'gauge'),
+    _sensor_metric('bme680_pressure_hpa', 'gauge'),
+    _sensor_metric('bme680_gas_resistance_kohms', 'gauge'),
+    _sensor_metric('bme680_air_quality_index', 'gauge'),
+    _sensor_metric('bme680_samples_total', 'counter'),
+)
+_SAMPLES = const(6)     # Index of the sample count in _SENSOR_METRICS
+_REQUESTS = _metric('http_requests_total', 'counter')
+_ERRORS = _metric('http_request_errors_total', 'counter')
+_CONNECTIONS = _metric('http_connections', 'gauge')
+_UPTIME = _metric('process_uptime_seconds', 'gauge')
+_HEAP_FREE = _metric('heap_free_bytes', 'gauge')
+
+
+def metrics(samplers, requests, errors, connections, uptime):
+    """Prometheus exposition of the latest samples in 'samplers', (sensor name as bytes,
+       Sampler) pairs, and the server counters. Returns a memoryview of the shared buffer."""
+    global _metrics, _metrics_mv
+    size = _METRICS_SIZE + _SENSOR_METRICS_SIZE * (len(samplers) - 1)
+    if len(_metrics) < size:    # Once, the sensors don't change
+        _metrics = bytearray(size)
+        _metrics_mv = memoryview(_metrics)
+    buf = _metrics
+    end = 0
+    for i in range(len(_SENSOR_METRICS)):
+        kind, lead = _SENSOR_METRICS[i]
+        end = _put(buf, end, kind)
+        for name, sampler in samplers:
+            if i == _SAMPLES:
+                value = b'%d\n' % sampler.count
+            elif not sampler.count:
+                continue    # Warming up
+            else:
+                value = (b'%d\n' if i == 0 else b'%.2f\n') % sampler.latest()[i]
+            end = _put(buf, end, lead)
+            end = _put(buf, end, name)
+            end = _put(buf, end, b'"} ')
+            end = _put(buf, end, value)
+    for lead, value in ((_REQUESTS, requests), (_ERRORS, errors),
+                        (_CONNECTIONS, connections), (_UPTIME, uptime)):
+        end = _put(buf, end, lead)
+        end = _put(buf, end, b'%d\n' % value)
+    try:
+        heap_free = gc.mem_free()
+    except AttributeError:
+        heap_free = None    # Not on CPython
+    if heap_free is not None:
+        end = _put(buf, end, _HEAP_FREE)
+        end = _put(buf, end, b'%d\n' % heap_free)
+    return _metrics_mv[:end]
+
+
+_FIELDS = ('temperature', 'humidity', 'pressure', 'gas', 'aqi')
+
+
+def stats_json(windows, sensor):
+    """JSON of the rolling statistics 'windows' of 'sensor', by name: samples, min, max,
+       mean and standard deviation per value and window"""
+    parts = []
+    for window in windows:
+        fields = []
+        for field in range(len(_FIELDS)):
+            summary = window.summary(field)
+            if summary is None:
+                continue
+            count, low, high, mean, variance = summary
+            fields.append('"%s":{"min":%.2f,"max":%.2f,"mean":%.2f,"sd":%.2f}' % (
+                _FIELDS[field], low, high, mean, variance ** 0.5))
+        samples = summary[0] if fields else 0
+        parts.append('{"span":%d,"samples":%d%s}' % (
+            window.span, samples, ''.join(',' + field for field in fields)))
+    return ('{"sensor":"%s","windows":[%s]}' % (sensor, ','.join(parts))).encode('ascii')
+
+
+def sensors_json(sensors):
+    """JSON list of the sensors: name, bus and samples taken"""
+    return ('{"sensors":[%s]}' % ','.join(
+        '{"name":"%s","bus":"%s","samples":%d}' % (
+            sensor.name, sensor.spec.get('bus', 'i2c'), sensor.sampler.count)
+        for sensor in sensors)).encode('ascii')
@@ -0,0 +1,129 @@
+"""
+Compensation benchmark: float against fixed-point integer compensation.
+
+First checks that both modes of the driver agree over a sweep of raw ADC
+inputs, then reports compensations per second for each. Runs the real
+driver code on a register image with typical calibration values, so no
+sensor is needed. Run from the project root, on the Pico W or on the
+host, where the MicroPython modules come from the simulator:
+
+    python3 benchmarks/compensation.py
+
+Exits with status 1 when the modes disagree by more than the tolerances.
+"""
+
+import sys
+import time
+import struct
+sys.path.insert(0, '.')
+try:
+    import micropython  # noqa: F401
+except ImportError:     # On the host
+    import sim
+    sim.install()
+from bme680 import Adafruit_BME680
+
+ROUNDS = 500
+
+# Largest accepted difference between the modes. The fixed-point formulas truncate at
+# every shift, which costs up to about 0.1 hPa of pressure, well inside the sensor's
+# 0.6 hPa absolute accuracy.
+TOLERANCE = {'temperature': 0.02, 'pressure': 0.12, 'humidity': 0.05, 'gas': 0.001}
+
+# Typical calibration words, in the order the driver unpacks them
+_COEFF_FORMAT = '<hbBHhbBhhbbHhhBBBHbbbBbHhbb'
+_COEFF = (26400, 3, 0, 36000, -10300, 88, 0, 7000, -100, 30, 30, 0, -3000, -2000, 30, 0, 63,
+          12483, 0, 45, 20, 120, -100, 26000, -12000, -30, 18)
+
+
+class MemoryBME680(Adafruit_BME680):
+    """The driver on an in-memory register image instead of a bus"""
+    def __init__(self, integer=False):
+        self._mem = bytearray(256)
+        self._mem[0xD0] = 0x61      # Chip ID
+        coeff = b'\x00' + struct.pack(_COEFF_FORMAT, *_COEFF) + b'\x00\x00'
+        self._mem[0x89:0x89 + 25] = coeff[:25]
+        self._mem[0xE1:0xE1 + 16] = coeff[25:]
+        self._mem[0x00:0x05] = bytes((0x3C, 0, 0x10, 0, 0x20))  # Heater value, range, error
+        super().__init__(integer=integer)
+
+    def _read(self, register, length):
+        return self._mem[register:register + length]
+
+    def _write_pairs(self, pairs):
+        for register, value in pairs:
+            if register != 0xE0:    # Soft reset
+                self._mem[register] = value
+
+
+# Raw data block as read from the status register on, for the given ADC values
+def data_block(adc_temp, adc_pres, adc_hum, adc_gas, gas_range):
+    data = bytearray(15)
+    data[0] = 0x80
+    data[2:5] = bytes((adc_pres >> 12, (adc_pres >> 4) & 0xFF, (adc_pres & 0x0F) << 4))
+    data[5:8] = bytes((adc_temp >> 12, (adc_temp >> 4) & 0xFF, (adc_temp & 0x0F) << 4))
+    data[8:10] = bytes((adc_hum >> 8, adc_hum & 0xFF))
+    data[13:15] = bytes((adc_gas >> 2, ((adc_gas & 0x03) << 6) | 0x30 | gas_range))
+    return data
+
+
+# Parse 'data', the result of a gas measurement, and return (temperature, pressure,
+# humidity, gas)
+def compensate(sensor, data):
+    sensor._data = data
+    sensor._measuring_step = 0
+    sensor._parse_data()
+    return (sensor._compensate_temperature(), sensor._compensate_pressure(),
+            sensor._compensate_humidity(), sensor._compensate_gas())
+
+
+def sweep():
+    """Compare both modes over the ADC ranges, return the largest difference per value
+       (relative for gas)"""
+    sensor = MemoryBME680()
+    worst = [0.0, 0.0, 0.0, 0.0]
+    count = 0
+    for adc_temp in range(380000, 620001, 16000):
+        for adc_pres in range(250000, 550001, 20000):
+            for adc_hum in range(12000, 36001, 3000):
+                gas_range = count % 16
+                adc_gas = 100 + (count * 37) % 900
+                data = data_block(adc_temp, adc_pres, adc_hum, adc_gas, gas_range)
+                sensor.integer_compensation = False
+                expected = compensate(sensor, data)
+                sensor.integer_compensation = True
+                got = compensate(sensor, data)
+                for i in range(3):
+                    worst[i] = max(worst[i], abs(got[i] - expected[i]))
+                worst[3] = max(worst[3], abs(got[3] - expected[3]) / expected[3])
+                count += 1
+    return count, dict(zip(('temperature', 'pressure', 'humidity', 'gas'), worst))
+
+
+def throughput(integer):
+    """Compensations per second, each one parsing a data block and computing every value"""
+    sensor = MemoryBME680(integer)
+    data = data_block(500000, 400000, 24000, 500, 5)
+    start = time.ticks_us() if hasattr(time, 'ticks_us') else int(time.perf_counter() * 1000000)
+    for x in range(ROUNDS):
+        compensate(sensor, data)
+    end = time.ticks_us() if hasattr(time, 'ticks_us') else int(time.perf_counter() * 1000000)
+    return ROUNDS * 1000000 / (end - start)
+
+
+def main():
+    count, worst = sweep()
+    ok = True
+    print(f'{count} ADC inputs, largest difference integer vs float:')
+    for name in ('temperature', 'pressure', 'humidity', 'gas'):
+        within = worst[name] <= TOLERANCE[name]
+        ok = ok and within
+        print(f'  {name:<12} {worst[name]:.6f}{" (relative)" if name == "gas" else ""}'
+              f'   {"ok" if within else "OVER TOLERANCE " + str(TOLERANCE[name])}')
+    for name, integer in (('float', False), ('integer', True)):
+        print(f'{name:<8} {throughput(integer):10.0f} compensations/s')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
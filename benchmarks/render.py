@@ -0,0 +1,120 @@
+"""
+Dashboard render benchmark: time and heap allocated per page render.
+
+Compares the old per-request string concatenation against the
+precompiled template, streamed and from the per-sample render cache.
+Run from the project root, on the host or on the Pico W:
+
+    python3 benchmarks/render.py
+"""
+
+import sys
+import time
+import gc
+sys.path.insert(0, '.')
+from template import Template
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ROUNDS = 200
+
+VALUES = {
+    'HOST': '192.168.1.50', 'SENSOR': 'bme680', 'TEMP_F': 75.43, 'TEMP_C': 24.13,
+    'MIN_TEMP': 71.2, 'MAX_TEMP': 79.9, 'HUMIDITY': 61.02, 'MIN_HUMID': 55.1,
+    'MAX_HUMID': 70.33, 'AQI': 7.1, 'MIN_AQI': 6.5, 'MAX_AQI': 7.9, 'GAS': 98.55,
+    'MIN_GAS': 80.1, 'MAX_GAS': 120.4, 'PRESSURE': 1012.62, 'MIN_PRESS': 1008.1,
+    'MAX_PRESS': 1019.4, 'TOKEN': 1700000000, 'START': 1699700000, 'DATE': '11-14-2023', 'TIME': '10:13:20',
+    'RUNTIME': '3 days 4 hours 5 minutes 6 seconds',
+}
+
+
+class NullWriter:
+    """Stream writer that drops everything, like a socket with an infinite send buffer"""
+    def __init__(self):
+        self.sent = 0
+
+    def write(self, buf):
+        self.sent += len(buf)
+
+    async def drain(self):
+        pass
+
+
+# Split each page line into static text and placeholder names, ahead of timing
+def split_lines(lines, names):
+    result = []
+    for line in lines:
+        parts = [line]
+        for name in names:
+            split = []
+            for part in parts:
+                if isinstance(part, tuple):
+                    split.append(part)
+                    continue
+                pieces = part.split('{' + name + '}')
+                for i in range(len(pieces)):
+                    if i:
+                        split.append((name,))
+                    split.append(pieces[i])
+            parts = split
+        result.append(parts)
+    return result
+
+
+# The pre-template renderer: one string concatenation per line of the page
+def concat_render(lines, values):
+    response = ''
+    for parts in lines:
+        line = ''
+        for part in parts:
+            line += str(values[part[0]]) if isinstance(part, tuple) else part
+        response += line + '\r\n'
+    return response.encode('utf-8')
+
+
+# Run a coroutine that never suspends, without event loop overhead
+def run(coro):
+    try:
+        coro.send(None)
+    except StopIteration:
+        pass
+
+
+def measure(name, fn):
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+    else:
+        before = gc.mem_alloc()
+    start = time.ticks_us() if hasattr(time, 'ticks_us') else int(time.perf_counter() * 1000000)
+    for x in range(ROUNDS):
+        fn()
+    end = time.ticks_us() if hasattr(time, 'ticks_us') else int(time.perf_counter() * 1000000)
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        heap = f'peak heap {peak} B'
+    else:
+        heap = f'allocated {(gc.mem_alloc() - before) // ROUNDS} B/render'
+    print(f'{name:<24} {(end - start) / ROUNDS:9.1f} us/render   {heap}')
+
+
+def main():
+    streamed = Template('index.html')
+    cached = Template('index.html', cache=True)
+    writer = NullWriter()
+    with open('index.html') as f:
+        lines = split_lines(f.read().split('\n'), streamed.names)
+
+    measure('concatenation (before)', lambda: concat_render(lines, VALUES))
+    measure('template, streamed', lambda: run(streamed.stream(writer, VALUES)))
+    measure('template, cached', lambda: run(cached.stream(writer, VALUES, key=1)))
+
+
+if __name__ == '__main__':
+    main()
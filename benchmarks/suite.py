@@ -0,0 +1,375 @@
+"""
+Benchmark suite: sensor pipeline, page rendering and the HTTP server under
+load, with the results as JSON for comparing versions.
+
+Runs on the host against the simulator (sim/), from the project root:
+
+    python3 benchmarks/suite.py [--quick] [--output results.json]
+
+Sections:
+
+sensor       Samples per second through the driver's poll() on a sensor
+             with no measurement time, and I2C transactions per sample
+compensation Compensations per second, float and integer
+render       Dashboard render time and peak heap, streamed and cached
+requests     Time and peak heap per request for each route, served
+             in-process from memory streams, no sockets
+load         The server started with 'python3 -m sim', hit over loopback
+             by concurrent keep-alive clients: latency p50/p95/p99 (the
+             first request of a client includes its connect, which is
+             also reported on its own), requests and bytes per second,
+             for the dashboard, a static asset, the JSON API and a 2 MB
+             stats.csv
+
+The sample log is seeded with LOG_RECORDS records, LOG_INTERVAL apart and
+ending now, so the CSV and the queries have realistic sizes.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [PROJECT, os.path.join(PROJECT, 'benchmarks')]
+
+import sim
+from sim import sensor as sim_sensor
+from sim.__main__ import prepare_root
+sim.install(sim_sensor.BME680(latency=0))
+
+import compensation
+import config
+import render
+import tsdb
+from bme680 import BME680_I2C
+from machine import I2C
+
+VERSION = 1         # Of the JSON layout
+LOG_RECORDS = 34000     # About 2 MB of CSV
+LOG_INTERVAL = 300
+# Settings of the server under test: a log that keeps the seeded records, and fast samples
+SETTINGS = {'LOG_MAX_BYTES': 0, 'SAMPLE_INTERVAL': 2, 'SAMPLE_WARMUP': 1,
+            'CALIBRATION_CACHE': None}
+# Route, concurrent clients and requests per client of the load test
+LOAD = (
+    ('/', (1, 4, 8), 50),
+    ('/img/apple-touch-icon.png', (1, 4, 8), 50),
+    ('/api/current', (1, 4, 8), 100),
+    ('/api/readings?from=-604800&step=3600', (1, 4), 20),
+    ('/stats.csv', (1, 4), 3),
+)
+ROUTES = [route for route, clients, requests in LOAD] + ['/metrics', '/api/stats',
+                                                        '/api/sensors', '/debug/stats']
+
+
+def clock():
+    return time.perf_counter()
+
+
+def percentile(values, p):
+    """The 'p' percentile of the sorted 'values', nearest rank"""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    return {'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3)}
+
+
+def seed_log(root, records):
+    """Fill the sample log in 'root' with 'records' samples ending now"""
+    log = tsdb.SegmentedLog(os.path.join(root, config.LOG_DIR), LOG_INTERVAL, 512,
+                            config.LOG_SEGMENT_RECORDS)
+    now = int(time.time())
+    for n in range(records):
+        phase = (n % 288) / 288
+        log.append(now - (records - n) * LOG_INTERVAL, 20 + 3 * phase, 45 + 10 * phase,
+                   1013 - 4 * phase, 60 + 20 * phase, 5 + phase)
+    log.flush()
+
+
+# Sections
+
+def bench_sensor(rounds):
+    results = {}
+    for name, integer in (('float', False), ('integer', True)):
+        bus = I2C(0)
+        bme = BME680_I2C(bus, refresh_rate=1000000, integer=integer)
+        bus.transactions = 0
+        samples = 0
+        start = clock()
+        while samples < rounds:
+            if bme.poll() is not None:
+                samples += 1
+        elapsed = clock() - start
+        results[name] = {'samples_per_s': round(samples / elapsed, 1),
+                         'i2c_transactions_per_sample': round(bus.transactions / samples, 2)}
+    return results
+
+
+def bench_compensation():
+    return {name: {'compensations_per_s': round(compensation.throughput(integer), 1)}
+            for name, integer in (('float', False), ('integer', True))}
+
+
+def bench_render(rounds):
+    streamed = render.Template(os.path.join(PROJECT, 'index.html'))
+    cached = render.Template(os.path.join(PROJECT, 'index.html'), cache=True)
+    writer = render.NullWriter()
+    results = {}
+    for name, fn in (('streamed', lambda: render.run(streamed.stream(writer, render.VALUES))),
+                     ('cached', lambda: render.run(cached.stream(writer, render.VALUES, key=1)))):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = clock()
+        for x in range(rounds):
+            fn()
+        elapsed = clock() - start
+        peak = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        results[name] = {'us_per_render': round(elapsed / rounds * 1000000, 2),
+                         'peak_heap_bytes': peak}
+    return results
+
+
+class MemoryReader:
+    """Stream reader over a request held in memory"""
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    async def readline(self):
+        return self._data.readline()
+
+    async def read(self, n=-1):
+        return self._data.read(n)
+
+    async def readexactly(self, n):
+        data = self._data.read(n)
+        if len(data) < n:
+            raise EOFError('incomplete read')
+        return data
+
+    async def readinto(self, buf):
+        return self._data.readinto(buf)
+
+
+class CountingWriter(render.NullWriter):
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def bench_requests(server, rounds):
+    """Service time and peak heap per request, after the state of a booted server"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.setup()
+    sensor = server.sensors[0]
+    reading = sensor.driver.read_all()
+    for n in range(3):
+        timestamp = int(time.time()) - (2 - n) * 15
+        sensor.sampler.add(timestamp, reading)
+        sensor.stats.add(timestamp, sensor.sampler.latest()[1:])
+    # The default range counts back from now, it has to be answered from a rollup level
+    now = int(time.time())
+    for start, step in ((now - 86400, 3600), (now - 604800, 3600)):
+        if sensor.rollups.level_for(start, step, sensor.log.record(0)[0]) is None:
+            raise RuntimeError(f'from={start - now}&step={step} reads the raw samples')
+
+    async def measure(route):
+        request = f'GET {route} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n'.encode()
+        writer = CountingWriter()
+        await server.handle_client(MemoryReader(request), writer)   # Fills caches
+        times = []
+        for x in range(rounds):
+            writer = CountingWriter()
+            start = clock()
+            await server.handle_client(MemoryReader(request), writer)
+            times.append(clock() - start)
+        # Heap separately, tracing slows everything down
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        await server.handle_client(MemoryReader(request), CountingWriter())
+        peak = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        return dict(latency_summary(times), bytes=writer.sent, peak_heap_bytes=peak)
+
+    async def measure_all():
+        return {route: await measure(route) for route in ROUTES}
+
+    with contextlib.redirect_stdout(io.StringIO()):     # The server logs every request
+        return asyncio.run(measure_all())
+
+
+async def request(reader, writer, route):
+    """Send one GET on a keep-alive connection and read the whole response, returns the
+       body size"""
+    writer.write(f'GET {route} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+    await writer.drain()
+    status = await reader.readline()
+    if not status.startswith(b'HTTP/1.1 200'):
+        raise OSError(f'{route}: {status!r}')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+        return int(headers['content-length'])
+    size = 0
+    while True:     # Chunked
+        length = int((await reader.readline()).strip(), 16)
+        await reader.readexactly(length + 2)
+        if not length:
+            return size
+        size += length
+
+
+async def client(port, route, count, latencies, connects):
+    """One keep-alive client. Its first request is timed from before the connect, so a
+       connection stalled in the listen backlog shows in the latencies."""
+    start = clock()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    connects.append(clock() - start)
+    received = 0
+    try:
+        for n in range(count):
+            received += await request(reader, writer, route)
+            latencies.append(clock() - start)
+            start = clock()
+    finally:
+        writer.close()
+    return received
+
+
+async def load(port, route, clients, count):
+    latencies = []
+    connects = []
+    start = clock()
+    results = await asyncio.gather(*[client(port, route, count, latencies, connects)
+                                     for n in range(clients)], return_exceptions=True)
+    elapsed = clock() - start
+    errors = [result for result in results if isinstance(result, BaseException)]
+    received = sum(result for result in results if not isinstance(result, BaseException))
+    return dict(latency_summary(latencies), connect=latency_summary(connects),
+                clients=clients, requests=len(latencies),
+                errors=len(errors), requests_per_s=round(len(latencies) / elapsed, 1),
+                mb_per_s=round(received / elapsed / 1000000, 3))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_boot(port, process, timeout=60):
+    """Wait until the server has logged its first sample"""
+    deadline = clock() + timeout
+    while clock() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as s:
+                s.sendall(b'GET /api/boot HTTP/1.0\r\n\r\n')
+                if b'first sample' in s.recv(1024):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('server did not boot')
+
+
+def bench_load(root, load_spec):
+    port = free_port()
+    command = [sys.executable, '-m', 'sim', '--port', str(port), '--root', root,
+               '--ntp-port', str(free_port()), '--connect-delay', '0']
+    for name, value in SETTINGS.items():
+        command += ['--set', f'{name}={value!r}']
+    process = subprocess.Popen(command, cwd=PROJECT, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        wait_for_boot(port, process)
+        results = {}
+        for route, concurrency, count in load_spec:
+            results[route] = [asyncio.run(load(port, route, clients, count))
+                              for clients in concurrency]
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark suite, results as JSON')
+    parser.add_argument('--output', help='JSON file, standard output by default')
+    parser.add_argument('--quick', action='store_true', help='fewer rounds and a smaller log')
+    parser.add_argument('--skip', action='append', default=[],
+                        choices=('sensor', 'compensation', 'render', 'requests', 'load'))
+    args = parser.parse_args(argv)
+    scale = 10 if args.quick else 1
+    for name, value in SETTINGS.items():
+        setattr(config, name, value)
+
+    root = tempfile.mkdtemp(prefix='bme680-bench-')
+    results = {'version': VERSION, 'timestamp': int(time.time()),
+               'python': sys.version.split()[0], 'platform': sys.platform}
+    try:
+        prepare_root(root)
+        seed_log(root, LOG_RECORDS // scale)
+        sections = (
+            ('sensor', lambda: bench_sensor(2000 // scale)),
+            ('compensation', bench_compensation),
+            ('render', lambda: bench_render(1000 // scale)),
+            ('requests', lambda: bench_requests(load_server(root), 50 // scale)),
+            ('load', lambda: bench_load(root, [(route, clients, max(1, count // scale))
+                                               for route, clients, count in LOAD])),
+        )
+        for name, run in sections:
+            if name in args.skip:
+                continue
+            print(f'{name}...', file=sys.stderr)
+            results[name] = run()
+    finally:
+        os.chdir(PROJECT)
+        shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+def load_server(root):
+    """bme680_server, working in 'root'"""
+    os.chdir(root)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import bme680_server
+    return bme680_server
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
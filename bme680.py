@@ -36,8 +36,9 @@ MicroPython driver from BME680 air quality sensor, based on Adafruit_bme680
 
 import time
 import math
+import json
 from micropython import const
-from ubinascii import hexlify as hex
+from ubinascii import hexlify as hex, crc32
 try:
     import struct
 except ImportError:
@@ -50,6 +51,8 @@ _BME680_CHIPID = const(0x61)
 _BME680_REG_CHIPID = const(0xD0)
 _BME680_BME680_COEFF_ADDR1 = const(0x89)
 _BME680_BME680_COEFF_ADDR2 = const(0xE1)
+_BME680_PAR_T2 = const(0x8A)    # par_t2 and par_t3, compared with a cached calibration
+_BME680_PAR_T1 = const(0xE9)
 _BME680_BME680_RES_HEAT_0 = const(0x5A)
 _BME680_BME680_GAS_WAIT_0 = const(0x64)
 
@@ -70,6 +73,28 @@ _BME680_SAMPLERATES = (0, 1, 2, 4, 8, 16)
 _BME680_FILTERSIZES = (0, 1, 3, 7, 15, 31, 63, 127)
 
 _BME680_RUNGAS = const(0x10)
+_BME680_HEATER_STEPS = const(10)    # Heater set-points, res_heat_0..9 and gas_wait_0..9
+_BME680_HEATER_MAX_TEMP = const(400)
+
+# Gas heater profile after reset: (target temperature in C, duration in ms) per step
+DEFAULT_HEATER_PROFILE = ((320, 150),)
+
+# Measurement state machine, see Adafruit_BME680.poll()
+STATE_IDLE = const(0)
+STATE_MEASURING = const(1)
+STATE_READY = const(2)
+_MEASURE_TIMEOUT_MS = const(1000)   # Past the expected duration, before triggering again
+
+# Settings presets: oversampling of temperature, pressure and humidity and the IIR filter
+# size. Duration of a measurement without gas, with gas add the heater step's duration:
+#   low-latency  11 ms, single samples, no filter: fast changes show at once
+#   balanced     33 ms, the driver's defaults
+#   low-noise    60 ms, heavy pressure oversampling and filtering for slow, smooth series
+PRESETS = {
+    'low-latency': (1, 1, 1, 0),
+    'balanced': (8, 4, 2, 3),
+    'low-noise': (8, 16, 4, 15),
+}
 
 _LOOKUP_TABLE_1 = (2147483647.0, 2147483647.0, 2147483647.0, 2147483647.0, 2147483647.0,
                    2126008810.0, 2147483647.0, 2130303777.0, 2147483647.0, 2147483647.0,
@@ -81,6 +106,37 @@ _LOOKUP_TABLE_2 = (4096000000.0, 2048000000.0, 1024000000.0, 512000000.0, 255744
                    500000.0, 250000.0, 125000.0)
 
 
+_LOOKUP_TABLE_1_INT = tuple(int(x) for x in _LOOKUP_TABLE_1)
+_LOOKUP_TABLE_2_INT = tuple(int(x) for x in _LOOKUP_TABLE_2)
+
+
+def _spi_mem_page(register):
+    """Return the SPI memory page holding 'register'"""
+    return 0x10 if register < 0x80 else 0x00
+
+
+def _div(a, b):
+    """Integer division truncating toward zero, like C, for the fixed-point compensation"""
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def _gas_wait_ms(value):
+    """Milliseconds a gas_wait_x register 'value' heats for"""
+    return (value & 0x3F) * (1, 4, 16, 64)[value >> 6]
+
+
+def _gas_wait(duration):
+    """gas_wait_x register value for 'duration' ms: 6 bits of value times 1, 4, 16 or 64"""
+    if duration >= 0xFC0:
+        return 0xFF     # 4032 ms at most
+    factor = 0
+    while duration > 0x3F:
+        duration //= 4
+        factor += 1
+    return duration + factor * 64
+
+
 def _read24(arr):
     """Parse an unsigned 24-bit value as a floating point and return it."""
     ret = 0.0
@@ -91,14 +147,55 @@ def _read24(arr):
     return ret
 
 
+class Reading:
+    """One forced-mode measurement: the compensated values and the raw ADC values behind them.
+
+       :param float temperature: Temperature in degrees celsius
+       :param float pressure: Barometric pressure in hectoPascals
+       :param float humidity: Relative humidity in RH %
+       :param int gas: Gas resistance in ohms
+       :param adc_temp: Raw temperature ADC value
+       :param adc_pres: Raw pressure ADC value
+       :param int adc_hum: Raw humidity ADC value
+       :param int adc_gas: Raw gas ADC value
+       :param int gas_range: Gas range index used for the gas reading
+       :param int gas_step: Heater profile step the gas reading was taken at. Measurements
+         without the heater carry the gas values of the last one with it."""
+    __slots__ = ('temperature', 'pressure', 'humidity', 'gas',
+                 'adc_temp', 'adc_pres', 'adc_hum', 'adc_gas', 'gas_range', 'gas_step')
+
+    def __init__(self, temperature, pressure, humidity, gas,
+                 adc_temp, adc_pres, adc_hum, adc_gas, gas_range, gas_step):
+        self.temperature = temperature
+        self.pressure = pressure
+        self.humidity = humidity
+        self.gas = gas
+        self.adc_temp = adc_temp
+        self.adc_pres = adc_pres
+        self.adc_hum = adc_hum
+        self.adc_gas = adc_gas
+        self.gas_range = gas_range
+        self.gas_step = gas_step
+
+
 class Adafruit_BME680:
     """Driver from BME680 air quality sensor
 
        :param int refresh_rate: Maximum number of readings per second. Faster property reads
-         will be from the previous reading."""
-    def __init__(self, *, refresh_rate=10):
+         will be from the previous reading.
+       :param bool integer: Compensate with Bosch's fixed-point integer formulas instead of
+         floating point. Much cheaper on chips without an FPU such as the RP2040; results
+         agree with the float path well within the sensor's accuracy. Can be changed later
+         through ``integer_compensation``.
+       :param str calibration_cache: File the parsed calibration is kept in. When it is
+         present, passes its checksum, was saved for the same bus address and its
+         temperature coefficients match the chip's, the calibration isn't read from the
+         sensor again."""
+    def __init__(self, *, refresh_rate=10, integer=False, calibration_cache=None):
         """Check the BME680 was found, read the coefficients and enable the sensor for continuous
            reads."""
+        self._shadow = {}   # Last value written to each configuration register
+        self.integer_compensation = integer
         self._write(_BME680_REG_SOFTRESET, [0xB6])
         time.sleep(0.005)
 
@@ -107,11 +204,24 @@ class Adafruit_BME680:
         if chip_id != _BME680_CHIPID:
             raise RuntimeError('Failed to find BME680! Chip ID 0x%x' % chip_id)
 
-        self._read_calibration()
+        if not (calibration_cache and self._load_calibration(calibration_cache, chip_id)):
+            self._read_calibration()
+            if calibration_cache:
+                self._save_calibration(calibration_cache, chip_id)
 
         # set up heater
-        self._write(_BME680_BME680_RES_HEAT_0, [0x73])
-        self._write(_BME680_BME680_GAS_WAIT_0, [0x65])
+        self._heater_steps = 1
+        self._heater_ms = ()    # Heating time per step, as the registers encode it
+        self._heater_step = 0   # Step the next gas measurement runs
+        self._measuring_step = None     # Step the running measurement heats to, or None
+        self._gas_step = 0      # Step of the last gas reading
+        self._measurements = 0
+        self.set_heater_profile(DEFAULT_HEATER_PROFILE)
+
+        self.gas_every = 1
+        """Measurements per gas measurement. The others run without the heater, so they take
+           a few ms instead of the heater duration and hardly any power, and keep the gas
+           values of the last measurement that had them."""
 
         self.sea_level_pressure = 1013.25
         """Pressure in hectoPascals at sea level. Used to calibrate ``altitude``."""
@@ -128,7 +238,11 @@ class Adafruit_BME680:
         self._adc_gas = None
         self._gas_range = None
         self._t_fine = None
+        self._data = None
 
+        self._state = STATE_IDLE
+        self._measure_start = 0
+        self._measure_ms = 0    # Expected duration of the running measurement
         self._last_reading = time.ticks_ms()
         self._min_refresh_time = 1000 // refresh_rate
 
@@ -176,7 +290,7 @@ class Adafruit_BME680:
     @filter_size.setter
     def filter_size(self, size):
         if size in _BME680_FILTERSIZES:
-            self._filter = _BME680_FILTERSIZES[size]
+            self._filter = _BME680_FILTERSIZES.index(size)
         else:
             raise RuntimeError("Invalid size")
 
@@ -184,13 +298,123 @@ class Adafruit_BME680:
     def temperature(self):
         """The compensated temperature in degrees celsius."""
         self._perform_reading()
-        calc_temp = (((self._t_fine * 5) + 128) / 256)
-        return calc_temp / 100
+        return self._compensate_temperature()
 
     @property
     def pressure(self):
         """The barometric pressure in hectoPascals"""
         self._perform_reading()
+        return self._compensate_pressure()
+
+    @property
+    def humidity(self):
+        """The relative humidity in RH %"""
+        self._perform_reading()
+        return self._compensate_humidity()
+
+    @property
+    def altitude(self):
+        """The altitude based on current ``pressure`` vs the sea level pressure
+           (``sea_level_pressure``) - which you must enter ahead of time)"""
+        pressure = self.pressure # in Si units for hPascal
+        return 44330 * (1.0 - math.pow(pressure / self.sea_level_pressure, 0.1903))
+
+    @property
+    def gas(self):
+        """The gas resistance in ohms"""
+        self._perform_reading()
+        return self._compensate_gas()
+
+    def set_heater_profile(self, steps, ambient=25):
+        """Program the gas heater with 1 to 10 (target temperature in C, duration in ms)
+           steps. Forced mode runs one step per gas measurement, each gas measurement takes
+           the next step in turn. 'ambient' is the temperature the heater starts from."""
+        if not 0 < len(steps) <= _BME680_HEATER_STEPS:
+            raise ValueError("Heater profile needs 1 to %d steps" % _BME680_HEATER_STEPS)
+        pairs = []
+        for i, (temperature, duration) in enumerate(steps):
+            pairs.append((_BME680_BME680_RES_HEAT_0 + i,
+                          self._heater_resistance(temperature, ambient)))
+            pairs.append((_BME680_BME680_GAS_WAIT_0 + i, _gas_wait(duration)))
+        self._update_registers(pairs)
+        self._heater_steps = len(steps)
+        self._heater_ms = tuple(_gas_wait_ms(_gas_wait(duration))
+                                for temperature, duration in steps)
+        self._heater_step = 0
+
+    def use_preset(self, name):
+        """Set the oversampling and IIR filter of one of the PRESETS by name"""
+        if name not in PRESETS:
+            raise ValueError("Unknown preset %r" % name)
+        (self.temperature_oversample, self.pressure_oversample, self.humidity_oversample,
+         self.filter_size) = PRESETS[name]
+
+    def duration_ms(self, gas_step=None):
+        """Milliseconds a forced-mode measurement takes with the current oversampling,
+           Bosch's formula, plus the heating time of heater step 'gas_step' when it
+           measures gas. The IIR filter doesn't change it, filtering is done on the data."""
+        cycles = (_BME680_SAMPLERATES[self._temp_oversample]
+                  + _BME680_SAMPLERATES[self._pressure_oversample]
+                  + _BME680_SAMPLERATES[self._humidity_oversample])
+        # 1963 us per conversion cycle, TPH switching, gas measurement, rounding
+        duration = (cycles * 1963 + 477 * 4 + 477 * 5 + 500) // 1000 + 1   # + wake up
+        if gas_step is not None:
+            duration += self._heater_ms[gas_step]
+        return duration
+
+    def remaining_ms(self):
+        """Milliseconds until the running measurement should be done, 0 when it should be
+           or none is running"""
+        if self._state != STATE_MEASURING:
+            return 0
+        return max(0, self._measure_ms - time.ticks_diff(time.ticks_ms(), self._measure_start))
+
+    def _heater_resistance(self, temperature, ambient):
+        """res_heat_x register value that heats the hot plate from 'ambient' to 'temperature'
+           degrees C, Bosch's fixed-point formula"""
+        temperature = min(int(temperature), _BME680_HEATER_MAX_TEMP)
+        gh1, gh2, gh3 = (int(x) for x in self._gas_calibration)
+        heat_val = int(self._heat_val)
+        if heat_val > 127:
+            heat_val -= 256     # Signed, read as a byte
+        var1 = _div(int(ambient) * gh3, 1000) * 256
+        var2 = (gh1 + 784) * _div(_div((gh2 + 154009) * temperature * 5, 100) + 3276800, 10)
+        var3 = var1 + var2 // 2
+        var4 = _div(var3, int(self._heat_range) + 4)
+        var5 = 131 * heat_val + 65536
+        resistance = (_div(var4, var5) - 250) * 34
+        return min(max(_div(resistance + 50, 100), 0), 255)
+
+    def read_all(self):
+        """Perform a single measurement and return every compensated value, plus the raw
+           ADC values it was computed from, as a :class:`Reading`. Blocks until the
+           measurement is done; see ``poll()`` for the non-blocking variant."""
+        self._perform_reading()
+        return Reading(self._compensate_temperature(), self._compensate_pressure(),
+                       self._compensate_humidity(), self._compensate_gas(),
+                       self._adc_temp, self._adc_pres, self._adc_hum, self._adc_gas,
+                       self._gas_range, self._gas_step)
+
+    @property
+    def calibration(self):
+        """The chip's calibration coefficients as the compensation formulas use them, a dict
+           that can be stored as JSON next to captured raw ADC values"""
+        return {'temperature': self._temp_calibration, 'pressure': self._pressure_calibration,
+                'humidity': self._humidity_calibration, 'gas': self._gas_calibration,
+                'heat_range': self._heat_range, 'heat_val': self._heat_val,
+                'sw_err': self._sw_err}
+
+    def _compensate_temperature(self):
+        """Temperature in degrees celsius from the last reading"""
+        if self.integer_compensation:
+            return (((self._t_fine * 5) + 128) >> 8) / 100
+        calc_temp = (((self._t_fine * 5) + 128) / 256)
+        return calc_temp / 100
+
+    def _compensate_pressure(self):
+        """Pressure in hectoPascals from the last reading"""
+        if self.integer_compensation:
+            return self._compensate_pressure_int() / 100
         var1 = (self._t_fine / 2) - 64000
         var2 = ((var1 / 4) * (var1 / 4)) / 2048
         var2 = (var2 * self._pressure_calibration[5]) / 4
@@ -210,10 +434,10 @@ class Adafruit_BME680:
         calc_pres += ((var1 + var2 + var3 + (self._pressure_calibration[6] * 128)) / 16)
         return calc_pres/100
 
-    @property
-    def humidity(self):
-        """The relative humidity in RH %"""
-        self._perform_reading()
+    def _compensate_humidity(self):
+        """Relative humidity in RH % from the last reading"""
+        if self.integer_compensation:
+            return self._compensate_humidity_int() / 1000
         temp_scaled = ((self._t_fine * 5) + 128) / 256
         var1 = ((self._adc_hum - (self._humidity_calibration[0] * 16)) -
                 ((temp_scaled * self._humidity_calibration[2]) / 200))
@@ -235,55 +459,179 @@ class Adafruit_BME680:
             calc_hum = 0
         return calc_hum
 
-    @property
-    def altitude(self):
-        """The altitude based on current ``pressure`` vs the sea level pressure
-           (``sea_level_pressure``) - which you must enter ahead of time)"""
-        pressure = self.pressure # in Si units for hPascal
-        return 44330 * (1.0 - math.pow(pressure / self.sea_level_pressure, 0.1903))
-
-    @property
-    def gas(self):
-        """The gas resistance in ohms"""
-        self._perform_reading()
+    def _compensate_gas(self):
+        """Gas resistance in ohms from the last reading"""
+        if self.integer_compensation:
+            return self._compensate_gas_int()
         var1 = ((1340 + (5 * self._sw_err)) * (_LOOKUP_TABLE_1[self._gas_range])) / 65536
         var2 = ((self._adc_gas * 32768) - 16777216) + var1
         var3 = (_LOOKUP_TABLE_2[self._gas_range] * var1) / 512
         calc_gas_res = (var3 + (var2 / 2)) / var2
         return int(calc_gas_res)
 
+    # Fixed-point versions of the above, after Bosch's BME680 reference driver. Plain ints
+    # throughout, with the calibration preprocessed by _read_calibration().
+
+    def _compensate_pressure_int(self):
+        """Pressure in Pascal from the last reading"""
+        p1, p2, p3, p4, p5, p6, p7, p8, p9, p10 = self._pressure_calibration_int
+        var1 = (self._t_fine >> 1) - 64000
+        var2 = ((((var1 >> 2) * (var1 >> 2)) >> 11) * p6) >> 2
+        var2 = var2 + ((var1 * p5) << 1)
+        var2 = (var2 >> 2) + (p4 << 16)
+        var1 = (((((var1 >> 2) * (var1 >> 2)) >> 13) * (p3 << 5)) >> 3) + ((p2 * var1) >> 1)
+        var1 = var1 >> 18
+        var1 = ((32768 + var1) * p1) >> 15
+        calc_pres = 1048576 - self._adc_pres
+        calc_pres = (calc_pres - (var2 >> 12)) * 3125
+        if calc_pres >= 0x40000000:
+            calc_pres = _div(calc_pres, var1) << 1
+        else:
+            calc_pres = _div(calc_pres << 1, var1)
+        var1 = (p9 * (((calc_pres >> 3) * (calc_pres >> 3)) >> 13)) >> 12
+        var2 = ((calc_pres >> 2) * p8) >> 13
+        var3 = ((calc_pres >> 8) * (calc_pres >> 8) * (calc_pres >> 8) * p10) >> 17
+        return calc_pres + ((var1 + var2 + var3 + (p7 << 7)) >> 4)
+
+    def _compensate_humidity_int(self):
+        """Relative humidity in thousandths of RH % from the last reading"""
+        h1, h2, h3, h4, h5, h6, h7 = self._humidity_calibration_int
+        temp_scaled = ((self._t_fine * 5) + 128) >> 8
+        var1 = (self._adc_hum - h1) - (_div(temp_scaled * h3, 100) >> 1)
+        var2 = (h2 * (_div(temp_scaled * h4, 100) +
+                      _div((temp_scaled * _div(temp_scaled * h5, 100)) >> 6, 100) +
+                      (1 << 14))) >> 10
+        var3 = var1 * var2
+        var4 = ((h6 << 7) + _div(temp_scaled * h7, 100)) >> 4
+        var5 = ((var3 >> 14) * (var3 >> 14)) >> 10
+        var6 = (var4 * var5) >> 1
+        calc_hum = (((var3 + var6) >> 10) * 1000) >> 12
+        if calc_hum > 100000:
+            calc_hum = 100000
+        if calc_hum < 0:
+            calc_hum = 0
+        return calc_hum
+
+    def _compensate_gas_int(self):
+        """Gas resistance in ohms from the last reading"""
+        var1 = ((1340 + (5 * self._sw_err_int)) * _LOOKUP_TABLE_1_INT[self._gas_range]) >> 16
+        var2 = ((self._adc_gas << 15) - 16777216) + var1
+        var3 = (_LOOKUP_TABLE_2_INT[self._gas_range] * var1) >> 9
+        return _div(var3 + (var2 >> 1), var2)
+
+    @property
+    def state(self):
+        """The measurement state machine: ``STATE_IDLE``, ``STATE_MEASURING`` or
+           ``STATE_READY``."""
+        return self._state
+
+    def start_measurement(self):
+        """Configure the sensor and trigger a forced-mode measurement without waiting for it.
+           Check for completion with ``is_ready()`` and fetch the result with ``collect()``."""
+        # temp oversample & pressure oversample, sleep mode
+        ctrl_meas = (self._temp_oversample << 5) | (self._pressure_oversample << 2)
+        # Gas with the next heater step every gas_every measurements, the heater stays off
+        # for the others
+        if self._measurements % self.gas_every == 0:
+            self._measuring_step = self._heater_step
+            ctrl_gas = _BME680_RUNGAS | self._heater_step
+        else:
+            self._measuring_step = None
+            ctrl_gas = 0
+        self._measurements += 1
+        # Only settings that changed since the last measurement cross the bus
+        self._update_registers(((_BME680_REG_CONFIG, self._filter << 2),    # set filter
+                                (_BME680_REG_CTRL_HUM, self._humidity_oversample),
+                                (_BME680_REG_CTRL_GAS, ctrl_gas),
+                                (_BME680_REG_CTRL_MEAS, ctrl_meas)))
+        # enable single shot! The sensor drops back to sleep mode by itself afterwards, so
+        # the shadow copy of CTRL_MEAS stays valid.
+        self._write(_BME680_REG_CTRL_MEAS, [ctrl_meas | 0x01])
+        self._measure_start = time.ticks_ms()
+        self._measure_ms = self.duration_ms(self._measuring_step)
+        self._state = STATE_MEASURING
+
+    def is_ready(self):
+        """Read the status register once and return True when the triggered measurement has
+           finished. Never blocks."""
+        if self._state == STATE_MEASURING:
+            data = self._read(_BME680_REG_MEAS_STATUS, 15)
+            if data[0] & 0x80 != 0:
+                self._data = data
+                self._state = STATE_READY
+        return self._state == STATE_READY
+
+    def collect(self):
+        """Return the finished measurement as a :class:`Reading` and go back to idle."""
+        if not self.is_ready():
+            raise RuntimeError("No measurement ready")
+        self._parse_data()
+        return Reading(self._compensate_temperature(), self._compensate_pressure(),
+                       self._compensate_humidity(), self._compensate_gas(),
+                       self._adc_temp, self._adc_pres, self._adc_hum, self._adc_gas,
+                       self._gas_range, self._gas_step)
+
+    def poll(self):
+        """Advance the measurement state machine by one non-blocking step.
+
+           Starts a measurement when idle and ``refresh_rate`` allows it, checks the status
+           register while measuring, and returns the :class:`Reading` once it is done.
+           Returns None while there is nothing to collect yet."""
+        if self._state == STATE_IDLE:
+            expired = time.ticks_diff(time.ticks_ms(), self._last_reading)
+            if 0 <= expired < self._min_refresh_time:
+                return None
+            self.start_measurement()
+        elif self._state == STATE_MEASURING:
+            if time.ticks_diff(time.ticks_ms(), self._measure_start) > \
+                    self._measure_ms + _MEASURE_TIMEOUT_MS:
+                self.start_measurement()  # Status bit never came up, trigger again
+                return None
+        if self.is_ready():
+            return self.collect()
+        return None
+
     def _perform_reading(self):
         """Perform a single-shot reading from the sensor and fill internal data structure for
            calculations"""
-        expired = time.ticks_diff(self._last_reading, time.ticks_ms()) * time.ticks_diff(0, 1)
-        if 0 <= expired < self._min_refresh_time:
-            time.sleep_ms(self._min_refresh_time - expired)
-
-        # set filter
-        self._write(_BME680_REG_CONFIG, [self._filter << 2])
-        # turn on temp oversample & pressure oversample
-        self._write(_BME680_REG_CTRL_MEAS,
-                    [(self._temp_oversample << 5)|(self._pressure_oversample << 2)])
-        # turn on humidity oversample
-        self._write(_BME680_REG_CTRL_HUM, [self._humidity_oversample])
-        # gas measurements enabled
-        self._write(_BME680_REG_CTRL_GAS, [_BME680_RUNGAS])
-
-        ctrl = self._read_byte(_BME680_REG_CTRL_MEAS)
-        ctrl = (ctrl & 0xFC) | 0x01  # enable single shot!
-        self._write(_BME680_REG_CTRL_MEAS, [ctrl])
-        new_data = False
-        while not new_data:
-            data = self._read(_BME680_REG_MEAS_STATUS, 15)
-            new_data = data[0] & 0x80 != 0
-            time.sleep(0.005)
+        if self._state == STATE_IDLE:
+            expired = time.ticks_diff(self._last_reading, time.ticks_ms()) * time.ticks_diff(0, 1)
+            if 0 <= expired < self._min_refresh_time:
+                time.sleep_ms(self._min_refresh_time - expired)
+            self.start_measurement()
+        # Sleep once for the expected duration, then poll briefly in case the chip is late
+        time.sleep_ms(self.remaining_ms())
+        while not self.is_ready():
+            time.sleep_ms(1)
+        self._parse_data()
+
+    def _parse_data(self):
+        """Convert the raw data block of a finished measurement and return to idle"""
+        data = self._data
+        self._data = None
+        self._state = STATE_IDLE
         self._last_reading = time.ticks_ms()
 
+        self._adc_hum = (data[8] << 8) | data[9]
+        if self._measuring_step is not None:
+            self._adc_gas = (data[13] << 2) | (data[14] >> 6)
+            self._gas_range = data[14] & 0x0F
+            self._gas_step = self._measuring_step
+            self._heater_step = (self._gas_step + 1) % self._heater_steps
+
+        if self.integer_compensation:
+            self._adc_pres = (data[2] << 12) | (data[3] << 4) | (data[4] >> 4)
+            self._adc_temp = (data[5] << 12) | (data[6] << 4) | (data[7] >> 4)
+            t1, t2, t3 = self._temp_calibration_int
+            var1 = (self._adc_temp >> 3) - (t1 << 1)
+            var2 = (var1 * t2) >> 11
+            var3 = ((var1 >> 1) * (var1 >> 1)) >> 12
+            var3 = (var3 * (t3 << 4)) >> 14
+            self._t_fine = var2 + var3
+            return
+
         self._adc_pres = _read24(data[2:5]) / 16
         self._adc_temp = _read24(data[5:8]) / 16
-        self._adc_hum = struct.unpack('>H', bytes(data[8:10]))[0]
-        self._adc_gas = int(struct.unpack('>H', bytes(data[13:15]))[0] / 64)
-        self._gas_range = data[14] & 0x0F
 
         var1 = (self._adc_temp / 8) - (self._temp_calibration[0] * 2)
         var2 = (var1 * self._temp_calibration[1]) / 2048
@@ -310,18 +658,92 @@ class Adafruit_BME680:
         self._humidity_calibration[1] += self._humidity_calibration[0] % 16
         self._humidity_calibration[0] /= 16
 
-        self._heat_range = (self._read_byte(0x02) & 0x30) / 16
-        self._heat_val = self._read_byte(0x00)
-        self._sw_err = (self._read_byte(0x04) & 0xF0) / 16
+        heat = self._read(0x00, 5)
+        self._heat_range = (heat[2] & 0x30) / 16
+        self._heat_val = heat[0]
+        self._sw_err = (heat[4] & 0xF0) / 16
+        self._prepare_calibration()
+
+    def _prepare_calibration(self):
+        """Derive the integer calibration from the parsed float coefficients"""
+        # Integer copies for the fixed-point compensation, H1 pre-scaled by 16 as it is used
+        self._temp_calibration_int = tuple(int(x) for x in self._temp_calibration)
+        self._pressure_calibration_int = tuple(int(x) for x in self._pressure_calibration)
+        humidity = [int(x) for x in self._humidity_calibration]
+        humidity[0] = int(self._humidity_calibration[0] * 16)
+        self._humidity_calibration_int = tuple(humidity)
+        self._sw_err_int = int(self._sw_err)
+
+    def _temperature_coefficients(self):
+        """Read par_t1, par_t2 and par_t3 from the chip, 5 bytes instead of the 41 of the
+           whole calibration"""
+        t2, t3 = struct.unpack('<hb', bytes(self._read(_BME680_PAR_T2, 3)))
+        t1 = struct.unpack('<H', bytes(self._read(_BME680_PAR_T1, 2)))[0]
+        return [float(t1), float(t2), float(t3)]
+
+    def _save_calibration(self, path, chip_id):
+        """Store the parsed calibration, chip ID and bus address in 'path', behind a CRC32
+           line"""
+        text = json.dumps({'chip_id': chip_id, 'device': self._device,
+                           'calibration': self.calibration})
+        try:
+            with open(path, 'w') as f:
+                f.write('%08x\n%s' % (crc32(text.encode()), text))
+        except OSError as e:
+            print(f'Could not save the BME680 calibration: {e}')
+
+    def _load_calibration(self, path, chip_id):
+        """Restore the calibration saved in 'path'. Returns False, leaving the calibration
+           unset, when the file is missing, corrupt or from another chip. The chip ID is the
+           same for every BME680, so the file also has to be for this bus address, and the
+           temperature coefficients read back from the chip have to match it."""
+        try:
+            with open(path, 'r') as f:
+                checksum, _, text = f.read().partition('\n')
+            if int(checksum, 16) != crc32(text.encode()):
+                raise ValueError('checksum mismatch')
+            saved = json.loads(text)
+            calibration = saved['calibration']
+            if saved['chip_id'] != chip_id or saved.get('device') != self._device or \
+                    self._temperature_coefficients() != calibration['temperature']:
+                print('Saved BME680 calibration is from another sensor, reading it again')
+                return False
+            self._temp_calibration = calibration['temperature']
+            self._pressure_calibration = calibration['pressure']
+            self._humidity_calibration = calibration['humidity']
+            self._gas_calibration = calibration['gas']
+            self._heat_range = calibration['heat_range']
+            self._heat_val = calibration['heat_val']
+            self._sw_err = calibration['sw_err']
+        except OSError:
+            return False    # Not saved yet
+        except (ValueError, KeyError, TypeError) as e:
+            print(f'Saved BME680 calibration not usable ({e}), reading it again')
+            return False
+        self._prepare_calibration()
+        return True
+
+    def _update_registers(self, pairs):
+        """Burst write the (register, value) pairs whose value differs from the shadow copy"""
+        changed = [(register, value) for register, value in pairs
+                   if self._shadow.get(register) != value]
+        if changed:
+            self._write_pairs(changed)
+            for register, value in changed:
+                self._shadow[register] = value
 
     def _read_byte(self, register):
         """Read a byte register value and return it"""
         return self._read(register, 1)[0]
 
+    def _write(self, register, values):
+        """Writes an array of 'length' bytes to consecutive registers from 'register'"""
+        self._write_pairs([(register + i, value) for i, value in enumerate(values)])
+
     def _read(self, register, length):
         raise NotImplementedError()
 
-    def _write(self, register, values):
+    def _write_pairs(self, pairs):
         raise NotImplementedError()
 
 class BME680_I2C(Adafruit_BME680):
@@ -332,12 +754,15 @@ class BME680_I2C(Adafruit_BME680):
         :param bool debug: Print debug statements when True.
         :param int refresh_rate: Maximum number of readings per second. Faster property reads
           will be from the previous reading."""
-    def __init__(self, i2c, address=0x77, debug=False, *, refresh_rate=10):
+    def __init__(self, i2c, address=0x77, debug=False, *, refresh_rate=10, integer=False,
+                 calibration_cache=None):
         """Initialize the I2C device at the 'address' given"""
         self._i2c = i2c
         self._address = address
+        self._device = 'i2c 0x%02x' % address  # Identifies the sensor's calibration cache
         self._debug = debug
-        super().__init__(refresh_rate=refresh_rate)
+        super().__init__(refresh_rate=refresh_rate, integer=integer,
+                         calibration_cache=calibration_cache)
 
     def _read(self, register, length):
         """Returns an array of 'length' bytes from the 'register'"""
@@ -347,13 +772,15 @@ class BME680_I2C(Adafruit_BME680):
             print("\t${:x} read ".format(register), " ".join(["{:02x}".format(i) for i in result]))
         return result
 
-    def _write(self, register, values):
-        """Writes an array of 'length' bytes to the 'register'"""
+    def _write_pairs(self, pairs):
+        """Writes (register, value) pairs in a single burst transaction"""
+        buffer = bytearray(2 * len(pairs))
+        for i, (register, value) in enumerate(pairs):
+            buffer[2 * i] = register & 0xFF
+            buffer[2 * i + 1] = value & 0xFF
         if self._debug:
-            print("\t${:x} write".format(register), " ".join(["{:02x}".format(i) for i in values]))
-        for value in values:
-            self._i2c.writeto_mem(self._address, register, bytearray([value & 0xFF]))
-            register += 1
+            print("\twrite", " ".join(["{:02x}".format(i) for i in buffer]))
+        self._i2c.writeto(self._address, buffer)
 
 
 class BME680_SPI(Adafruit_BME680):
@@ -366,12 +793,16 @@ class BME680_SPI(Adafruit_BME680):
           will be from the previous reading.
       """
 
-    def __init__(self, spi, cs, debug=False, *, refresh_rate=10):
+    def __init__(self, spi, cs, debug=False, *, refresh_rate=10, integer=False,
+                 calibration_cache=None):
         self._spi = spi
         self._cs = cs
+        self._device = 'spi %s' % cs    # Pin repr with the GPIO, see the calibration cache
         self._debug = debug
+        self._spi_mem_page = None   # Currently selected memory page, None when unknown
         self._cs(1)
-        super().__init__(refresh_rate=refresh_rate)
+        super().__init__(refresh_rate=refresh_rate, integer=integer,
+                         calibration_cache=calibration_cache)
 
     def _read(self, register, length):
         if register != _BME680_REG_PAGE_SELECT:
@@ -394,28 +825,46 @@ class BME680_SPI(Adafruit_BME680):
             self._cs(1)
         return result
 
-    def _write(self, register, values):
+    def _write_pairs(self, pairs):
+        # Registers on different memory pages need separate transactions
+        start = 0
+        while start < len(pairs):
+            end = start + 1
+            while end < len(pairs) and _spi_mem_page(pairs[end][0]) == _spi_mem_page(pairs[start][0]):
+                end += 1
+            self._write_page(pairs[start:end])
+            start = end
+
+    def _write_page(self, pairs):
+        """Write the (register, value) 'pairs', all of one memory page, in one burst.
+           Returns False when the write failed."""
+        register = pairs[0][0]
         if register != _BME680_REG_PAGE_SELECT:
             # _BME680_REG_PAGE_SELECT exists in both SPI memory pages
             # For all other registers, we must set the correct memory page
             self._set_spi_mem_page(register)
-        register &= 0x7F  # Write, bit 7 low.
         try:
             self._cs(0)
-            buffer = bytearray(2 * len(values))
-            for i, value in enumerate(values):
-                buffer[2 * i] = register + i
+            buffer = bytearray(2 * len(pairs))
+            for i, (register, value) in enumerate(pairs):
+                buffer[2 * i] = register & 0x7F  # Write, bit 7 low.
                 buffer[2 * i + 1] = value & 0xFF
             self._spi.write(buffer)  # pylint: disable=no-member
             if self._debug:
-                print("\t${:x} write".format(register), " ".join(["{:02x}".format(i) for i in values]))
+                print("\twrite", " ".join(["{:02x}".format(i) for i in buffer]))
         except Exception as e:
             print (e)
+            self._spi_mem_page = None
+            return False
         finally:
             self._cs(1)
+        if pairs[0][0] == _BME680_REG_SOFTRESET:
+            self._spi_mem_page = None   # Reset returns to page 0, don't trust the cache
+        return True
 
     def _set_spi_mem_page(self, register):
-        spi_mem_page = 0x00
-        if register < 0x80:
-            spi_mem_page = 0x10
-        self._write(_BME680_REG_PAGE_SELECT, [spi_mem_page])
+        spi_mem_page = _spi_mem_page(register)
+        if spi_mem_page != self._spi_mem_page:
+            # Only a page select that went through is cached, else the next access retries
+            if self._write_page(((_BME680_REG_PAGE_SELECT, spi_mem_page),)):
+                self._spi_mem_page = spi_mem_page
@@ -4,44 +4,64 @@ Hosted on a Raspberry Pi Pico W
 
 Displays BME680 sensor readings on
 a graphical html web page.
+
+Runs on uasyncio: every client connection is its own task, so a slow
+client no longer holds up the others, and sensor sampling and sample
+logging run as separate background tasks. Handlers never read the
+sensors themselves, they use the samplers' latest readings.
+
+Several sensors can be configured, see sensors.py. Every sensor has its
+own log, rollups and statistics; the dashboard and the API answer for
+the first one, or the one named by a 'sensor' query parameter.
 """
 
 import uos
-from machine import Pin, I2C
+from machine import Pin
 import wlan_setup
-from bme680 import *
-import socket
-import select
 import time
-import math
 import ntp_client as ntp
+import config
+from sensors import Scheduler, load, open_sensors
+from template import Template
+from http_util import content_type, send_headers, send_response, send_chunks, parse_query
+from http_request import RequestReader, RequestError
+import http_request
+import static
+import tsdb
+import rollup
+import query
+import api
+import events
+import stats
+import instrument
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 # Initialize global variables
-get_media_req = False       # Toggle var for switch between html and media transfer
 days = 0                    # Counter for days of runtime, Pico W resets system time every 24H
 led = Pin("LED", Pin.OUT)   # activity led
-request  = ''               # Request buffer
-response = ''               # Response buffer
-recv_buf = ''               # Socket receive buffer
-cl   = None
-addr = None
-fieldnames = ['date', 'time', 'Temp_C', 'Temp_F', 'Humidity', 'Pressure', 'Gas', 'AQI']     # CSV
-min_temp    = 99999.9
-min_humid   = 99999.9
-min_press   = 99999.9
-min_gas     = 99999.9
-min_aqi     = 99999.9
-max_temp    = -1.0
-max_humid   = -1.0
-max_press   = -1.0
-max_gas     = -1.0
-max_aqi     = -1.0
-
-
-# Check string for whole word using space as delimiter 
-def contains_word(st, wd, sep=' '):
-    sep = sep.encode('ascii')  # Convert str to bytes
-    return (sep + wd + sep) in (sep + st + sep)
+sensors = []                # Configured sensors with their samplers and storage, the first
+                            # is the default
+sensor_names = {}           # The same by name
+scheduler = None            # Samples all sensors in the background
+metric_samplers = ()        # (name as bytes, sampler) per sensor, for /metrics
+page = None                 # Dashboard template, index.html
+assets = None               # Static asset cache, icons and manifest
+broadcaster = None          # Pushes each new sample to the /events subscribers
+connections = 0             # Open client connections
+requests_served = 0         # Requests answered since boot
+request_errors = 0          # Requests failed or refused since boot
+start_timestamp = 0
+download_token = 0
+boot_ticks = time.ticks_ms()    # Startup, for the boot-phase timing report
+boot_phases = []            # (phase, ms since startup) in the order they completed
+
+
+# Note the end of a startup phase for the boot report
+def boot_phase(name):
+    boot_phases.append((name, time.ticks_diff(time.ticks_ms(), boot_ticks)))
 
 
 # Function convert second into day
@@ -61,324 +81,518 @@ def seconds_to_time(n):
     return [seconds, minutes, hour, day]
 
 
-def write_to_csv(fieldnames, rows):
-    # Check for existing stats.csv file, create a new one if not found
-    try:
-        f = open('stats.csv', 'r')
-    except OSError as e:
-        print(f'CSV may not exist: {e}')
-        print('Creating new csv...')
-        try:
-            with open('stats.csv', 'w') as f:
-                for x in fieldnames:
-                    f.write(x)
-                    if x == fieldnames[-1]:
-                        f.write('\r\n')
-                    else:
-                        f.write(',')
-        except TypeError as e:
-            print(f'TypeError writing headers to csv: {e}')
-        except NameError as e:
-            print(e)
-    finally:
-        try:
-            f.close()
-        except OSError as e:
-            print(f'CSV may not exist: {e}')
-
-    # Append sensor readings to csv
-    try:
-        with open('stats.csv', 'a') as f:
-            for x in rows:
-                f.write(str(x))
-                if x == rows[-1]:
-                    f.write('\r\n')
-                else:
-                    f.write(',')
-        csv_sample = now
-        print("Done.")
-    except TypeError as e:
-        print(f'TypeError appending to csv: {e}')
-    except NameError as e:
-        print(f'NameError appending to csv: {e}')
-
-
-led.on()
-
-# Print hardware info
-print()
-print("Machine: \t" + uos.uname()[4])
-print("MicroPython: \t" + uos.uname()[3])
+# Latest sample from a sensor's sampler, rounded as shown on the page
+def sample_values(sampler):
+    timestamp, temperature, humid, press, gas, aqi = sampler.latest()
+    temperature_f = round(((temperature * 9 / 5) + 32), 2)
+    return (round(temperature, 2), temperature_f, round(humid, 2), round(press, 2),
+            round(gas, 2), round(aqi, 2))
 
-# Initializing the I2C method 
-i2c=I2C(0, scl=Pin(17), sda=Pin(16), freq=400000)
-bme = BME680_I2C(i2c=i2c)
 
-# Initialize and connect wireless lan
-wlan_setup.connect()
-
-# Sync NTP Online
-ntp.setup()
-start_timestamp = time.mktime(time.localtime())     # Program start time
-csv_sample = start_timestamp
-download_token = start_timestamp
-
-# Initialize listen socket
-addr = socket.getaddrinfo('0.0.0.0', 80)[0][-1]
-s = socket.socket()
-s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-s.settimeout(30.0)
-s.bind(addr)
-s.listen(3)
-
-led.off()
-
-poller = select.poll()
-poller.register(s, select.POLLIN)
+# Sample logging task, stores the latest sample of every sensor every config.LOG_INTERVAL
+# seconds
+async def log_samples():
+    while True:
+        await asyncio.sleep(config.LOG_INTERVAL)
+        print("Writing sensor values to log...")
+        for sensor in sensors:
+            sampler = sensor.sampler
+            if not sampler.count:
+                continue    # Not sampled since boot
+            sample = sampler.latest()
+            sensor.log.append(*sample)
+            sensor.rollups.add(sample[0], sample[1:])
+            if sensor.raw_log is not None:
+                reading = sampler.reading
+                sensor.raw_log.append(sample[0], reading.adc_temp, reading.adc_pres,
+                                      reading.adc_hum, reading.adc_gas, reading.gas_range,
+                                      reading.gas_step)
+        print("Done.")
 
-for x in range(5):  # Warm up sensor before reporting readings
-    led.on()
-    temperature = round(bme.temperature, 2)
-    temperature_f = round(((bme.temperature * 9 / 5) + 32), 2)
-    humid = round(bme.humidity, 2)
-    press = round(bme.pressure, 2)
-    gas = round(bme.gas / 1000, 2)
-    aqi = round((math.log(round(bme.gas / 1000, 2)) + 0.04 * round(bme.humidity, 2)), 2)
-    led.off()
-    time.sleep_us(10)
 
-# Networking initialized, start listening for connections
-print('Listening for connections...')
-while True:
-    # Poll for new connection request
+# Statistics task, adds every sample to its sensor's rolling windows and checkpoints them to
+# flash every config.STATS_CHECKPOINT seconds
+async def update_stats():
+    saved = time.ticks_ms()
+    while True:
+        await scheduler.wait()
+        for sensor in scheduler.sampled:
+            sample = sensor.sampler.latest()
+            sensor.stats.add(sample[0], sample[1:])
+        if time.ticks_diff(time.ticks_ms(), saved) >= config.STATS_CHECKPOINT * 1000:
+            for sensor in sensors:
+                sensor.stats.save()
+            saved = time.ticks_ms()
+
+
+# Rounded (min, max) of a sampler field over the dashboard's statistics window
+def extremes(sensor, field, current):
+    summary = sensor.stats.window(config.STATS_PAGE_WINDOW).summary(field)
+    if summary is None:
+        return current, current     # First sample not added yet
+    return round(summary[1], 2), round(summary[2], 2)
+
+
+# (mins, maxs) of the sample values over the dashboard's statistics window, the latest
+# 'sample' included as the stats task may not have added it yet
+def window_extremes(sensor, sample):
+    window = sensor.stats.window(config.STATS_PAGE_WINDOW)
+    mins, maxs = list(sample[1:]), list(sample[1:])
+    for field in range(stats.NUM_VALUES):
+        summary = window.summary(field)
+        if summary is not None:
+            mins[field] = min(mins[field], summary[1])
+            maxs[field] = max(maxs[field], summary[2])
+    return mins, maxs
+
+
+# Event publishing task, pushes every new sample with the window's extremes to the open
+# dashboards, which pick their sensor's
+async def publish_samples():
+    while True:
+        await scheduler.wait()
+        for sensor in scheduler.sampled:
+            sampler = sensor.sampler
+            sample = sampler.latest()
+            await broadcaster.publish(bytes(api.current(
+                sample, (sensor.name, sampler.count, 'event'), sensor.name, sampler.gas_steps,
+                window_extremes(sensor, sample))))
+
+
+# Values for the index.html placeholders before the first sample
+def warming_values(sensor):
+    values = {name: '--' for name in page.names}
+    values.update({'HOST': wlan_setup.getIp(), 'SENSOR': sensor.name, 'TOKEN': download_token,
+                   'START': start_timestamp, 'DATE': 'Sensor warming up', 'TIME': '',
+                   'RUNTIME': '--'})
+    return values
+
+
+# Values for the index.html placeholders, from the latest sample of 'sensor'
+def page_values(sensor):
+    global download_token
+
+    # Date and time of the sample
+    timestamp = sensor.sampler.timestamp()
+    year, month, mday, hour, minute, second, weekday, yearday = time.localtime(timestamp)[:8]
+    runtime = seconds_to_time((timestamp-start_timestamp))
+
+    temperature, temperature_f, humid, press, gas, aqi = sample_values(sensor.sampler)
+    print(f'\nIncoming connection --> sending webpage of {sensor.name}')
+    print('Temperature:', temperature, 'C')
+    print('Humidity:', humid, '%')
+    print('Pressure:', press, 'hPa')
+    print('Gas:', gas, 'KOhms')
+    print('AQI:', aqi)
+    print('-------\n')
+
+    # Extremes over the statistics window, kept by the stats task
+    min_temp, max_temp = extremes(sensor, stats.TEMPERATURE, temperature)
+    min_temp, max_temp = round(min_temp * 9 / 5 + 32, 2), round(max_temp * 9 / 5 + 32, 2)
+    min_humid, max_humid = extremes(sensor, stats.HUMIDITY, humid)
+    min_press, max_press = extremes(sensor, stats.PRESSURE, press)
+    min_gas, max_gas = extremes(sensor, stats.GAS, gas)
+    min_aqi, max_aqi = extremes(sensor, stats.AQI, aqi)
+
+    download_token = timestamp  # Refresh download token to avoid stale download cache
+
+    return {
+        'HOST': wlan_setup.getIp(),
+        'SENSOR': sensor.name,
+        'TEMP_F': temperature_f, 'TEMP_C': temperature,
+        'MIN_TEMP': min_temp, 'MAX_TEMP': max_temp,
+        'HUMIDITY': humid, 'MIN_HUMID': min_humid, 'MAX_HUMID': max_humid,
+        'AQI': aqi, 'MIN_AQI': min_aqi, 'MAX_AQI': max_aqi,
+        'GAS': gas, 'MIN_GAS': min_gas, 'MAX_GAS': max_gas,
+        'PRESSURE': press, 'MIN_PRESS': min_press, 'MAX_PRESS': max_press,
+        'TOKEN': download_token,
+        'START': start_timestamp,
+        'DATE': f'{month}-{mday}-{year}',
+        'TIME': f'{(hour-12) if hour > 12 else hour }:{minute}:{second}',
+        'RUNTIME': f'{int(runtime[3])} days {int(runtime[2])} hours {int(runtime[1])} minutes {int(runtime[0])} seconds',
+    }
+
+
+# The sensor named by the request's 'sensor' parameter, the first sensor without one.
+# None when there is no such sensor.
+def requested_sensor(request, params=None):
+    if params is None:
+        if '?' not in request.target:
+            return sensors[0]
+        params = parse_query(request.target)
+    name = params.get('sensor')
+    return sensor_names.get(name) if name else sensors[0]
+
+
+async def send_unknown_sensor(writer, keep_alive):
+    await send_response(writer, '404 Not Found', 'text/plain', b'Unknown sensor', 0,
+                        keep_alive)
+    return keep_alive
+
+
+# Readings between two times, downsampled to min/max/mean per step, as JSON or CSV.
+# 'from' and 'to' are Unix times, negative values count back from now. Returns False
+# when the connection has to be closed after the response.
+async def send_readings(writer, request, keep_alive):
+    params = parse_query(request.target)
+    sensor = requested_sensor(request, params)
+    if sensor is None:
+        return await send_unknown_sensor(writer, keep_alive)
+    now = int(time.time())
     try:
-        evts = poller.poll(1000)  # Poll for 1 sec (1000ms)
-        for sock, evt in evts:
-            if evt and select.POLLIN:
-                    led.on()
-                    cl, addr = s.accept()
-                    cl_file = cl.makefile('rwb', 0)
-                    recv_buf = cl_file.readline()
-        if len(evts) < 1:   # No connection request
-            now = time.mktime(time.localtime())
-            if (now - csv_sample) > 1800:   # Update CSV every 30min (1800 sec)
-                # Update current date and time
-                year, month, mday, hour, minute, second, weekday, yearday = time.localtime()
-                date = f'{month}/{mday}/{year}'
-                time_now = f'{hour}:{minute}:{second}'
-                runtime = seconds_to_time((now - start_timestamp))
-
-                for x in range(5):  # Warm up sensor before reporting readings
-                    temperature = round(bme.temperature, 2)
-                    temperature_f = round(((bme.temperature * 9 / 5) + 32), 2)
-                    humid = round(bme.humidity, 2)
-                    press = round(bme.pressure, 2)
-                    gas = round(bme.gas / 1000, 2)
-                    aqi = round((math.log(round(bme.gas / 1000, 2)) + 0.04 * round(bme.humidity, 2)), 2)
-                    time.sleep_us(10)
-
-                print("Writing sensor values to csv...")
-                rows = [
-                    date,
-                    time_now,
-                    temperature,
-                    temperature_f,
-                    humid,
-                    press,
-                    gas,
-                    aqi
-                ]
-                write_to_csv(fieldnames, rows)
-                csv_sample = now
-            continue
+        start = int(params.get('from', -86400))
+        stop = int(params.get('to', now))
+        step = int(params.get('step', 3600))
+    except ValueError:
+        start = stop = step = 0
+    if start < 0:
+        start += now
+    if stop < 0:
+        stop += now
+    stop += 1   # 'to' is inclusive
+    output = params.get('format', 'json')
+    if step < 1 or stop <= start or (stop - start) // step > config.MAX_QUERY_BUCKETS \
+            or output not in ('json', 'csv'):
+        await send_response(writer, '400 Bad Request', 'text/plain', b'Bad Request', 0,
+                            keep_alive)
+        return keep_alive
+    rows = query.buckets(sensor.log, start, stop, step, sensor.rollups)
+    if output == 'csv':
+        chunks, mime = query.csv_chunks(rows), 'text/csv'
+    else:
+        chunks, mime = query.json_chunks(rows, start, stop - 1, step), 'application/json'
+    return await send_chunks(writer, '200 OK', mime, chunks, 0, keep_alive,
+                             request.version != 'HTTP/1.0')
+
+
+# Request handlers, see ROUTES. Each answers one request and returns False when the
+# connection has to be closed afterwards.
+
+async def send_page(writer, request, keep_alive):
+    sensor = requested_sensor(request)
+    if sensor is None:
+        return await send_unknown_sensor(writer, keep_alive)
+    if sensor.sampler.count:
+        # The page only changes with a new sample, skip the values when it is cached
+        key = (sensor.name, sensor.sampler.count)
+        values = None if page.cached(key) else page_values(sensor)
+        max_age = 60
+    else:
+        key, values, max_age = None, warming_values(sensor), 0     # Not cached, updates by itself
+    await asyncio.wait_for(page.stream(
+        writer, values, key=key,
+        send_headers=lambda length: send_headers(writer, '200 OK', 'text/html', length,
+                                                 max_age, keep_alive)),
+        config.CONNECTION_TIMEOUT)
+    return keep_alive
+
+
+# Scraped often, answered from the cached sample without logging
+async def send_current(writer, request, keep_alive):
+    sensor = requested_sensor(request)
+    if sensor is None:
+        return await send_unknown_sensor(writer, keep_alive)
+    sampler = sensor.sampler
+    if not sampler.count:
+        await send_response(writer, '503 Service Unavailable', 'application/json',
+                            b'{"error":"warming up"}', 0, keep_alive, 'Retry-After: 5\r\n')
+    else:
+        await send_response(writer, '200 OK', 'application/json',
+                            api.current(sampler.latest(), (sensor.name, sampler.count),
+                                        sensor.name, sampler.gas_steps), 0, keep_alive)
+    return keep_alive
+
+
+# Every sensor, labelled by name
+async def send_metrics(writer, request, keep_alive):
+    body = api.metrics(metric_samplers, requests_served, request_errors, connections,
+                       int(time.time()) - start_timestamp)
+    await send_response(writer, '200 OK', 'text/plain; version=0.0.4', body, 0, keep_alive)
+    return keep_alive
+
+
+async def send_stats(writer, request, keep_alive):
+    sensor = requested_sensor(request)
+    if sensor is None:
+        return await send_unknown_sensor(writer, keep_alive)
+    await send_response(writer, '200 OK', 'application/json',
+                        api.stats_json(sensor.stats.windows, sensor.name), 0, keep_alive)
+    return keep_alive
+
+
+async def send_sensors(writer, request, keep_alive):
+    await send_response(writer, '200 OK', 'application/json', api.sensors_json(sensors), 0,
+                        keep_alive)
+    return keep_alive
+
+
+async def send_debug_stats(writer, request, keep_alive):
+    await send_response(writer, '200 OK', 'application/json',
+                        instrument.stats_json(requests_served, request_errors, connections),
+                        0, keep_alive)
+    return keep_alive
+
+
+async def send_boot(writer, request, keep_alive):
+    body = ','.join('"%s":%d' % phase for phase in boot_phases)
+    await send_response(writer, '200 OK', 'application/json',
+                        ('{%s}' % body).encode('ascii'), 0, keep_alive)
+    return keep_alive
+
+
+# Held open until the broadcaster drops it, the page updates itself from it
+async def send_events(writer, request, keep_alive):
+    return await broadcaster.subscribe(writer, keep_alive)
+
+
+async def delete_log(writer, request, keep_alive):
+    print(f'{request.path} Requested')
+    sensor = requested_sensor(request)
+    if sensor is None:
+        return await send_unknown_sensor(writer, keep_alive)
+    # Deleting history changes state, so only a POST from the dashboard form may do it
+    if request.method != 'POST':
+        await send_response(writer, '405 Method Not Allowed', 'text/plain',
+                            b'Method Not Allowed', 0, keep_alive, 'Allow: POST\r\n')
+        return keep_alive
+    try:
+        with open('delete.html', 'rb') as f:
+            response = f.read()
     except OSError as e:
+        print(f'Error Parsing Request: {e}')
+        response = b''
+    response = response.decode('utf-8')
+    response = response.replace('{REDIRECT_URL}', wlan_setup.getIp()).encode('ascii')
+    print(f'Clearing sample log of {sensor.name}')
+    sensor.log.clear()
+    sensor.rollups.clear()
+    if sensor.raw_log is not None:
+        sensor.raw_log.clear()
+    print("Done.")
+    await send_response(writer, '200 OK', 'text/html', response, 0, keep_alive)
+    return keep_alive
+
+
+# Rendered from the binary log, fixed width rows keep Range requests cheap
+async def send_csv(writer, request, keep_alive):
+    sensor = requested_sensor(request)
+    if sensor is None:
+        return await send_unknown_sensor(writer, keep_alive)
+    print(f"Sending CSV File of {sensor.name}...")
+    await static.send_stream(writer, sensor.log.csv_size(), sensor.log.csv_chunks, 'text/csv',
+                             0, keep_alive, request.headers.get('range'))
+    return keep_alive
+
+
+# Assets of config.STATIC_ASSETS from memory, or 304 when the client already has them.
+# Files added to img/ since startup are streamed in fixed-size pieces. Nothing else of the
+# working directory is served, it holds the Wi-Fi credentials and the logs.
+async def send_static(writer, request, keep_alive):
+    path = request.path
+    print(f'{path} Requested')
+    max_age = 604800            # Default cache age
+    if path[1:] in assets:
+        await static.send_asset(writer, assets, path[1:], request.headers, max_age, keep_alive)
+        return keep_alive
+    name = path[len('/img/'):]
+    if not path.startswith('/img/') or not name or '/' in name or name.startswith('.') or \
+            not await static.send_file(writer, path[1:], content_type(path), max_age,
+                                       keep_alive, request.headers.get('range')):
+        return await send_not_found(writer, request, keep_alive)
+    return keep_alive
+
+
+async def send_not_found(writer, request, keep_alive):
+    print(f'Error Parsing Request: {request.path} not found')
+    await send_response(writer, '404 Not Found', 'text/plain', b'Not Found', 0, keep_alive)
+    return keep_alive
+
+
+# Exact paths, then the assets of config.STATIC_ASSETS, then prefixes in order. Anything
+# else is 404 Not Found.
+ROUTES = {
+    '/': send_page,
+    '/api/current': send_current,
+    '/metrics': send_metrics,
+    '/api/stats': send_stats,
+    '/api/sensors': send_sensors,
+    '/debug/stats': send_debug_stats,
+    '/api/boot': send_boot,
+    '/events': send_events,
+    '/delete.html': delete_log,
+    '/api/readings': send_readings,
+    '/stats.csv': send_csv,
+}
+PREFIX_ROUTES = (
+    ('/img/', send_static),
+)
+
+
+# Route one request and send the response. Returns False when the connection has to be
+# closed afterwards.
+async def dispatch(writer, request, keep_alive):
+    handler = ROUTES.get(request.path)
+    if handler is None and request.path[1:] in assets:
+        handler = send_static
+    if handler is None:
+        handler = send_not_found
+        for prefix, prefix_handler in PREFIX_ROUTES:
+            if request.path.startswith(prefix):
+                handler = prefix_handler
+                break
+    return await handler(writer, request, keep_alive)
+
+
+# One task per client connection, serves requests until the client closes, times out
+# or uses up config.MAX_KEEP_ALIVE
+async def handle_client(reader, writer):
+    global connections, requests_served, request_errors
+    if connections >= config.MAX_CONNECTIONS:
+        request_errors += 1
+        try:
+            await send_response(writer, '503 Service Unavailable', 'text/plain', b'Busy', 0, False)
+        except Exception as e:
+            print(f'Error Sending Request: {e}')
+        writer.close()
+        await writer.wait_closed()
+        return
+
+    connections += 1
+    trace = None
+    if instrument.enabled:
+        writer = instrument.TimedWriter(writer)     # Counts bytes, times the socket
+    requests = RequestReader(reader)
+    try:
+        for served in range(config.MAX_KEEP_ALIVE):
+            if instrument.enabled:
+                trace = writer.trace = instrument.Trace()
+            request = await requests.read(trace)
+            if request is None:
+                break
+            connection = request.headers.get('connection', '').lower()
+            keep_alive = (served + 1 < config.MAX_KEEP_ALIVE and connection != 'close'
+                          and (request.version == 'HTTP/1.1' or connection == 'keep-alive'))
+            if trace:
+                handled = time.ticks_us()
+            keep_alive = await dispatch(writer, request, keep_alive)
+            if trace and request.path != '/events':     # Streams aren't request times
+                instrument.finish(trace, request.target, handled)
+            requests_served += 1
+            print("Successfully Sent Request")
+            if not keep_alive:
+                break
+    except asyncio.TimeoutError:
+        pass    # Idle keep-alive connection or stalled client
+    except RequestError as e:
+        request_errors += 1
         print(f'Error Receiving Request: {e}')
-        recv_buf = ''
-        led.off()
         try:
-            cl.close()
-        except NameError as e:
-            print(e)
-        time.sleep_ms(10)
-        continue
-
-    # Check buffer header for media or webpage request
-    if not contains_word(recv_buf, b'/') and len(recv_buf) > 1:
+            await send_response(writer, e.status, 'text/plain', e.status.encode('ascii'), 0,
+                                False)
+        except (OSError, asyncio.TimeoutError):
+            pass
+    except (OSError, ValueError) as e:
+        request_errors += 1
+        print(f'Error Receiving Request: {e}')
+    finally:
+        requests.release()
+        connections -= 1
         try:
-            request = recv_buf.split()[1].decode('ascii')
-            print(f'{request} Requested')
-            get_media_req = True
-            with open(str(request), "rb") as f:
-                response = f.read()
+            writer.close()
+            await writer.wait_closed()
         except OSError as e:
-            print(f'Error Parsing Request: {e}')
+            print(e)
+
+
+# Rest of the startup, behind a listening server: clock sync, then the first sample with a
+# synced timestamp before anything is logged
+async def finish_boot():
+    global start_timestamp, download_token
+    await ntp.sync()
+    boot_phase('ntp')
+    # Program start time, on the synced clock
+    start_timestamp = int(time.time()) - time.ticks_diff(time.ticks_ms(), boot_ticks) // 1000
+    download_token = start_timestamp
+    for sensor in sensors:
+        sensor.stats.expire(int(time.time()))    # The checkpoint may be from before a pause
+        if sensor.raw_log is not None:
+            sensor.raw_log.set_calibration(sensor.driver.calibration, start_timestamp)
+    await scheduler.wait()  # Warmed up, and timestamped after the sync
+    boot_phase('first sample')
+    asyncio.create_task(log_samples())
+    asyncio.create_task(update_stats())
+    print('Boot phases (ms): ' + ', '.join('%s %d' % phase for phase in boot_phases))
+
+
+async def serve():
+    asyncio.create_task(scheduler.run())    # Sensors warm up in the background
+    asyncio.create_task(publish_samples())
+    await wlan_setup.connect_async()
+    boot_phase('network')
+    server = await asyncio.start_server(handle_client, '0.0.0.0', config.HTTP_PORT,
+                                        backlog=config.LISTEN_BACKLOG)
+    # Networking initialized, start listening for connections
+    boot_phase('listening')
+    print('Listening for connections...')
+    asyncio.create_task(finish_boot())
     while True:
-        # print(recv_buf)    # DEBUG
-        if not recv_buf or recv_buf == b'\r\n' or len(recv_buf) == 0:
-           break
-        else:
-            recv_buf = cl_file.readline()       
+        await asyncio.sleep(3600)
+
+
+# Sample log, rollups, raw log and statistics of 'sensor', in its own directories
+def open_storage(sensor):
+    sensor.log = tsdb.SegmentedLog(sensor.log_dir, config.LOG_INTERVAL, config.LOG_BATCH,
+                                   config.LOG_SEGMENT_RECORDS, config.LOG_MAX_BYTES,
+                                   config.LOG_MAX_AGE)
+    sensor.rollups = rollup.Rollup(sensor.log_dir, config.ROLLUP_LEVELS)
+    sensor.rollups.catch_up(sensor.log)     # Rebuilds missing levels from the log
+    if config.RAW_CAPTURE:
+        sensor.raw_log = tsdb.RawSegmentedLog(sensor.raw_log_dir, config.LOG_INTERVAL,
+                                              config.LOG_BATCH, config.LOG_SEGMENT_RECORDS,
+                                              config.RAW_MAX_BYTES)
+    sensor.stats = stats.Stats(config.STATS_WINDOWS, sensor.log_dir + '/stats.bin')
+
+
+# Build the sensor, storage and page state in the working directory, without serving
+def setup():
+    global sensors, sensor_names, scheduler, metric_samplers, page, assets, broadcaster
+    global start_timestamp, download_token
+
+    # Print hardware info
+    print()
+    print("Machine: \t" + uos.uname()[4])
+    print("MicroPython: \t" + uos.uname()[3])
+
+    # The sensors listed in config.SENSORS_FILE, the board's BME680 without one
+    sensors = open_sensors(load(config.SENSORS_FILE), config.SAMPLE_HISTORY,
+                           config.INTEGER_COMPENSATION, config.CALIBRATION_CACHE,
+                           config.HEATER_PROFILE, config.GAS_EVERY, config.SENSOR_PRESET)
+    sensor_names = {sensor.name: sensor for sensor in sensors}
+    metric_samplers = tuple((sensor.name.encode('ascii'), sensor.sampler) for sensor in sensors)
+    scheduler = Scheduler(sensors, config.SAMPLE_INTERVAL, config.SAMPLE_WARMUP)
+    print('Sensors: \t' + ', '.join(sensor.name for sensor in sensors))
+    boot_phase('sensor')
+    if config.INSTRUMENT:
+        instrument.setup(config.DEBUG_SLOW_REQUESTS, config.DEBUG_SLOW_MS)
+    http_request.setup(config.MAX_CONNECTIONS, config.MAX_REQUEST_HEAD)
+    # Until the clock is synced in the background, see finish_boot()
+    start_timestamp = int(time.time())
+    download_token = start_timestamp
+
+    page = Template('index.html', cache=config.PAGE_CACHE)
+    for sensor in sensors:
+        open_storage(sensor)
+    broadcaster = events.Broadcaster(config.EVENTS_MAX_SUBSCRIBERS, config.EVENTS_SEND_TIMEOUT)
+    assets = static.AssetCache(config.STATIC_ASSETS, config.ASSET_CACHE_BYTES,
+                               config.ASSET_CACHE_MAX_ITEM)
+
+
+def main():
+    led.on()
+    setup()
     led.off()
+    asyncio.run(serve())
 
-    # Update current date and time
-    year, month, mday, hour, minute, second, weekday, yearday = time.localtime()
-    date = f'{mday}-{month}-{year}'
-    time_now = f'{hour}:{minute}:{second}'
-    now = time.mktime(time.localtime())
-    runtime = seconds_to_time((now-start_timestamp))
-
-    if not get_media_req:
-        # Update sensor readings
-        for x in range(1):  # Warm up sensor before reporting readings
-            temperature = round(bme.temperature, 2)
-            temperature_f = round(((bme.temperature * 9 / 5) + 32), 2)
-            humid = round(bme.humidity, 2)
-            press = round(bme.pressure, 2)
-            gas = round(bme.gas / 1000, 2)
-            aqi = round((math.log(round(bme.gas / 1000, 2)) + 0.04 * round(bme.humidity, 2)), 2)
-            time.sleep_us(1)
-        temperature_str = str(temperature) + ' C'
-        temperature_f_str = str(temperature_f) + ' F'
-        humidity_str = str(humid) + ' %'
-        pressure_str = str(press) + ' hPa'
-        gas_str = str(gas) + ' KOhms'
-        aqi_str = str(aqi)
-        print(f'\nIncoming connection --> sending webpage')
-        print('Temperature:', temperature_str)
-        print('Humidity:', humidity_str)
-        print('Pressure:', pressure_str)
-        print('Gas:', gas_str)
-        print('AQI:', aqi_str)
-        print('-------\n')
-
-        # Set min/max
-        if temperature_f < min_temp:  # min
-            min_temp = temperature_f
-        if humid < min_humid:
-            min_humid = humid
-        if press < min_press:
-            min_press = press
-        if gas < min_gas:
-            min_gas = gas
-        if aqi < min_aqi:
-            min_aqi = aqi
-        if temperature_f > max_temp:  # max
-            max_temp = temperature_f
-        if humid > max_humid:
-            max_humid = humid
-        if press > max_press:
-            max_press = press
-        if gas > max_gas:
-            max_gas = gas
-        if aqi > max_aqi:
-            max_aqi = aqi
-
-        download_token = now  # Refresh download token to avoid stale download cache
-
-        # Move this html response to index.html
-        # and use str.replace() to fill in each variable {VAR}
-        response =  '<!DOCTYPE HTML>'+'\r\n'
-        response += '<html><head>'+'\r\n'
-        response += '<title>Plant Tent</title>'+'\r\n'
-        response += '<link rel="apple-touch-icon" sizes="76x76" href="/img/apple-touch-icon.png">\r\n'
-        response += '<link rel="icon" type="image/png" sizes="32x32" href="/img/favicon-32x32.png">\r\n'
-        response += '<link rel="icon" type="image/png" sizes="16x16" href="/img/favicon-16x16.png">\r\n'
-        response += '<link rel="manifest" href="/img/site.webmanifest">\r\n'
-        response += '<link rel="mask-icon" href="/img/safari-pinned-tab.svg" color="#5bbad5">\r\n'
-        response += '<link rel="shortcut icon" type="image/x-icon" href="/img/favicon.ico">\r\n'
-        response += '<meta name="msapplication-TileColor" content="#da532c">\r\n'
-        response += '<meta name="msapplication-config" content="/img/browserconfig.xml">\r\n'
-        response += '<meta name="theme-color" content="#ffffff">\r\n'
-        response += f'<meta http-equiv=\"refresh\" content=\"15; url=\'http://{wlan_setup.getIp()}\'\">'+'\r\n'
-        response += '<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\">\r\n'
-        response += '<style>'+'\r\n'
-        response += 'html {font-family: Arial; display: inline-block; text-align: center;}'+'\r\n'
-        response += 'p {  font-size: 1.2rem;}'+'\r\n'
-        response += 'body {  margin: 0;}'+'\r\n'
-        response += '.topnav { overflow: hidden; background-color: #5c055c; color: white; font-size: 1.7rem; }'+'\r\n'
-        response += '.content { padding: 20px; }'+'\r\n'
-        response += '.card { background-color: white; box-shadow: 2px 2px 12px 1px rgba(140,140,140,.5); }'+'\r\n'
-        response += '.cards { max-width: 700px; margin: 0 auto; display: grid; grid-gap: 2rem; grid-template-columns: repeat(auto-fit, minmax(300px, 1fr)); }'+'\r\n'
-        response += '.reading { font-size: 2.8rem; }'+'\r\n'
-        response += '.card.temperature { color: #0e7c7b; }'+'\r\n'
-        response += '.card.humidity { color: #17bebb; }'+'\r\n'
-        response += '.card.pressure { color: hsl(113, 61%, 29%); }'+'\r\n'
-        response += '.card.gas { color: #5c055c; }'+'\r\n'
-        response += '.downloadButton{box-shadow:0 10px 14px -7px #3dc21b;background:linear-gradient(to bottom,#44c767 5%,#5cbf2a 100%);background-color:#44c767;border-radius:8px;display:inline-block;cursor:pointer;color:#fff;font-family:Arial;font-size:16px;font-weight:700;padding:13px 16px;text-decoration:none;text-shadow:0 1px 0 #2f6627}\r\n'
-        response += '.downloadButton:hover{background:linear-gradient(to bottom,#5cbf2a 5%,#44c767 100%);background-color:#5cbf2a}\r\n'
-        response += '.deleteButton:active,.downloadButton:active{position:relative;top:1px}.deleteButton{box-shadow:0 10px 14px -7px #cf866c;background:linear-gradient(to bottom,#d0451b 5%,#bc3315 100%);background-color:#d0451b;border-radius:8px;display:inline-block;cursor:pointer;color:#fff;font-family:Arial;font-size:12px;font-weight:700;padding:8px 10px;text-decoration:none;text-shadow:0 1px 0 #854629}.deleteButton:hover{background:linear-gradient(to bottom,#bc3315 5%,#d0451b 100%);background-color:#bc3315}\r\n'
-        response += '.downloadButton:active{position:relative;top:1px}\r\n'
-        response += '</style>'+'\r\n'
-        response += '</head>'+'\r\n'
-        response += '<body>'+'\r\n'
-        response += '<div class=\"topnav\">'+'\r\n'
-        response += '<h3><img src=/img/favicon-32x32.png alt="Potted Plant Left"> Exotic Plant Tent <img src=/img/favicon-32x32.png alt="Potted Plant Right"></h3>'+'\r\n'
-        response += '</div>'+'\r\n'
-        response += '<div class=\"content\">'+'\r\n'
-        response += '<div class=\"cards\">'+'\r\n'
-        response += '<div class=\"card temperature\">'+'\r\n'
-        response += '<h4>Temp. Fahrenheit</h4><p><span class=\"reading\">' + temperature_f_str + '<br><h4>' + temperature_str + f'<br>min: {min_temp} F max: {max_temp} F</h4></p>'+'\r\n'
-        response += '</div>'+'\r\n'
-        response += '<div class=\"card humidity\">'+'\r\n'
-        response += '<h4>Humidity</h4><p><span class=\"reading\">' + humidity_str + f'<br><h4>min: {min_humid} max: {max_humid}</h4></p>'+'\r\n'
-        response += '</div>'+'\r\n'
-        response += '<div class=\"card gas\">' + '\r\n'
-        response += '<h4>Gas</h4><p><span class=\"reading\">' + 'AQI: ' + aqi_str + f'<h4>min: {min_aqi} max: {max_aqi}</h4><h2>' + gas_str + f'</h2><h4>min: {min_gas} max: {max_gas}</h4></p>' + '\r\n'
-        response += '</div>'+'\r\n'
-        response += '<div class=\"card pressure\">' + '\r\n'
-        response += '<h4>PRESSURE</h4><p><span class=\"reading\">' + pressure_str + f'<br><h4>min: {min_press} max: {max_press}</h4></p>' + '\r\n'
-        response += f'</div></div><br><a href="stats.csv?token{download_token}" class="downloadButton">Download</a><br><br>{month}-{mday}-{year} {(hour-12) if hour > 12 else hour }:{minute}:{second}<br>Runtime: {int(runtime[3])} days {int(runtime[2])} hours {int(runtime[1])} minutes {int(runtime[0])} seconds<br><br><br><br><a href="delete.html" class="deleteButton">Delete</a></div>'+'\r\n'
-        response += '</body></html>'+'\r\n\r\n'
 
-    try:
-        led.on()
-        content_type = 'text/html'  # Default html
-        max_age = 604800            # Default cache age
-        if not get_media_req:       # Toggle response type between html and favicon
-            cl.send('HTTP/1.1 200 OK\r\nContent-type: text/html\r\nCache-Control: max-age=60\r\n\r\n')
-            cl.send(response)
-        else:
-            print(f'Sending {request}')
-            if contains_word(request, '/img/site.webmanifest'):
-                content_type = 'application/manifest+json'
-            elif contains_word(request, '/favicon.ico'):
-                content_type = 'image/x-icon'
-            elif contains_word(request.split('?')[0], f'/stats.csv'):
-                print("Sending CSV File...")
-                max_age = 0
-                content_type = 'text/csv'
-                try:
-                    with open('stats.csv', 'rb') as f:
-                        response = f.read()
-                except OSError as e:
-                    print(f'No csv found: {e}')
-                response += '\r\n\r\n'
-            elif contains_word(request, '/delete.html'):
-                response = response.decode('utf-8')
-                response = response.replace('{REDIRECT_URL}', wlan_setup.getIp()).encode('ascii')
-                print('Removing stats.csv')
-                try:
-                    uos.remove('stats.csv')
-                except OSError as e:
-                    print(f'No csv found: {e}')
-                print("Done.")
-                max_age = 0
-            else:
-                content_type = 'image/png'
-            cl.send(f'HTTP/1.1 200 OK\r\nContent-type: {content_type}\r\nAccept-Ranges: bytes\r\nCache-Control: max-age={max_age}\r\n\r\n')
-            cl.send(response)
-        get_media_req = False
-        cl.close()
-        print("Successfully Sent Request")
-    except OSError as e:
-        print(f'Error Sending Request: {e}')
-        cl.close()
-
-    led.off()
-    recv_buf = ''   # Reset buffer
-    response = ''   # Reset response
-    request  = ''   # Reset request
-    cl   = ''
-    addr = ''
-    time.sleep_ms(1)
-    print('\nListening for connections...\n')
+if __name__ == '__main__':
+    main()
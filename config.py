@@ -0,0 +1,72 @@
+"""
+BME680 HTTP Web Socket Server configuration.
+Edit these values before copying the project to the Pico W.
+"""
+
+# HTTP server
+HTTP_PORT = 80
+LISTEN_BACKLOG = 3
+MAX_CONNECTIONS = 6         # Concurrent client connections, extra clients get a 503
+CONNECTION_TIMEOUT = 30     # Seconds a client may stay silent before it is disconnected
+MAX_KEEP_ALIVE = 20         # Requests served on one keep-alive connection before closing it
+MAX_REQUEST_BODY = 1024     # Larger request bodies are refused
+MAX_REQUEST_HEAD = 2048     # Request line and headers, one buffer per connection
+PAGE_CACHE = True           # Reuse the rendered dashboard until the next sensor sample
+MAX_QUERY_BUCKETS = 2000    # Buckets one /api/readings request may ask for
+EVENTS_MAX_SUBSCRIBERS = 3  # Open dashboards receiving samples over /events, each holds
+                            # one of MAX_CONNECTIONS
+EVENTS_SEND_TIMEOUT = 5     # Seconds a dashboard may take to accept a sample before it is dropped
+INSTRUMENT = False          # Phase timers and slow request log at /debug/stats
+DEBUG_SLOW_REQUESTS = 8     # Slow requests kept for /debug/stats
+DEBUG_SLOW_MS = 50          # Requests taking this long are kept, 0 keeps the latest ones
+
+# Static assets, scanned at startup for ETags and kept in memory within a byte budget
+STATIC_ASSETS = ('img', 'favicon.ico')     # Files and directories, relative paths
+ASSET_CACHE_BYTES = 16384   # Memory for cached asset contents
+ASSET_CACHE_MAX_ITEM = 4096 # Larger assets are always streamed from flash
+
+# Background sensor sampling
+SENSORS_FILE = 'sensors.json'   # Sensors and their buses, see sensors.py. Without the file
+                                # the BME680 at 0x77 on I2C 0 (scl 17, sda 16) is used
+INTEGER_COMPENSATION = True # Bosch fixed-point compensation, the Pico has no FPU
+CALIBRATION_CACHE = 'bme680_calibration.txt'  # Sensor calibration saved at first boot
+SAMPLE_INTERVAL = 15        # Seconds between sensor samples
+SAMPLE_HISTORY = 240        # Samples kept in memory (1 hour at 15 sec)
+SAMPLE_WARMUP = 5           # Readings discarded at startup before the first sample
+SENSOR_PRESET = 'balanced'  # Oversampling and filter, 'low-latency' (11 ms a sample),
+                            # 'balanced' (33 ms) or 'low-noise' (60 ms), plus the heater
+                            # duration when gas is measured
+HEATER_PROFILE = ((320, 150),)  # Gas heater steps, (temperature C, duration ms), up to 10.
+                                # Each gas measurement runs the next step; the dashboard and
+                                # log show the first, /api/current all of them
+GAS_EVERY = 4               # Samples per gas measurement, the others skip the heater: a few
+                            # ms and almost no power instead of the heater duration
+
+# Sample log, downloaded as stats.csv. Stored as segment files, the oldest segment is
+# deleted once the log is over LOG_MAX_BYTES or its samples are older than LOG_MAX_AGE
+LOG_DIR = 'log'
+LOG_INTERVAL = 300          # Seconds between logged samples (5 min)
+LOG_BATCH = 1               # Samples buffered in memory before writing to flash. Raise it
+                            # for short intervals, buffered samples are lost on power loss
+LOG_SEGMENT_RECORDS = 512   # Samples per segment file (8 KB, about 42 hours at 5 min)
+LOG_MAX_BYTES = 262144      # Flash used by the log at most, 0 for no limit (about 56 days)
+LOG_MAX_AGE = 0             # Seconds samples are kept, 0 for no limit
+
+# Raw capture, logs the sensor's ADC values next to every logged sample so history can be
+# recompensated on a host (tools/compensate.py). The calibration goes in calibration.json.
+RAW_CAPTURE = False
+RAW_LOG_DIR = 'raw'
+RAW_MAX_BYTES = 131072      # Flash used by the raw log at most, 0 for no limit
+
+# Aggregates of the sample log, (period seconds, buckets kept) per level, finest first.
+# Queries with a step that is a multiple of a period read its buckets instead of samples.
+ROLLUP_LEVELS = ((3600, 336),   # Hourly for 2 weeks (30 KB)
+                 (86400, 400))  # Daily for 13 months (35 KB)
+
+# Rolling statistics, (span seconds, buckets) per window. The window slides one bucket
+# (span / buckets) at a time.
+STATS_WINDOWS = ((3600, 30),        # Last hour
+                 (86400, 48),       # Last day
+                 (604800, 56))      # Last week
+STATS_PAGE_WINDOW = 86400   # Window of the dashboard's min/max
+STATS_CHECKPOINT = 900      # Seconds between saving the statistics to flash
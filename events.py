@@ -0,0 +1,81 @@
+"""
+Server-Sent Events.
+
+Dashboard viewers subscribe to /events and keep the connection open. Each
+new sample is serialized once and the same bytes are written to every
+subscriber, then all of them are drained together. A subscriber that
+can't take an event within the send timeout is dropped, so one slow
+viewer never holds up the others or the sampler.
+"""
+
+import config
+from http_util import send_response
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+class _Subscriber:
+    __slots__ = ('writer', 'closed')
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.closed = asyncio.Event()
+
+
+class Broadcaster:
+    """Fan-out of events to the open /events connections.
+
+       :param int max_subscribers: Further subscribers are refused with 503
+       :param send_timeout: Seconds a subscriber may take to accept an event"""
+    def __init__(self, max_subscribers=3, send_timeout=5):
+        self.max_subscribers = max_subscribers
+        self.send_timeout = send_timeout
+        self._subscribers = []
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    async def subscribe(self, writer, keep_alive=True):
+        """Answer an /events request and hold the connection until the subscriber is
+           dropped. Returns False, the connection is done afterwards."""
+        if len(self._subscribers) >= self.max_subscribers:
+            await send_response(writer, '503 Service Unavailable', 'text/plain', b'Busy', 0,
+                                keep_alive, 'Retry-After: 15\r\n')
+            return keep_alive
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n'
+                     b'retry: 5000\n\n')   # Browser reconnect delay
+        await asyncio.wait_for(writer.drain(), config.CONNECTION_TIMEOUT)
+        subscriber = _Subscriber(writer)
+        self._subscribers.append(subscriber)
+        print(f'Event subscriber added, {len(self._subscribers)} open')
+        await subscriber.closed.wait()
+        return False
+
+    async def _send(self, subscriber, event):
+        try:
+            subscriber.writer.write(event)
+            await asyncio.wait_for(subscriber.writer.drain(), self.send_timeout)
+            return True
+        except (asyncio.TimeoutError, OSError):
+            return False
+
+    async def publish(self, data):
+        """Send one event with 'data' (bytes, a single line) to every subscriber"""
+        if not self._subscribers:
+            return
+        event = b'data: ' + data + b'\n\n'
+        subscribers = self._subscribers[:]
+        sent = await asyncio.gather(*[self._send(subscriber, event)
+                                      for subscriber in subscribers])
+        for subscriber, ok in zip(subscribers, sent):
+            if not ok:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+            print(f'Event subscriber dropped, {len(self._subscribers)} open')
+        subscriber.closed.set()     # Lets its connection task close the socket
@@ -0,0 +1,183 @@
+"""
+Incremental HTTP request parser.
+
+Each connection reads into a buffer taken from a pool preallocated at
+startup, with readinto, so a request head arrives in as many reads as
+the client sent packets instead of one tiny read per byte of every
+line. Only the bytes of each read are searched for the end of the head
+(MicroPython's bytearray has no find()), and the head is parsed by
+offsets from that copy, or one copy of the whole head when it took
+several reads. Only the method, target, version and the values of the
+headers in HEADERS are decoded, the other headers are skipped without
+allocating. The path is percent-decoded. Heads larger than the buffer,
+bodies over the limit and malformed request lines raise RequestError
+carrying the status to answer with, before anything else is read.
+"""
+
+import config
+from http_util import unquote
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+# Request headers the server looks at, the others are skipped
+HEADERS = ('connection', 'content-length', 'range', 'if-none-match', 'if-modified-since',
+           'accept-encoding')
+# Lower case and the usual capitalization (Content-Length) of each, found without lower()
+_NAMES = {}
+for _name in HEADERS:
+    _NAMES[_name.encode('ascii')] = _name
+    _NAMES['-'.join(part[0].upper() + part[1:] for part in _name.split('-')).encode('ascii')] = \
+        _name
+_LENGTHS = set(len(name) for name in HEADERS)
+_FIRSTS = set(name.encode('ascii')[0] for name in HEADERS)   # Lower case first letters
+
+_pool = []
+
+
+class RequestError(ValueError):
+    """Request refused, answer with 'status' and close the connection"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    """The current request of a connection, reused for every request on it.
+
+       ``target`` is the request target as sent, ``path`` the same without the query and
+       percent-decoded."""
+    __slots__ = ('method', 'target', 'path', 'version', 'headers')
+
+    def __init__(self):
+        self.method = self.target = self.path = self.version = None
+        self.headers = {}
+
+
+def setup(count, size):
+    """Preallocate buffers of 'size' bytes for 'count' connections"""
+    _pool[:] = [bytearray(size) for x in range(count)]
+
+
+class RequestReader:
+    """Reads the requests of one connection from 'reader'. Call release() when the
+       connection is done, it returns the buffer to the pool."""
+    def __init__(self, reader):
+        self._reader = reader
+        self._buf = _pool.pop() if _pool else bytearray(config.MAX_REQUEST_HEAD)
+        self._mv = memoryview(self._buf)
+        self._length = 0    # Bytes in the buffer not consumed yet
+        self._readinto = getattr(reader, 'readinto', None)  # Not on CPython streams
+        self.request = Request()
+
+    def release(self):
+        if self._buf is not None:
+            _pool.append(self._buf)
+            self._buf = self._mv = None
+
+    async def _fill(self):
+        """Read more of the stream into the free end of the buffer, returns the bytes read,
+           0 when the client has closed the connection"""
+        free = self._mv[self._length:]
+        if self._readinto:
+            n = await asyncio.wait_for(self._readinto(free), config.CONNECTION_TIMEOUT)
+        else:
+            data = await asyncio.wait_for(self._reader.read(len(free)),
+                                          config.CONNECTION_TIMEOUT)
+            n = len(data)
+            free[:n] = data
+        self._length += n
+        return n
+
+    def _consume(self, n):
+        """Drop the first 'n' bytes of the buffer"""
+        rest = self._length - n
+        if rest:    # Pipelined request or body, rarely
+            self._mv[:rest] = self._mv[n:self._length]
+        self._length = rest
+
+    async def read(self, trace=None):
+        """Read the next request into ``request`` and return it, or None once the client has
+           closed the connection. 'trace' is told when the request line arrives and when
+           the request has been read."""
+        if not self._length and not await self._fill():
+            return None
+        if trace:
+            trace.arrived()
+        searched = 0
+        while True:
+            head = bytes(self._mv[searched:self._length])     # What arrived since the last search
+            end = head.find(b'\r\n\r\n')
+            if end >= 0:
+                end += searched
+                if searched:    # Head in several reads
+                    head = bytes(self._mv[:end + 4])
+                break
+            searched = max(0, self._length - 3)
+            if self._length == len(self._buf):
+                raise RequestError('431 Request Header Fields Too Large',
+                                   'request head too large')
+            if not await self._fill():
+                raise RequestError('400 Bad Request', 'connection closed mid-request')
+        request = self.request
+        self._parse(head, end, request)
+        self._consume(end + 4)
+
+        # Nothing reads request bodies, drop it so the next keep-alive request parses
+        try:
+            length = int(request.headers.get('content-length', '0'))
+        except ValueError:
+            raise RequestError('400 Bad Request', 'malformed Content-Length')
+        if length > config.MAX_REQUEST_BODY or length < 0:
+            raise RequestError('413 Payload Too Large', f'request body too large: {length}')
+        while length:
+            if not self._length and not await self._fill():
+                raise RequestError('400 Bad Request', 'request body cut short')
+            used = min(length, self._length)
+            self._consume(used)
+            length -= used
+        if trace:
+            trace.parsed()
+        return request
+
+    @staticmethod
+    def _parse(head, end, request):
+        """Fill 'request' from the request line and headers in head[:end]"""
+        line_end = head.find(b'\r\n', 0, end + 2)
+        space = head.find(b' ', 0, line_end)
+        space2 = head.find(b' ', space + 1, line_end)
+        if space < 1 or space2 < space + 2 or head.find(b' ', space2 + 1, line_end) >= 0 \
+                or not head.startswith(b'HTTP/', space2 + 1):
+            raise RequestError('400 Bad Request', f'malformed request line: {head[:line_end]}')
+        try:
+            request.method = head[:space].decode('ascii')
+            request.target = head[space + 1:space2].decode('ascii')
+            request.version = head[space2 + 1:line_end].decode('ascii')
+        except UnicodeError:
+            raise RequestError('400 Bad Request', 'request line not ASCII')
+        query = request.target.find('?')
+        path = request.target if query < 0 else request.target[:query]
+        try:
+            request.path = unquote(path, False) if '%' in path else path
+        except UnicodeError:
+            raise RequestError('400 Bad Request', 'path not UTF-8')
+
+        headers = request.headers
+        headers.clear()
+        start = line_end + 2
+        while start < end:
+            line_end = head.find(b'\r\n', start, end + 2)
+            colon = head.find(b':', start, line_end)
+            if colon < 0:
+                raise RequestError('400 Bad Request', 'malformed header line')
+            if colon - start in _LENGTHS and head[start] | 0x20 in _FIRSTS:
+                name = _NAMES.get(head[start:colon])
+                if name is None:    # Unusual capitalization
+                    name = _NAMES.get(head[start:colon].lower())
+                if name:
+                    try:
+                        headers[name] = head[colon + 1:line_end].strip().decode('ascii')
+                    except UnicodeError:
+                        raise RequestError('400 Bad Request', 'header not ASCII')
+            start = line_end + 2
@@ -0,0 +1,92 @@
+"""
+HTTP response helpers shared by the server modules.
+"""
+
+import config
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+content_types = {
+    'png': 'image/png',
+    'ico': 'image/x-icon',
+    'svg': 'image/svg+xml',
+    'xml': 'application/xml',
+    'webmanifest': 'application/manifest+json',
+    'csv': 'text/csv',
+    'html': 'text/html',
+}
+
+
+# Content type from the file extension of 'path'
+def content_type(path):
+    return content_types.get(path.rsplit('.', 1)[-1], 'application/octet-stream')
+
+
+# Write the status line and headers. 'headers' holds any extra header lines, each
+# ending in \r\n
+def send_headers(writer, status, content_type, length, max_age=0, keep_alive=True, headers=''):
+    writer.write(f'HTTP/1.1 {status}\r\nContent-type: {content_type}\r\n'
+                 f'Content-Length: {length}\r\nCache-Control: max-age={max_age}\r\n{headers}'
+                 f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('ascii'))
+
+
+async def send_response(writer, status, content_type, body, max_age=0, keep_alive=True,
+                        headers=''):
+    send_headers(writer, status, content_type, len(body), max_age, keep_alive, headers)
+    writer.write(body)
+    await asyncio.wait_for(writer.drain(), config.CONNECTION_TIMEOUT)
+
+
+async def send_chunks(writer, status, content_type, chunks, max_age=0, keep_alive=True,
+                      chunked=True, headers=''):
+    """Send a body of unknown length produced by the 'chunks' generator. It goes out with
+       chunked transfer coding, which keeps the connection open. HTTP/1.0 clients don't
+       understand it ('chunked' False), the connection is closed to end the body then."""
+    keep_alive = keep_alive and chunked
+    if chunked:
+        headers += 'Transfer-Encoding: chunked\r\n'
+    writer.write(f'HTTP/1.1 {status}\r\nContent-type: {content_type}\r\n'
+                 f'Cache-Control: max-age={max_age}\r\n{headers}'
+                 f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('ascii'))
+    for chunk in chunks:
+        if chunked:
+            writer.write(b'%x\r\n' % len(chunk))
+            writer.write(chunk)
+            writer.write(b'\r\n')
+        else:
+            writer.write(chunk)
+        await asyncio.wait_for(writer.drain(), config.CONNECTION_TIMEOUT)
+    if chunked:
+        writer.write(b'0\r\n\r\n')
+        await asyncio.wait_for(writer.drain(), config.CONNECTION_TIMEOUT)
+    return keep_alive
+
+
+# Decode %XX escapes and, unless 'plus' is False as for paths, '+' in a query string value
+def unquote(value, plus=True):
+    if plus:
+        value = value.replace('+', ' ')
+    if '%' not in value:
+        return value
+    parts = value.split('%')
+    result = bytearray(parts[0].encode())
+    for part in parts[1:]:
+        try:
+            result.append(int(part[:2], 16))
+            result.extend(part[2:].encode())
+        except ValueError:
+            result.extend(b'%' + part.encode())
+    return result.decode('utf-8')
+
+
+# Parse the query string of 'path' into a dict, later values win
+def parse_query(path):
+    params = {}
+    query = path.partition('?')[2]
+    for pair in query.split('&'):
+        if pair:
+            name, _, value = pair.partition('=')
+            params[unquote(name)] = unquote(value)
+    return params
@@ -0,0 +1,165 @@
+"""
+Hot-path instrumentation, served at /debug/stats.
+
+Per-phase timers in microseconds: 'wait' until a request line arrives
+(accept or keep-alive idle), 'headers' for the rest of the request,
+'handle' for routing and rendering, 'send' for waiting on the socket and
+'sensor' for the sampler's calls into the driver. Requests whose total
+is at least config.DEBUG_SLOW_MS are kept, with their phases, bytes sent
+and free heap before and after, in a ring of config.DEBUG_SLOW_REQUESTS
+preallocated slots.
+
+Off unless config.INSTRUMENT is set: the hot paths then only test
+``enabled`` and skip the rest.
+"""
+
+import gc
+import json
+import time
+from array import array
+from micropython import const
+
+WAIT = const(0)
+HEADERS = const(1)
+HANDLE = const(2)
+SEND = const(3)
+SENSOR = const(4)
+PHASES = ('wait', 'headers', 'handle', 'send', 'sensor')
+_NUM_PHASES = const(5)
+# Per slow request: ticks received, total, headers, handle, send (us), bytes, heap before, after
+_SLOW_FIELDS = const(8)
+
+enabled = False
+bytes_sent = 0
+_totals = [0] * _NUM_PHASES     # Microseconds
+_counts = [0] * _NUM_PHASES
+_maxs = [0] * _NUM_PHASES
+_slow_ms = 0
+_slow_paths = []
+_slow = None
+_slow_head = 0      # Slot the next slow request goes to
+_slow_count = 0
+
+
+def setup(slow_requests=8, slow_ms=50):
+    """Turn the instrumentation on, keeping 'slow_requests' requests of at least 'slow_ms'"""
+    global enabled, _slow, _slow_paths, _slow_ms
+    _slow = array('i', bytes(4 * _SLOW_FIELDS * slow_requests))
+    _slow_paths = [None] * slow_requests
+    _slow_ms = slow_ms
+    enabled = True
+
+
+def heap_free():
+    """Free heap in bytes, None where gc can't tell (CPython)"""
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return None
+
+
+def add(phase, started):
+    """Add the time since 'started' (ticks_us) to 'phase', returns the microseconds"""
+    elapsed = time.ticks_diff(time.ticks_us(), started)
+    _book(phase, elapsed)
+    return elapsed
+
+
+def _book(phase, elapsed):
+    _totals[phase] += elapsed
+    _counts[phase] += 1
+    if elapsed > _maxs[phase]:
+        _maxs[phase] = elapsed
+
+
+class Trace:
+    """Timing of one request. Created when the server starts waiting for it."""
+    __slots__ = ('started', 'headers', 'send', 'bytes', 'heap')
+
+    def __init__(self):
+        self.started = time.ticks_us()
+        self.headers = 0
+        self.send = 0
+        self.bytes = 0
+        self.heap = None
+
+    def arrived(self):
+        """The request line is in, the request starts"""
+        add(WAIT, self.started)
+        self.started = time.ticks_us()
+        self.heap = heap_free()
+
+    def parsed(self):
+        """The headers are read"""
+        self.headers = add(HEADERS, self.started)
+
+
+def finish(trace, path, started):
+    """Book the handling of the request in 'trace', which ran from 'started' (ticks_us), and
+       keep it when it was slow"""
+    global _slow_head, _slow_count
+    handle = time.ticks_diff(time.ticks_us(), started) - trace.send
+    _book(HANDLE, handle)
+    total = time.ticks_diff(time.ticks_us(), trace.started)
+    if total < _slow_ms * 1000:
+        return
+    heap = heap_free()
+    base = _slow_head * _SLOW_FIELDS
+    _slow[base:base + _SLOW_FIELDS] = array('i', (
+        time.ticks_ms(), total, trace.headers, handle, trace.send, trace.bytes,
+        -1 if trace.heap is None else trace.heap, -1 if heap is None else heap))
+    _slow_paths[_slow_head] = path
+    _slow_head = (_slow_head + 1) % len(_slow_paths)
+    _slow_count = min(_slow_count + 1, len(_slow_paths))
+
+
+class TimedWriter:
+    """Stream writer that counts the bytes written and times drain() into the trace"""
+    def __init__(self, writer):
+        self._writer = writer
+        self.trace = None
+
+    def write(self, data):
+        global bytes_sent
+        bytes_sent += len(data)
+        if self.trace is not None:
+            self.trace.bytes += len(data)
+        self._writer.write(data)
+
+    async def drain(self):
+        started = time.ticks_us()
+        await self._writer.drain()
+        elapsed = add(SEND, started)
+        if self.trace is not None:
+            self.trace.send += elapsed
+
+    def __getattr__(self, name):
+        return getattr(self._writer, name)
+
+
+def stats_json(requests, errors, connections):
+    """JSON of the counters, phase timers and slow requests, the newest first"""
+    parts = ['"enabled":%s,"requests":%d,"errors":%d,"connections":%d' % (
+        'true' if enabled else 'false', requests, errors, connections)]
+    heap = heap_free()
+    if heap is not None:
+        parts.append('"heap_free":%d' % heap)
+    if enabled:
+        parts.append('"bytes_sent":%d' % bytes_sent)
+        parts.append('"phases":{%s}' % ','.join(
+            '"%s":{"count":%d,"total_us":%d,"mean_us":%d,"max_us":%d}' % (
+                PHASES[i], _counts[i], _totals[i], _totals[i] // _counts[i] if _counts[i] else 0,
+                _maxs[i]) for i in range(_NUM_PHASES)))
+        now = time.ticks_ms()
+        slow = []
+        for n in range(_slow_count):
+            slot = (_slow_head - 1 - n) % len(_slow_paths)
+            at, total, headers, handle, send, sent, before, after = \
+                _slow[slot * _SLOW_FIELDS:(slot + 1) * _SLOW_FIELDS]
+            heap = ',"heap_before":%d,"heap_after":%d' % (before, after) if before >= 0 else ''
+            slow.append('{"path":%s,"age_ms":%d,"total_us":%d,"headers_us":%d,'
+                        '"handle_us":%d,"send_us":%d,"bytes":%d%s}' % (
+                            json.dumps(_slow_paths[slot]), time.ticks_diff(now, at),
+                            total, headers, handle, send, sent, heap))
+        parts.append('"slow_ms":%d,"slow":[%s]' % (_slow_ms, ','.join(slow)))
+    return ('{%s}' % ','.join(parts)).encode('utf-8')
@@ -1 +1,3 @@
-import bme680_server
\ No newline at end of file
+import bme680_server
+
+bme680_server.main()
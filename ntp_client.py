@@ -9,10 +9,15 @@ import time
 import struct
 
 from machine import Pin, RTC
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 pt_gmtoffset = 28800    # Convert UTC time to Pacific Timezone (UTC-08:00)
 NTP_DELTA = 2208988800 + pt_gmtoffset
 host = "pool.ntp.org"
+port = 123
 
 led = Pin("LED", Pin.OUT)
 
@@ -20,7 +25,7 @@ led = Pin("LED", Pin.OUT)
 def set_time():
     NTP_QUERY = bytearray(48)
     NTP_QUERY[0] = 0x1B
-    addr = socket.getaddrinfo(host, 123)[0][-1]
+    addr = socket.getaddrinfo(host, port)[0][-1]
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         s.settimeout(1)
@@ -45,3 +50,16 @@ def setup():
     print(time.localtime())
     print()
     led.off()
+
+
+# Sync the clock in the background, retrying every 'interval' seconds until it works.
+# Each attempt blocks for at most the 1 second socket timeout.
+async def sync(interval=5):
+    while True:
+        try:
+            set_time()
+            print("Completed Online NTP Sync")
+            return
+        except OSError as e:
+            print(f'NTP sync failed ({e}), retrying')
+        await asyncio.sleep(interval)
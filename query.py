@@ -0,0 +1,129 @@
+"""
+Time-range queries over the sample log.
+
+The start of the range is found by binary search, then the samples are
+streamed once and folded into step-wide buckets with min, max and mean
+per value. Output is rendered bucket by bucket as JSON or CSV, so memory
+use and work follow the number of buckets, not the size of the log.
+When a rollup level tiles the steps, its buckets are merged instead of
+reading the samples, so a range of a year costs hundreds of reads.
+"""
+
+FIELDS = ('temperature', 'humidity', 'pressure', 'gas', 'aqi')
+_NUM_FIELDS = len(FIELDS)
+
+
+def buckets(log, start, stop, step, rollup=None):
+    """Yield (bucket start, samples, mins, maxs, means) for every step-wide bucket in
+       [start, stop) that holds samples. The value lists follow FIELDS. Reads the coarsest
+       level of 'rollup' that fits, the samples in 'log' otherwise. Rollup buckets start on
+       whole periods, so with a level 'start' is floored to its period. The unfinished
+       period before 'stop' is read from the log, which ends the range at 'stop'; past the
+       log's retention it is read from the level, and the range ends on a whole period."""
+    level = None
+    first = log.record(0)[0] if len(log) else None
+    if rollup:
+        level = rollup.level_for(start, step, first)
+    if level is None:
+        for row in _scan(log, start, stop, step):
+            yield row
+        return
+    start -= start % level.period
+    edge = stop - stop % level.period
+    if first is None or first > edge:
+        rows = level.rows(start, stop)
+    else:
+        rows = _chain(level.rows(start, edge), _scan(log, edge, stop, stop - edge))
+    for row in _merge(rows, start, step):
+        yield row
+
+
+def _scan(log, start, stop, step):
+    """Fold the samples in [start, stop) into step-wide buckets"""
+    current = None
+    count = 0
+    mins = maxs = sums = None
+    for record in log.records(log.bisect(start), log.bisect(stop)):
+        timestamp = record[0]
+        if not start <= timestamp < stop:
+            continue    # Out of order after a clock change
+        bucket = start + (timestamp - start) // step * step
+        if bucket != current:
+            if count:
+                yield current, count, mins, maxs, [total / count for total in sums]
+            current = bucket
+            count = 0
+            mins = list(record[1:])
+            maxs = list(record[1:])
+            sums = [0.0] * _NUM_FIELDS
+        count += 1
+        for i in range(_NUM_FIELDS):
+            value = record[i + 1]
+            sums[i] += value
+            if value < mins[i]:
+                mins[i] = value
+            if value > maxs[i]:
+                maxs[i] = value
+    if count:
+        yield current, count, mins, maxs, [total / count for total in sums]
+
+
+def _chain(rows, tail):
+    """Rollup rows followed by the log's buckets, shaped as rollup rows"""
+    for row in rows:
+        yield row
+    for bucket, count, mins, maxs, means in tail:
+        yield bucket, count, mins, maxs, means, None
+
+
+def _numbers(values):
+    return ','.join('%.2f' % value for value in values)
+
+
+def json_chunks(rows, start, stop, step):
+    """Render bucket rows as a JSON document, one chunk per bucket"""
+    fields = ','.join('"%s"' % field for field in FIELDS)
+    yield (f'{{"from":{start},"to":{stop},"step":{step},"fields":[{fields}],'
+           f'"buckets":[').encode('ascii')
+    separator = ''
+    for bucket, count, mins, maxs, means in rows:
+        yield (f'{separator}{{"t":{bucket},"n":{count},"min":[{_numbers(mins)}],'
+               f'"max":[{_numbers(maxs)}],"mean":[{_numbers(means)}]}}').encode('ascii')
+        separator = ','
+    yield b']}'
+
+
+def csv_chunks(rows):
+    """Render bucket rows as CSV, one chunk per bucket"""
+    columns = ','.join(f'{field}_min,{field}_max,{field}_mean' for field in FIELDS)
+    yield f'time,samples,{columns}\r\n'.encode('ascii')
+    for bucket, count, mins, maxs, means in rows:
+        values = ','.join('%.2f,%.2f,%.2f' % (mins[i], maxs[i], means[i])
+                          for i in range(_NUM_FIELDS))
+        yield f'{bucket},{count},{values}\r\n'.encode('ascii')
+
+
+def _merge(rows, start, step):
+    """Combine rollup rows into step-wide buckets"""
+    current = None
+    count = 0
+    mins = maxs = sums = None
+    for bucket, samples, row_mins, row_maxs, row_means, m2s in rows:
+        bucket = start + (bucket - start) // step * step
+        if bucket != current:
+            if count:
+                yield current, count, mins, maxs, [total / count for total in sums]
+            current = bucket
+            count = 0
+            mins = list(row_mins)
+            maxs = list(row_maxs)
+            sums = [0.0] * _NUM_FIELDS
+        count += samples
+        for i in range(_NUM_FIELDS):
+            sums[i] += row_means[i] * samples
+            if row_mins[i] < mins[i]:
+                mins[i] = row_mins[i]
+            if row_maxs[i] > maxs[i]:
+                maxs[i] = row_maxs[i]
+    if count:
+        yield current, count, mins, maxs, [total / count for total in sums]
@@ -0,0 +1,186 @@
+"""
+Rollup pyramid of the sample log.
+
+Each level folds the samples into fixed periods, e.g. hours and days,
+and keeps per value the sample count, min, max, mean and sum of squared
+deviations (M2, Welford's form of count/sum/sum of squares, which stays
+accurate in single precision floats). The buckets are updated on every
+append, so long-range queries read one bucket per period instead of
+every sample.
+
+A level is a file of fixed-size slots used as a ring: the bucket of a
+period lives in slot (start / period) % capacity, so writes are in place
+and the oldest buckets are overwritten once the ring wraps. The files
+sit next to the sample log and are rebuilt from it when missing or corrupt.
+"""
+
+import uos
+import struct
+from micropython import const
+
+_MAGIC = b'BMER'
+VERSION = const(1)
+_HEADER = '<4sBBHII'    # magic, version, values, capacity, period, last folded timestamp
+HEADER_SIZE = const(16)
+NUM_VALUES = const(5)   # temperature, humidity, pressure, gas, aqi
+# bucket start, samples, then min, max, mean, M2 per value
+_SLOT = '<II20f'
+SLOT_SIZE = const(88)
+
+
+class Level:
+    """One rollup level, the buckets of 'period' seconds held in a ring of 'capacity' slots.
+
+       Query rows are (bucket start, samples, mins, maxs, means, m2s)."""
+    def __init__(self, path, period, capacity):
+        self.path = path
+        self.period = period
+        self.capacity = capacity
+        self.through = 0            # Timestamp of the newest sample folded in
+        self._buf = bytearray(SLOT_SIZE)
+        self._bucket = None         # Start of the bucket in _stats
+        self._count = 0
+        self._stats = [0.0] * (NUM_VALUES * 4)
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise ValueError('truncated header')
+            magic, version, values, capacity, period, through = struct.unpack(_HEADER, header)
+            if (magic != _MAGIC or version != VERSION or values != NUM_VALUES
+                    or capacity != self.capacity or period != self.period):
+                raise ValueError('rollup format or size changed')
+            self.through = through
+            self._f = open(path, 'r+b')
+        except OSError:
+            self._create()
+        except ValueError as e:
+            print(f'Rollup {path} not usable ({e}), starting a new one')
+            self._create()
+
+    def _create(self):
+        """Write an empty ring, the slots are preallocated so every write is in place"""
+        with open(self.path, 'wb') as f:
+            f.write(struct.pack(_HEADER, _MAGIC, VERSION, NUM_VALUES, self.capacity,
+                                self.period, 0))
+            empty = bytes(SLOT_SIZE * 16)
+            for first in range(0, self.capacity, 16):
+                f.write(empty[:SLOT_SIZE * min(16, self.capacity - first)])
+        self.through = 0
+        self._bucket = None
+        self._f = open(self.path, 'r+b')
+
+    def _slot(self, bucket):
+        return HEADER_SIZE + (bucket // self.period) % self.capacity * SLOT_SIZE
+
+    def _read(self, bucket):
+        """Return (samples, stats) stored for 'bucket', None if its slot holds another one"""
+        self._f.seek(self._slot(bucket))
+        self._f.readinto(self._buf)
+        row = struct.unpack(_SLOT, self._buf)
+        if row[0] != bucket or not row[1]:
+            return None
+        return row[1], list(row[2:])
+
+    def add(self, timestamp, values):
+        """Fold one sample into its bucket and write the bucket back"""
+        bucket = timestamp - timestamp % self.period
+        if bucket != self._bucket:
+            stored = self._read(bucket)     # Replayed or late samples add to what is there
+            self._bucket = bucket
+            self._count, self._stats = stored if stored else (0, [0.0] * (NUM_VALUES * 4))
+        self._count += 1
+        stats = self._stats
+        for i in range(NUM_VALUES):
+            value = values[i]
+            base = i * 4
+            if self._count == 1:
+                stats[base:base + 4] = [value, value, value, 0.0]
+                continue
+            if value < stats[base]:
+                stats[base] = value
+            if value > stats[base + 1]:
+                stats[base + 1] = value
+            delta = value - stats[base + 2]
+            stats[base + 2] += delta / self._count
+            stats[base + 3] += delta * (value - stats[base + 2])
+        struct.pack_into(_SLOT, self._buf, 0, bucket, self._count, *stats)
+        self._f.seek(self._slot(bucket))
+        self._f.write(self._buf)
+        if timestamp > self.through:
+            self.through = timestamp
+            self._f.seek(0)
+            self._f.write(struct.pack(_HEADER, _MAGIC, VERSION, NUM_VALUES, self.capacity,
+                                      self.period, self.through))
+        self._f.flush()
+
+    def oldest(self):
+        """Start of the oldest bucket the ring can still hold"""
+        newest = self.through - self.through % self.period
+        return newest - (self.capacity - 1) * self.period
+
+    def rows(self, start, stop):
+        """Yield the stored buckets starting in [start, stop), oldest first"""
+        bucket = max(start - start % self.period, self.oldest())
+        if bucket < start:
+            bucket += self.period
+        while bucket < stop:
+            stored = self._read(bucket)
+            if stored:
+                count, stats = stored
+                yield (bucket, count, stats[0::4], stats[1::4], stats[2::4], stats[3::4])
+            bucket += self.period
+
+    def clear(self):
+        """Drop every bucket"""
+        self._f.close()
+        self._create()
+
+    def close(self):
+        self._f.close()
+
+
+class Rollup:
+    """Rollup levels kept next to the sample log.
+
+       :param str directory: Directory for the level files, the log's directory
+       :param levels: (period seconds, buckets kept) per level, finest first"""
+    def __init__(self, directory, levels=((3600, 336), (86400, 400))):
+        self.levels = [Level('%s/rollup_%d.bin' % (directory, period), period, capacity)
+                       for period, capacity in levels]
+
+    def add(self, timestamp, values):
+        """Fold one sample, the values in tsdb order: temperature, humidity, pressure, gas
+           and aqi"""
+        for level in self.levels:
+            level.add(timestamp, values)
+
+    def catch_up(self, log):
+        """Fold in the samples of 'log' newer than the rollups. Rebuilds a level that was
+           missing entirely, and recovers samples logged before a crash or update."""
+        through = min(level.through for level in self.levels)
+        first = log.bisect(through + 1)
+        if first < len(log):
+            print(f'Rolling up {len(log) - first} logged samples')
+        for record in log.records(first):
+            for level in self.levels:
+                if record[0] > level.through:
+                    level.add(record[0], record[1:])
+
+    def clear(self):
+        """Drop every bucket of every level"""
+        for level in self.levels:
+            level.clear()
+
+    def level_for(self, start, step, first=None):
+        """The coarsest level whose buckets tile steps of 'step' seconds and which still holds
+           the bucket of 'start', None when the raw samples have to be read. 'first' is the
+           time of the oldest raw sample: a range starting before it is answered by the
+           level reaching furthest back, even if that lost 'start' too."""
+        tiling = [level for level in self.levels if step % level.period == 0]
+        for level in reversed(tiling):
+            if start - start % level.period >= level.oldest():
+                return level
+        if tiling and (first is None or start < first):
+            return min(tiling, key=Level.oldest)
+        return None
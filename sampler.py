@@ -0,0 +1,81 @@
+"""
+BME680 sample history.
+
+The scheduler (sensors.py) reads every sensor at a fixed cadence into its
+preallocated ring buffer, so request handlers and the csv logger read the
+latest sample without touching the bus.
+"""
+
+import math
+from array import array
+from micropython import const
+
+# Values stored per sample, in ring buffer order
+TEMPERATURE = const(0)  # Degrees celsius
+HUMIDITY = const(1)     # RH %
+PRESSURE = const(2)     # hPa
+GAS = const(3)          # KOhms
+AQI = const(4)
+NUM_FIELDS = const(5)
+
+
+# Air quality index shown on the page, from gas resistance in KOhms and humidity
+def air_quality(gas, humidity):
+    return math.log(gas) + 0.04 * humidity if gas > 0 else 0.0
+
+
+class Sampler:
+    """Ring buffer of the latest ``capacity`` samples of one sensor.
+
+       The GAS field is the gas resistance at the first step of the sensor's heater profile.
+       ``gas_steps`` holds the latest one of every step, in KOhms.
+
+       :param int capacity: Number of samples kept in the ring buffer
+       :param int heater_steps: Steps of the sensor's heater profile"""
+    def __init__(self, capacity=240, heater_steps=1):
+        self.capacity = capacity
+        self.gas_steps = array('f', bytes(4 * heater_steps))
+        # Preallocated, never resized: one timestamp and NUM_FIELDS floats per sample
+        self._times = array('I', bytes(4 * capacity))
+        self._values = array('f', bytes(4 * NUM_FIELDS * capacity))
+        self._head = 0      # Slot the next sample is written to
+        self.count = 0      # Samples taken since start, also a sequence number
+        self.reading = None # Driver Reading of the latest sample, with its raw ADC values
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def prime(self, reading):
+        """Take the gas reading of a warm-up ``Reading``, which isn't stored"""
+        self.gas_steps[reading.gas_step] = reading.gas / 1000
+
+    def add(self, timestamp, reading):
+        """Store a driver ``Reading`` taken at epoch 'timestamp'"""
+        self.prime(reading)
+        gas = self.gas_steps[0]
+        base = self._head * NUM_FIELDS
+        values = self._values
+        values[base + TEMPERATURE] = reading.temperature
+        values[base + HUMIDITY] = reading.humidity
+        values[base + PRESSURE] = reading.pressure
+        values[base + GAS] = gas
+        values[base + AQI] = air_quality(gas, reading.humidity)
+        self._times[self._head] = timestamp
+        self.reading = reading
+        self._head = (self._head + 1) % self.capacity
+        self.count += 1
+
+    def timestamp(self, age=0):
+        """Return the epoch time of the sample taken 'age' samples ago (0 is the latest)"""
+        if not 0 <= age < len(self):
+            raise IndexError('sample not in buffer')
+        return self._times[(self._head - 1 - age) % self.capacity]
+
+    def latest(self):
+        """Return (timestamp, temperature, humidity, pressure, gas, aqi) of the newest sample,
+           or None before the first one"""
+        if not self.count:
+            return None
+        slot = (self._head - 1) % self.capacity
+        base = slot * NUM_FIELDS
+        return (self._times[slot],) + tuple(self._values[base:base + NUM_FIELDS])
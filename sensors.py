@@ -0,0 +1,222 @@
+"""
+Sensor registry and scheduler.
+
+The sensors are listed in config.SENSORS_FILE, a JSON list with one
+object per BME680:
+
+    [{"name": "left", "bus": "i2c", "id": 0, "scl": 17, "sda": 16, "address": "0x77"},
+     {"name": "right", "bus": "i2c", "id": 0, "scl": 17, "sda": 16, "address": "0x76"},
+     {"name": "floor", "bus": "spi", "id": 1, "sck": 10, "mosi": 11, "miso": 12, "cs": 13}]
+
+A sensor may set its own "preset" (bme680.PRESETS), "heater" profile, a
+list of [temperature C, duration ms] steps, and "gas_every", see
+config.SENSOR_PRESET and config.HEATER_PROFILE.
+
+Sensors on the same bus id share one bus object. Without the file there
+is one sensor, the board's BME680 at 0x77 on I2C 0. The first sensor of
+the list keeps the single-sensor storage names, so its existing log
+carries on; the others get '-<name>' appended (log-right, raw-right).
+
+A BME680 spends most of a sample in its forced-mode conversion, so the
+scheduler triggers every sensor, sleeps once for the longest expected
+conversion time and collects them: sampling N sensors takes about one
+conversion time, not N.
+"""
+
+import json
+import time
+import config
+from machine import Pin, I2C, SPI
+from bme680 import BME680_I2C, BME680_SPI, DEFAULT_HEATER_PROFILE
+from micropython import const
+from sampler import Sampler
+import instrument
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+DEFAULT = ({'name': 'bme680', 'bus': 'i2c', 'id': 0, 'scl': 17, 'sda': 16, 'address': 0x77},)
+_MEASURE_TIMEOUT_MS = const(1000)   # Conversions this late are given up on
+_NAME_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-'
+
+
+# Name plus '-suffix', before the extension of a file name
+def _suffixed(path, suffix):
+    dot = path.rfind('.')
+    if dot > path.rfind('/'):
+        return f'{path[:dot]}-{suffix}{path[dot:]}'
+    return f'{path}-{suffix}'
+
+
+class Sensor:
+    """One configured BME680: its driver, sampler and the storage the server gives it.
+
+       :param dict spec: Entry of the sensors file
+       :param driver: BME680_I2C or BME680_SPI
+       :param bool first: First of the sensors file, keeps the single-sensor storage names"""
+    def __init__(self, spec, driver, first, capacity, heater_steps):
+        self.name = spec['name']
+        self.spec = spec
+        self.driver = driver
+        self.sampler = Sampler(capacity, heater_steps)
+        self.log_dir = config.LOG_DIR if first else _suffixed(config.LOG_DIR, self.name)
+        self.raw_log_dir = (config.RAW_LOG_DIR if first
+                            else _suffixed(config.RAW_LOG_DIR, self.name))
+        self.log = self.rollups = self.raw_log = self.stats = None     # Set by the server
+
+
+# Raise ValueError unless 'value' is a gas_every setting: gas every 1, 2, ... samples
+def _check_gas_every(value, where):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValueError(f'{where}: gas_every has to be a whole number from 1 on, not {value!r}')
+
+
+def load(path):
+    """The sensor specs in the JSON file 'path', DEFAULT when there is none"""
+    try:
+        with open(path, 'r') as f:
+            specs = json.load(f)
+    except OSError:
+        return DEFAULT
+    names = set()
+    for spec in specs:
+        name = spec.get('name', '')
+        if not name or name in names or any(c not in _NAME_CHARS for c in name):
+            raise ValueError(f'{path}: bad or repeated sensor name {name!r}')
+        if spec.get('bus', 'i2c') not in ('i2c', 'spi'):
+            raise ValueError(f'{path}: {name}: unknown bus {spec["bus"]!r}')
+        if 'gas_every' in spec:
+            _check_gas_every(spec['gas_every'], f'{path}: {name}')
+        names.add(name)
+    if not specs:
+        raise ValueError(f'{path}: no sensors')
+    return specs
+
+
+def _address(value):
+    return int(value, 0) if isinstance(value, str) else value
+
+
+def _bus(spec, buses):
+    """The bus of 'spec', created the first time a sensor uses it"""
+    kind = spec.get('bus', 'i2c')
+    key = (kind, spec.get('id', 0))
+    bus = buses.get(key)
+    if bus is None:
+        if kind == 'i2c':
+            bus = I2C(key[1], scl=Pin(spec.get('scl', 17)), sda=Pin(spec.get('sda', 16)),
+                      freq=spec.get('freq', 400000))
+        else:
+            bus = SPI(key[1], baudrate=spec.get('baudrate', 1000000), sck=Pin(spec['sck']),
+                      mosi=Pin(spec['mosi']), miso=Pin(spec['miso']))
+        buses[key] = bus
+    return bus
+
+
+def open_sensors(specs, capacity, integer=False, calibration_cache=None,
+                 heater_profile=DEFAULT_HEATER_PROFILE, gas_every=1, preset='balanced'):
+    """Sensors for 'specs', with samplers of 'capacity' samples. They use the settings
+       'preset' and their gas heaters run 'heater_profile' every 'gas_every' samples, unless
+       the spec has its own "preset", "heater" or "gas_every". A sensor that can't be
+       reached is left out with a message, there has to be one left."""
+    _check_gas_every(gas_every, 'config.GAS_EVERY')
+    buses = {}
+    sensors = []
+    for i, spec in enumerate(specs):
+        name = spec['name']
+        cache = calibration_cache and (calibration_cache if i == 0
+                                       else _suffixed(calibration_cache, name))
+        try:
+            bus = _bus(spec, buses)
+            if spec.get('bus', 'i2c') == 'i2c':
+                driver = BME680_I2C(bus, _address(spec.get('address', 0x77)), integer=integer,
+                                    calibration_cache=cache)
+            else:
+                driver = BME680_SPI(bus, Pin(spec['cs'], Pin.OUT, value=1), integer=integer,
+                                    calibration_cache=cache)
+            profile = spec.get('heater', heater_profile)
+            driver.set_heater_profile(profile)
+        except (OSError, RuntimeError) as e:
+            print(f'Sensor {name} not found: {e}')
+            continue
+        driver.gas_every = spec.get('gas_every', gas_every)
+        driver.use_preset(spec.get('preset', preset))
+        sensors.append(Sensor(spec, driver, i == 0, capacity, len(profile)))
+    if not sensors:
+        raise RuntimeError('no sensors found')
+    return sensors
+
+
+# Driver call, timed into instrument.SENSOR when instrumentation is on
+def _timed(call):
+    if not instrument.enabled:
+        return call()
+    started = time.ticks_us()
+    result = call()
+    instrument.add(instrument.SENSOR, started)
+    return result
+
+
+class Scheduler:
+    """Samples all 'sensors' every 'interval' seconds after 'warmup' discarded rounds.
+       ``updated`` is set and cleared after every round, ``sampled`` holds the sensors
+       that took a sample in it."""
+    def __init__(self, sensors, interval=15, warmup=5):
+        self.sensors = sensors
+        self.interval = interval
+        self._warmup = warmup
+        self.sampled = ()
+        self.updated = asyncio.Event()
+
+    async def wait(self):
+        """Wait for the next round of samples"""
+        await self.updated.wait()
+
+    async def _measure(self):
+        """Trigger every sensor, then collect them as they finish. Returns (sensor, Reading)
+           pairs, without the sensors that failed or timed out."""
+        pending = []
+        for sensor in self.sensors:
+            try:
+                _timed(sensor.driver.start_measurement)
+                pending.append(sensor)
+            except OSError as e:
+                print(f'Sensor {sensor.name}: {e}')
+        started = time.ticks_ms()
+        longest = max(sensor.driver.remaining_ms() for sensor in pending) if pending else 0
+        readings = []
+        while pending:
+            # Once for the expected duration, then in short steps for a late sensor
+            await asyncio.sleep(max(1, max(sensor.driver.remaining_ms() for sensor in pending))
+                                / 1000)
+            for sensor in tuple(pending):
+                try:
+                    if _timed(sensor.driver.is_ready):
+                        readings.append((sensor, _timed(sensor.driver.collect)))
+                        pending.remove(sensor)
+                except OSError as e:
+                    print(f'Sensor {sensor.name}: {e}')
+                    pending.remove(sensor)
+            if pending and time.ticks_diff(time.ticks_ms(), started) > \
+                    longest + _MEASURE_TIMEOUT_MS:
+                print('Sensor timeout: ' + ', '.join(sensor.name for sensor in pending))
+                break
+        return readings
+
+    async def run(self):
+        """Sampling task, runs forever"""
+        for x in range(self._warmup):   # Warm up sensors before storing readings
+            for sensor, reading in await self._measure():
+                sensor.sampler.prime(reading)
+        while True:
+            started = time.ticks_ms()
+            readings = await self._measure()
+            timestamp = int(time.time())
+            for sensor, reading in readings:
+                sensor.sampler.add(timestamp, reading)
+            self.sampled = [sensor for sensor, reading in readings]
+            self.updated.set()
+            self.updated.clear()
+            elapsed = time.ticks_diff(time.ticks_ms(), started)
+            await asyncio.sleep(max(0, self.interval * 1000 - elapsed) / 1000)
@@ -0,0 +1,35 @@
+"""
+Pico W simulator: runs the server and the driver unmodified under CPython.
+
+install() puts stand-ins for the MicroPython modules in sys.modules:
+machine (Pin, an I2C bus with a simulated BME680, RTC), network (a WLAN
+that always connects), uos, utime, micropython and ubinascii. MicroPython
+adds the ticks functions to time and has no time zones, so the utime
+functions are copied onto CPython's time module as well. uasyncio isn't
+needed, the code falls back to asyncio.
+
+    python3 -m sim --port 8080
+
+runs bme680_server against the simulated sensor and a local NTP
+responder, see sim/__main__.py.
+"""
+
+import sys
+import time
+
+from . import machine, micropython, network, ubinascii, uos, utime
+from .sensor import ADDRESS, BME680
+
+MODULES = {'machine': machine, 'micropython': micropython, 'network': network,
+           'ubinascii': ubinascii, 'uos': uos, 'utime': utime}
+
+
+def install(sensor=None):
+    """Make the MicroPython modules importable and attach 'sensor', a new
+       sim.sensor.BME680 by default, to the I2C bus. Returns the sensor."""
+    sys.modules.update(MODULES)
+    for name in utime.PATCHED:
+        setattr(time, name, getattr(utime, name))
+    sensor = sensor or BME680()
+    machine.attach(ADDRESS, sensor)
+    return sensor
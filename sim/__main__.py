@@ -0,0 +1,133 @@
+"""
+Run bme680_server on the host against the simulated Pico W.
+
+    python3 -m sim [--port 8080] [--root sim-data] [--set NAME=VALUE ...]
+                   [--wave NAME=MEAN,AMPLITUDE,PERIOD ...] [--sensors N]
+
+Run from the project root. The server runs in --root, which gets links to
+the dashboard files and a wifi_info.txt, and keeps its logs there across
+runs. --set overrides config.py settings with Python literals, e.g.
+--set SAMPLE_INTERVAL=2. --wave replaces a sensor waveform (temperature,
+humidity, pressure or gas) with a sine, a zero amplitude makes it constant;
+--noise adds measurement noise of that many percent of the mean.
+--sensors attaches N sensors, at 0x77 and 0x76 on I2C 0, then on I2C 1 and
+so on, each a little warmer than the one before, and writes the matching
+sensors.json to --root.
+"""
+
+import argparse
+import ast
+import json
+import os
+import sys
+
+import sim
+from sim import machine, network, sensor
+from sim.ntp import NTPServer
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE_FILES = ('index.html', 'delete.html')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python3 -m sim', description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8080, help='HTTP port')
+    parser.add_argument('--root', default='sim-data', help='directory the server runs in')
+    parser.add_argument('--ntp-port', type=int, default=12300, help='local NTP responder port')
+    parser.add_argument('--ntp-offset', type=float, default=0,
+                        help='seconds the NTP time is ahead of the host clock')
+    parser.add_argument('--connect-delay', type=float, default=network.connect_delay,
+                        help='seconds the WLAN takes to connect')
+    parser.add_argument('--latency', type=float,
+                        help="fixed measurement time in seconds instead of the datasheet's")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a config.py setting')
+    parser.add_argument('--wave', action='append', default=[],
+                        metavar='NAME=MEAN,AMPLITUDE,PERIOD', help='sensor waveform')
+    parser.add_argument('--noise', type=float, default=0, metavar='PERCENT',
+                        help='measurement noise')
+    parser.add_argument('--sensors', type=int, metavar='N',
+                        help='number of sensors, written to sensors.json')
+    return parser.parse_args(argv)
+
+
+def waveforms(specs, noise):
+    waves = dict(sensor.WAVEFORMS)
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        if name not in waves:
+            raise SystemExit(f'unknown waveform {name!r}, one of {", ".join(waves)}')
+        mean, amplitude, period = (float(value) for value in values.split(','))
+        waves[name] = (sensor.sine(mean, amplitude, period) if amplitude
+                       else sensor.constant(mean))
+    if noise:
+        # Noise relative to the value at the start of the run
+        waves = {name: sensor.noisy(wave, abs(wave(0)) * noise / 100)
+                 for name, wave in waves.items()}
+    return waves
+
+
+def attach_sensors(count, waves, latency):
+    """Attach 'count' sensors, 1.5 C apart, and return their sensors.json entries"""
+    specs = []
+    for n in range(count):
+        bus, address = n // 2, (0x77, 0x76)[n % 2]
+        temperature = waves['temperature']
+        offset = dict(waves, temperature=lambda t, wave=temperature, n=n: wave(t) + 1.5 * n)
+        machine.attach(address, sensor.BME680(offset, latency=latency), bus)
+        specs.append({'name': f'sensor{n + 1}', 'bus': 'i2c', 'id': bus, 'scl': 17,
+                      'sda': 16, 'address': '0x%02x' % address})
+    return specs
+
+
+def prepare_root(root):
+    """Create the server directory with links to the dashboard files and WLAN credentials"""
+    import config
+    os.makedirs(root, exist_ok=True)
+    for name in PAGE_FILES + tuple(config.STATIC_ASSETS):
+        link = os.path.join(root, name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(PROJECT, name), link)
+    credentials = os.path.join(root, 'wifi_info.txt')
+    if not os.path.exists(credentials):
+        with open(credentials, 'w') as f:
+            f.write('simulator\nsimulator\n')
+
+
+def main(argv):
+    args = parse_args(argv)
+    network.connect_delay = args.connect_delay
+    waves = waveforms(args.wave, args.noise)
+    sim.install(sensor.BME680(waves, latency=args.latency))
+    sys.path.insert(0, PROJECT)
+
+    import config
+    for setting in args.set:
+        name, _, value = setting.partition('=')
+        if not hasattr(config, name):
+            raise SystemExit(f'unknown setting {name!r}')
+        setattr(config, name, ast.literal_eval(value))
+    config.HTTP_PORT = args.port
+
+    ntp = NTPServer(port=args.ntp_port, offset=args.ntp_offset).start()
+    import ntp_client
+    ntp_client.host, ntp_client.port = ntp.address
+
+    prepare_root(args.root)
+    if args.sensors:
+        specs = attach_sensors(args.sensors, waves, args.latency)
+        with open(os.path.join(args.root, config.SENSORS_FILE), 'w') as f:
+            json.dump(specs, f, indent=1)
+    os.chdir(args.root)
+    print(f'Simulated Pico W, dashboard on http://127.0.0.1:{args.port}/')
+    import bme680_server
+    try:
+        bme680_server.main()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ntp.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,119 @@
+"""
+MicroPython's machine module on CPython: Pin, I2C with the simulated
+devices, an SPI bus with nothing on it and an RTC driving the utime clock.
+"""
+
+import errno
+from . import utime
+
+# Devices on the simulated I2C buses, by (bus id, address), a bus id of None for every bus.
+# Each has read(register, length) and write(register, value), see sim.sensor.BME680.
+devices = {}
+
+
+def attach(address, device, bus=None):
+    """Put 'device' at 'address' on I2C bus 'bus', on every bus by default"""
+    devices[(bus, address)] = device
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=-1, pull=-1, *, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = value or 0
+
+    def __repr__(self):
+        return f'Pin(GPIO{self.id}, mode={("IN", "OUT", "OPEN_DRAIN")[self.mode]})' \
+            if self.mode in (0, 1, 2) else f'Pin(GPIO{self.id})'
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def toggle(self):
+        self._value ^= 1
+
+    __call__ = value
+
+
+class I2C:
+    """I2C controller with the devices registered through attach()"""
+    def __init__(self, id=0, *, scl=None, sda=None, freq=400000, timeout=50000):
+        self.id = id
+        self.freq = freq
+        self.transactions = 0   # Bus transactions, for comparing access patterns
+
+    def _device(self, address):
+        device = devices.get((self.id, address)) or devices.get((None, address))
+        if device is None:
+            raise OSError(errno.EIO, 'no device at 0x%02x' % address)   # Not acknowledged
+        self.transactions += 1
+        return device
+
+    def scan(self):
+        return sorted(set(address for bus, address in devices if bus in (None, self.id)))
+
+    def readfrom_mem(self, address, register, length, *, addrsize=8):
+        return self._device(address).read(register, length)
+
+    def readfrom_mem_into(self, address, register, buf, *, addrsize=8):
+        buf[:] = self._device(address).read(register, len(buf))
+
+    def writeto_mem(self, address, register, buf, *, addrsize=8):
+        device = self._device(address)
+        for i, value in enumerate(buf):
+            device.write(register + i, value)
+
+    def writeto(self, address, buf, stop=True):
+        """Register and value byte pairs, as the BME680 takes burst writes"""
+        device = self._device(address)
+        for i in range(0, len(buf) - 1, 2):
+            device.write(buf[i], buf[i + 1])
+        return len(buf)
+
+
+class SPI:
+    """SPI controller without devices, reads return 0xFF like a floating MISO line"""
+    def __init__(self, id=0, baudrate=1000000, *, polarity=0, phase=0, bits=8, firstbit=0,
+                 sck=None, mosi=None, miso=None):
+        self.id = id
+        self.baudrate = baudrate
+
+    def write(self, buf):
+        pass
+
+    def readinto(self, buf, write=0x00):
+        for i in range(len(buf)):
+            buf[i] = 0xFF
+
+
+class RTC:
+    def datetime(self, datetime=None):
+        if datetime is None:
+            return utime.rtc_datetime()
+        utime.set_rtc(datetime)
+
+
+def freq():
+    return 125000000
+
+
+def unique_id():
+    return b'\xe6\x61\x41\x04\x03\x5e\x2a\x21'
+
+
+def reset():
+    raise SystemExit('machine.reset()')
@@ -0,0 +1,56 @@
+"""
+MicroPython's network module on CPython. The WLAN connects to any network
+after 'connect_delay' seconds and reports 'address' as its IP.
+"""
+
+import time
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+connect_delay = 1.0     # Seconds from connect() to STAT_GOT_IP
+address = '127.0.0.1'
+
+_state = {}     # Per interface: [active, connect() time or None]
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self._state = _state.setdefault(interface, [False, None])
+
+    def active(self, active=None):
+        if active is None:
+            return self._state[0]
+        self._state[0] = bool(active)
+        if not active:
+            self._state[1] = None
+
+    def connect(self, ssid=None, key=None):
+        if not self._state[0]:
+            raise OSError('WLAN not active')
+        self._state[1] = time.monotonic()
+
+    def disconnect(self):
+        self._state[1] = None
+
+    def status(self, param=None):
+        if self._state[1] is None:
+            return STAT_IDLE
+        if time.monotonic() - self._state[1] < connect_delay:
+            return STAT_CONNECTING
+        return STAT_GOT_IP
+
+    def isconnected(self):
+        return self.status() == STAT_GOT_IP
+
+    def ifconfig(self):
+        if not self.isconnected():
+            return ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
+        return (address, '255.255.255.0', address, address)
@@ -0,0 +1,52 @@
+"""
+Local NTP responder, so ntp_client syncs without a network. Answers every
+request with the host's clock, shifted by 'offset' seconds.
+"""
+
+import socket
+import struct
+import threading
+from .utime import host_time
+
+NTP_DELTA = 2208988800  # 1900-01-01 to 1970-01-01
+
+
+class NTPServer:
+    """NTP server on a background thread.
+
+       :param int port: UDP port, unprivileged by default
+       :param offset: Seconds added to the host clock in the answers"""
+    def __init__(self, host='127.0.0.1', port=12300, offset=0):
+        self.offset = offset
+        self.requests = 0
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self.address = self._socket.getsockname()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._socket.close()
+
+    def _serve(self):
+        while True:
+            try:
+                request, client = self._socket.recvfrom(48)
+            except OSError:
+                return      # Closed
+            if len(request) < 48:
+                continue
+            now = host_time() + self.offset + NTP_DELTA
+            seconds = int(now)
+            fraction = int((now - seconds) * 4294967296) & 0xFFFFFFFF
+            version = (request[0] >> 3) & 0x07
+            # Leap indicator 0, the client's version, mode 4 (server), stratum 1
+            reply = struct.pack('!BBbb11I', (version << 3) | 4, 1, 0, -20, 0, 0,
+                                int.from_bytes(b'SIM\x00', 'big'), seconds, fraction,
+                                *struct.unpack('!II', request[40:48]), seconds, fraction,
+                                seconds, fraction)
+            self._socket.sendto(reply, client)
+            self.requests += 1
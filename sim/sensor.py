@@ -0,0 +1,273 @@
+"""
+Register-level model of a BME680 on the simulated I2C bus.
+
+The model holds the chip's 256 byte register map: chip ID, the factory
+calibration block, the heater and oversampling settings. A write of
+forced mode to ctrl_meas starts a measurement that takes as long as the
+datasheet's duration for the configured oversampling and the wait of the
+heater step selected in ctrl_gas_1, with the measuring bits set in the
+status register meanwhile. When it
+finishes, the temperature, pressure, humidity and gas resistance of the
+waveforms at that moment are turned into ADC counts through the inverse
+of the Bosch compensation, so a driver reads back the waveform values.
+
+The IIR filter setting is stored but not applied.
+"""
+
+import math
+import random
+import struct
+import time
+
+CHIP_ID = 0x61
+ADDRESS = 0x77
+
+_STATUS = 0x1D
+_GAS_R_LSB = 0x2B
+_RES_HEAT_0 = 0x5A
+_GAS_WAIT_0 = 0x64
+_CTRL_GAS_1 = 0x71
+_CTRL_HUM = 0x72
+_CTRL_MEAS = 0x74
+_CHIP_ID = 0xD0
+_SOFT_RESET = 0xE0
+
+_NEW_DATA = 0x80
+_GAS_MEASURING = 0x40
+_MEASURING = 0x20
+_GAS_VALID = 0x20
+_HEAT_STAB = 0x10
+_RUN_GAS = 0x10
+
+_OVERSAMPLING_CYCLES = (0, 1, 2, 4, 8, 16, 16, 16)
+
+# Typical factory calibration of a BME680, as the datasheet names them
+CALIBRATION = {
+    'par_t1': 26098, 'par_t2': 26354, 'par_t3': 3,
+    'par_p1': 36477, 'par_p2': -10685, 'par_p3': 88, 'par_p4': 6849, 'par_p5': -108,
+    'par_p6': 30, 'par_p7': 35, 'par_p8': -3907, 'par_p9': -2663, 'par_p10': 30,
+    # Equal low nibbles, register 0xE2 holds the low nibble of both
+    'par_h1': 771, 'par_h2': 1011, 'par_h3': 0, 'par_h4': 45, 'par_h5': 20, 'par_h6': 120,
+    'par_h7': -100,
+    'par_gh1': -30, 'par_gh2': -12000, 'par_gh3': 18,
+    'res_heat_range': 1, 'res_heat_val': 42, 'range_sw_err': 1,
+}
+
+# Gas resistance lookup tables of the datasheet, indexed by gas range
+_LOOKUP_TABLE_1 = (2147483647.0, 2147483647.0, 2147483647.0, 2147483647.0, 2147483647.0,
+                   2126008810.0, 2147483647.0, 2130303777.0, 2147483647.0, 2147483647.0,
+                   2143188679.0, 2136746228.0, 2147483647.0, 2126008810.0, 2147483647.0,
+                   2147483647.0)
+_LOOKUP_TABLE_2 = (4096000000.0, 2048000000.0, 1024000000.0, 512000000.0, 255744255.0,
+                   127110228.0, 64000000.0, 32258064.0, 16016016.0, 8000000.0, 4000000.0,
+                   2000000.0, 1000000.0, 500000.0, 250000.0, 125000.0)
+
+
+def constant(value):
+    """Waveform that always has 'value'"""
+    return lambda t: value
+
+
+def sine(mean, amplitude, period, phase=0.0):
+    """Waveform swinging 'amplitude' around 'mean' once every 'period' seconds"""
+    return lambda t: mean + amplitude * math.sin(2 * math.pi * (t / period + phase))
+
+
+def noisy(wave, deviation, seed=None):
+    """'wave' plus normally distributed noise of standard deviation 'deviation'"""
+    rng = random.Random(seed)
+    return lambda t: wave(t) + rng.gauss(0.0, deviation)
+
+
+# Default waveforms: a day's temperature and humidity swing, slow weather fronts and the
+# gas resistance of a room that is aired twice a day
+WAVEFORMS = {
+    'temperature': sine(21.0, 3.0, 86400),          # C
+    'humidity': sine(45.0, 10.0, 86400, 0.5),       # RH %
+    'pressure': sine(1013.0, 4.0, 3 * 86400),       # hPa
+    'gas': sine(60000.0, 25000.0, 43200),           # ohms
+}
+
+
+def _calibration_registers(cal):
+    """(register, bytes) blocks of the calibration 'cal' in the chip's register layout"""
+    return (
+        (0x8A, struct.pack('<hbx', cal['par_t2'], cal['par_t3'])),
+        (0x8E, struct.pack('<Hhbx', cal['par_p1'], cal['par_p2'], cal['par_p3'])),
+        (0x94, struct.pack('<hhbb', cal['par_p4'], cal['par_p5'], cal['par_p7'], cal['par_p6'])),
+        (0x9C, struct.pack('<hhB', cal['par_p8'], cal['par_p9'], cal['par_p10'])),
+        (0xE1, bytes((cal['par_h2'] >> 4, ((cal['par_h2'] & 0x0F) << 4) | (cal['par_h1'] & 0x0F),
+                      cal['par_h1'] >> 4))),
+        (0xE4, struct.pack('<bbbBbHhbb', cal['par_h3'], cal['par_h4'], cal['par_h5'],
+                           cal['par_h6'], cal['par_h7'], cal['par_t1'], cal['par_gh2'],
+                           cal['par_gh1'], cal['par_gh3'])),
+        (0x00, struct.pack('<b', cal['res_heat_val'])),
+        (0x02, bytes((cal['res_heat_range'] << 4,))),
+        (0x04, bytes(((cal['range_sw_err'] & 0x0F) << 4,))),
+    )
+
+
+def _solve(function, target, low, high):
+    """Integer in [low, high] where the monotonic 'function' comes closest to 'target'"""
+    rising = function(high) > function(low)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if (function(middle) < target) == rising:
+            low = middle
+        else:
+            high = middle
+    return low if abs(function(low) - target) <= abs(function(high) - target) else high
+
+
+class BME680:
+    """Simulated BME680 register map.
+
+       :param dict waveforms: Functions of the seconds since the sensor was created, for
+         'temperature' (C), 'humidity' (RH %), 'pressure' (hPa) and 'gas' (ohms). Missing
+         ones are taken from WAVEFORMS.
+       :param dict calibration: Factory calibration, CALIBRATION by default
+       :param latency: Fixed measurement time in seconds instead of the datasheet's"""
+    def __init__(self, waveforms=None, calibration=None, latency=None):
+        self.waveforms = dict(WAVEFORMS, **(waveforms or {}))
+        self.calibration = dict(calibration or CALIBRATION)
+        self.latency = latency
+        self.measurements = 0
+        self._epoch = time.monotonic()
+        self._ready_at = None
+        self._reset()
+
+    def _reset(self):
+        self.registers = bytearray(256)
+        self.registers[_CHIP_ID] = CHIP_ID
+        for register, data in _calibration_registers(self.calibration):
+            self.registers[register:register + len(data)] = data
+        self._ready_at = None
+
+    def read(self, register, length):
+        """Registers from 'register' on, as a burst read returns them"""
+        self._update()
+        return bytes(self.registers[register:register + length])
+
+    def write(self, register, value):
+        """Write one register byte"""
+        self._update()
+        if register == _SOFT_RESET:
+            if value == 0xB6:
+                self._reset()
+            return
+        if register == _CHIP_ID or 0x89 <= register <= 0xA1 or 0xE1 <= register <= 0xEE:
+            return      # Read only
+        self.registers[register] = value
+        if register == _CTRL_MEAS and value & 0x03 == 0x01:
+            self._start()
+
+    def measurement_time(self):
+        """Seconds a forced-mode measurement takes with the current settings, from the
+           datasheet's oversampling cycles and the heater wait time"""
+        if self.latency is not None:
+            return self.latency
+        registers = self.registers
+        cycles = (_OVERSAMPLING_CYCLES[registers[_CTRL_MEAS] >> 5]
+                  + _OVERSAMPLING_CYCLES[(registers[_CTRL_MEAS] >> 2) & 0x07]
+                  + _OVERSAMPLING_CYCLES[registers[_CTRL_HUM] & 0x07])
+        microseconds = cycles * 1963 + 477 * 4 + 477 * 5 + 1000
+        if registers[_CTRL_GAS_1] & _RUN_GAS:
+            wait = registers[_GAS_WAIT_0 + (registers[_CTRL_GAS_1] & 0x0F)]
+            microseconds += (wait & 0x3F) * (1, 4, 16, 64)[wait >> 6] * 1000
+        return microseconds / 1000000
+
+    def _start(self):
+        self.registers[_STATUS] = _MEASURING | (
+            _GAS_MEASURING if self.registers[_CTRL_GAS_1] & _RUN_GAS else 0)
+        self._ready_at = time.monotonic() + self.measurement_time()
+
+    def _update(self):
+        """Finish the running measurement once its time is up"""
+        if self._ready_at is None or time.monotonic() < self._ready_at:
+            return
+        self._ready_at = None
+        t = time.monotonic() - self._epoch
+        values = {name: wave(t) for name, wave in self.waveforms.items()}
+        self._store(values)
+        self.registers[_CTRL_MEAS] &= 0xFC     # Back to sleep mode
+        self.registers[_STATUS] = _NEW_DATA | (self.registers[_CTRL_GAS_1] & 0x0F)  # Step run
+        self.measurements += 1
+
+    def _store(self, values):
+        """Put the ADC counts for the physical 'values' into the data registers"""
+        adc_temp = _solve(self._t_fine, self._t_fine_for(values['temperature']), 0, 0xFFFFF)
+        t_fine = self._t_fine(adc_temp)
+        adc_pres = _solve(lambda adc: self._pressure(adc, t_fine), values['pressure'] * 100,
+                          0, 0xFFFFF)
+        adc_hum = _solve(lambda adc: self._humidity(adc, t_fine),
+                         min(max(values['humidity'], 0.0), 100.0), 0, 0xFFFF)
+        adc_gas, gas_range = self._gas_adc(values['gas'])
+        data = bytearray(15)
+        data[2:5] = bytes((adc_pres >> 12, (adc_pres >> 4) & 0xFF, (adc_pres & 0x0F) << 4))
+        data[5:8] = bytes((adc_temp >> 12, (adc_temp >> 4) & 0xFF, (adc_temp & 0x0F) << 4))
+        data[8:10] = bytes((adc_hum >> 8, adc_hum & 0xFF))
+        data[13] = adc_gas >> 2
+        data[14] = ((adc_gas & 0x03) << 6) | gas_range
+        if self.registers[_CTRL_GAS_1] & _RUN_GAS:
+            data[14] |= _GAS_VALID | _HEAT_STAB
+        self.registers[_STATUS + 1:_GAS_R_LSB + 1] = data[1:]
+
+    # The datasheet's compensation formulas, run backwards by _store()
+
+    def _t_fine(self, adc_temp):
+        cal = self.calibration
+        var1 = (adc_temp / 8) - (cal['par_t1'] * 2)
+        var2 = (var1 * cal['par_t2']) / 2048
+        var3 = ((var1 / 2) * (var1 / 2)) / 4096
+        var3 = (var3 * cal['par_t3'] * 16) / 16384
+        return int(var2 + var3)
+
+    @staticmethod
+    def _t_fine_for(temperature):
+        return (temperature * 100 * 256 - 128) / 5
+
+    def _pressure(self, adc_pres, t_fine):
+        cal = self.calibration
+        var1 = (t_fine / 2) - 64000
+        var2 = ((var1 / 4) * (var1 / 4)) / 2048
+        var2 = (var2 * cal['par_p6']) / 4
+        var2 = var2 + (var1 * cal['par_p5'] * 2)
+        var2 = (var2 / 4) + (cal['par_p4'] * 65536)
+        var1 = (((((var1 / 4) * (var1 / 4)) / 8192) * (cal['par_p3'] * 32) / 8)
+                + ((cal['par_p2'] * var1) / 2))
+        var1 = var1 / 262144
+        var1 = ((32768 + var1) * cal['par_p1']) / 32768
+        pressure = 1048576 - adc_pres
+        pressure = (pressure - (var2 / 4096)) * 3125
+        pressure = (pressure / var1) * 2
+        var1 = (cal['par_p9'] * (((pressure / 8) * (pressure / 8)) / 8192)) / 4096
+        var2 = ((pressure / 4) * cal['par_p8']) / 8192
+        var3 = (((pressure / 256) ** 3) * cal['par_p10']) / 131072
+        return pressure + ((var1 + var2 + var3 + (cal['par_p7'] * 128)) / 16)
+
+    def _humidity(self, adc_hum, t_fine):
+        cal = self.calibration
+        temp_scaled = ((t_fine * 5) + 128) / 256
+        var1 = (adc_hum - (cal['par_h1'] * 16)) - ((temp_scaled * cal['par_h3']) / 200)
+        var2 = (cal['par_h2'] * (((temp_scaled * cal['par_h4']) / 100)
+                                 + (((temp_scaled * ((temp_scaled * cal['par_h5']) / 100))
+                                     / 64) / 100) + 16384)) / 1024
+        var3 = var1 * var2
+        var4 = (cal['par_h6'] * 128 + ((temp_scaled * cal['par_h7']) / 100)) / 16
+        var5 = ((var3 / 16384) * (var3 / 16384)) / 1024
+        var6 = (var4 * var5) / 2
+        return min(max((((var3 + var6) / 1024) * 1000) / 4096 / 1000, 0.0), 100.0)
+
+    def _gas_adc(self, resistance):
+        """(ADC count, range) reading as 'resistance', in the most sensitive range that
+           holds it, like the sensor's automatic ranging"""
+        resistance = max(resistance, 1.0)
+        for gas_range in range(16):
+            var1 = ((1340 + 5 * self.calibration['range_sw_err'])
+                    * _LOOKUP_TABLE_1[gas_range]) / 65536
+            var3 = (_LOOKUP_TABLE_2[gas_range] * var1) / 512
+            var2 = var3 / (resistance - 0.5)
+            adc = round((var2 - var1 + 16777216) / 32768)
+            if adc <= 1023:
+                return max(adc, 0), gas_range
+        return 1023, 15
@@ -0,0 +1,22 @@
+"""MicroPython's uos module on CPython, with uname() of a Pico W"""
+
+from collections import namedtuple
+from os import chdir, getcwd, listdir, mkdir, remove, rename, rmdir, stat, statvfs   # noqa: F401
+import os as _os
+
+_uname = namedtuple('uname_result', ('sysname', 'nodename', 'release', 'version', 'machine'))
+
+
+def uname():
+    return _uname('rp2', 'rp2', '1.22.0', 'v1.22.0 (simulator)',
+                  'Raspberry Pi Pico W with RP2040 (simulator)')
+
+
+def ilistdir(path='.'):
+    """(name, type, inode) per entry, type 0x4000 for directories and 0x8000 for files"""
+    for entry in _os.scandir(path):
+        yield entry.name, 0x4000 if entry.is_dir() else 0x8000, entry.inode()
+
+
+def sync():
+    pass
@@ -0,0 +1,93 @@
+"""
+MicroPython's time module on CPython.
+
+Ticks wrap around like on the RP2040 port, so the code sees the same
+arithmetic it gets on the board. The wall clock is the RTC: it starts at
+the host's UTC time and machine.RTC().datetime() sets it, as NTP does. As
+on the Pico there is no time zone, localtime() is gmtime().
+"""
+
+import calendar
+import time as _time
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _TICKS_PERIOD // 2
+
+_rtc_offset = 0.0   # RTC time minus host time, seconds
+
+# The host clock, kept before install() replaces these on the time module
+host_time = _time.time
+_host_time_ns = _time.time_ns
+_host_gmtime = _time.gmtime
+
+
+def ticks_ms():
+    return int(_time.monotonic() * 1000) & _TICKS_MAX
+
+
+def ticks_us():
+    return int(_time.monotonic() * 1000000) & _TICKS_MAX
+
+
+def ticks_cpu():
+    return _time.perf_counter_ns() & _TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+def sleep(seconds):
+    _time.sleep(seconds)
+
+
+def sleep_ms(ms):
+    _time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    _time.sleep(us / 1000000)
+
+
+def time():
+    return int(host_time() + _rtc_offset)
+
+
+def time_ns():
+    return _host_time_ns() + int(_rtc_offset * 1000000000)
+
+
+def gmtime(secs=None):
+    """(year, month, mday, hour, minute, second, weekday, yearday), weekday 0 is Monday"""
+    return tuple(_host_gmtime(time() if secs is None else secs))[:8]
+
+
+localtime = gmtime
+
+
+def mktime(local):
+    return calendar.timegm(tuple(local[:6]) + (0, 0, 0))
+
+
+def set_rtc(datetime):
+    """Set the clock from an RTC (year, month, mday, weekday, hour, minute, second, subseconds)
+       tuple"""
+    global _rtc_offset
+    year, month, mday, weekday, hour, minute, second = datetime[:7]
+    _rtc_offset = (calendar.timegm((year, month, mday, hour, minute, second, 0, 0, 0))
+                   - host_time())
+
+
+def rtc_datetime():
+    year, month, mday, hour, minute, second, weekday = gmtime()[:7]
+    return (year, month, mday, weekday, hour, minute, second, 0)
+
+
+# What install() copies onto CPython's time module
+PATCHED = ('ticks_ms', 'ticks_us', 'ticks_cpu', 'ticks_add', 'ticks_diff', 'sleep_ms', 'sleep_us',
+           'time', 'time_ns', 'gmtime', 'localtime', 'mktime')
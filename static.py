@@ -0,0 +1,267 @@
+"""
+Static file responses.
+
+Files are streamed through one preallocated buffer with readinto, so
+memory use stays flat however large the file grows. A single byte range
+(Range: bytes=first-last) is answered with 206 Partial Content, which
+lets interrupted downloads resume.
+
+Small assets such as the icons are also kept in an LRU cache bounded by
+a byte budget, with ETags precomputed at startup, so repeat requests are
+answered from memory or with a 304 Not Modified.
+"""
+
+import uos
+import time
+from collections import OrderedDict
+from micropython import const
+import config
+from http_util import content_type, send_headers, send_response
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+_BUF_SIZE = const(1024)
+
+# Shared by every connection. Safe because nothing awaits between filling the buffer and
+# handing it to writer.write(), which sends or copies it before returning.
+_buf = bytearray(_BUF_SIZE)
+_mv = memoryview(_buf)
+
+
+def parse_range(header, size):
+    """Return the (first, last) byte positions of a ``Range`` header for a file of 'size'
+       bytes, or None when the header should be ignored and the whole file sent. Raises
+       ValueError when the range can not be satisfied."""
+    if not header.startswith('bytes=') or ',' in header:
+        return None     # Other units and multiple ranges are not supported
+    first, sep, last = header[6:].strip().partition('-')
+    try:
+        first = int(first) if first else None
+        last = int(last) if last else None
+    except ValueError:
+        return None     # Malformed, ignored as the spec asks
+    if not sep or (first is None and last is None):
+        return None
+    if first is None:   # Suffix range, the final 'last' bytes
+        if last == 0 or size == 0:
+            raise ValueError('range not satisfiable')
+        return max(0, size - last), size - 1
+    if last is not None and last < first:
+        return None
+    if first >= size:
+        raise ValueError('range not satisfiable')
+    if last is None:
+        last = size - 1
+    return first, min(last, size - 1)
+
+
+# Yield bytes first..last of the file at 'path' as slices of the shared buffer
+def _file_chunks(path, first, last):
+    remaining = last - first + 1
+    with open(path, 'rb') as f:
+        if first:
+            f.seek(first)
+        while remaining > 0:
+            n = f.readinto(_buf)
+            if not n:
+                return
+            n = min(n, remaining)
+            remaining -= n
+            yield _mv[:n]
+
+
+async def send_stream(writer, size, chunks, content_type, max_age=0, keep_alive=True,
+                      range_header=None, headers=''):
+    """Send a 'size' byte body produced by 'chunks(first, last)', a generator of the bytes
+       first..last (inclusive), honouring 'range_header' when given. 'headers' holds extra
+       header lines."""
+    first, last = 0, size - 1
+    status = '200 OK'
+    headers += 'Accept-Ranges: bytes\r\n'
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            await send_response(writer, '416 Range Not Satisfiable', 'text/plain', b'', 0,
+                                keep_alive, f'Content-Range: bytes */{size}\r\n')
+            return
+        if byte_range is not None:
+            first, last = byte_range
+            status = '206 Partial Content'
+            headers += f'Content-Range: bytes {first}-{last}/{size}\r\n'
+
+    remaining = last - first + 1
+    send_headers(writer, status, content_type, remaining, max_age, keep_alive, headers)
+    if remaining > 0:
+        for chunk in chunks(first, last):
+            writer.write(chunk)
+            remaining -= len(chunk)
+            await asyncio.wait_for(writer.drain(), config.CONNECTION_TIMEOUT)
+    if remaining:
+        # Shrunk while sending, Content-Length can't be kept. Drop the connection.
+        raise OSError('body truncated')
+
+
+async def send_file(writer, path, content_type, max_age=0, keep_alive=True, range_header=None,
+                    headers=''):
+    """Stream the file at 'path', honouring 'range_header' when given. 'headers' holds extra
+       header lines. Returns False if the file does not exist, nothing is sent then."""
+    try:
+        size = uos.stat(path)[6]
+    except OSError:
+        return False
+    await send_stream(writer, size, lambda first, last: _file_chunks(path, first, last),
+                      content_type, max_age, keep_alive, range_header, headers)
+    return True
+
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+# HTTP date, e.g. Sun, 06 Nov 1994 08:49:37 GMT
+def http_date(timestamp):
+    year, month, mday, hour, minute, second, weekday = time.gmtime(timestamp)[:7]
+    return (f'{_DAYS[weekday]}, {mday:02d} {_MONTHS[month - 1]} {year} '
+            f'{hour:02d}:{minute:02d}:{second:02d} GMT')
+
+
+# Unix time of an HTTP date as http_date() writes it, None for anything else
+def parse_http_date(text):
+    try:
+        mday, month, year, clock = text.split()[1:5]
+        month = _MONTHS.index(month) + 1
+        hour, minute, second = (int(part) for part in clock.split(':'))
+        mday, year = int(mday), int(year)
+    except ValueError:
+        return None
+    # Days since 1970-01-01 of the proleptic Gregorian date, years starting in March
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month - 3 if month > 2 else month + 9) + 2) // 5 + mday - 1
+    days = (era * 146097 + year_of_era * 365 + year_of_era // 4 - year_of_era // 100
+            + day_of_year - 719468)
+    return days * 86400 + hour * 3600 + minute * 60 + second
+
+
+class Asset:
+    """Metadata of one static file, computed once at startup"""
+    __slots__ = ('size', 'mtime', 'etag', 'last_modified', 'content_type')
+
+    def __init__(self, size, mtime, content_type):
+        self.size = size
+        self.mtime = int(mtime)
+        self.etag = f'"{size:x}-{int(mtime):x}"'
+        self.last_modified = http_date(int(mtime))
+        self.content_type = content_type
+
+
+class AssetCache:
+    """Static assets with precomputed ETags, and the contents of the recently used ones
+       kept in memory within a byte budget.
+
+       :param paths: Files and directories (not recursive) to serve, relative paths
+       :param int budget: Bytes of file contents held in memory at most
+       :param int max_item: Larger files are always streamed from flash"""
+    def __init__(self, paths, budget=16384, max_item=4096):
+        self._budget = budget
+        self._max_item = max_item
+        self._used = 0
+        self._assets = {}           # path -> Asset
+        self._data = OrderedDict()  # path -> bytes, least recently used first
+        for path in paths:
+            try:
+                if uos.stat(path)[0] & 0x4000:  # Directory
+                    for name in uos.listdir(path):
+                        self._add(path + '/' + name)
+                else:
+                    self._add(path)
+            except OSError as e:
+                print(f'Static asset {path} not found: {e}')
+        for path in self._assets:   # Warm the cache while the budget lasts
+            if self._used + self._assets[path].size <= self._budget:
+                self._load(path)
+
+    def _add(self, path):
+        stat = uos.stat(path)
+        if not stat[0] & 0x4000:
+            self._assets[path] = Asset(stat[6], stat[8], content_type(path))
+
+    def _load(self, path):
+        size = self._assets[path].size
+        if size > self._max_item or size > self._budget:
+            return None
+        while self._used + size > self._budget:
+            oldest = next(iter(self._data))
+            self._used -= len(self._data.pop(oldest))
+        with open(path, 'rb') as f:
+            data = f.read()
+        self._data[path] = data
+        self._used += len(data)
+        return data
+
+    def __contains__(self, path):
+        return path in self._assets
+
+    @property
+    def used(self):
+        """Bytes of file contents currently held in memory"""
+        return self._used
+
+    def asset(self, path):
+        """Return the Asset for 'path', or None if it isn't a static asset"""
+        return self._assets.get(path)
+
+    def get(self, path):
+        """Return the contents of 'path' from memory, loading it if it fits the budget.
+           Returns None for files that are streamed instead."""
+        data = self._data.pop(path, None)
+        if data is None:
+            return self._load(path)
+        self._data[path] = data     # Most recently used again
+        return data
+
+
+# True when the client's conditional headers show it already has 'asset'
+def not_modified(asset, request_headers):
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match is not None:   # Takes precedence over If-Modified-Since
+        if if_none_match.strip() == '*':
+            return True
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == asset.etag:
+                return True
+        return False
+    # Unchanged since the date, which is usually the Last-Modified value the client was given
+    since = parse_http_date(request_headers.get('if-modified-since', ''))
+    return since is not None and asset.mtime <= since
+
+
+async def send_asset(writer, cache, path, request_headers, max_age=0, keep_alive=True):
+    """Send the cached static asset at 'path', or 304 Not Modified when the client has it.
+       Returns False when 'path' is not in the cache, nothing is sent then."""
+    asset = cache.asset(path)
+    if asset is None:
+        return False
+    headers = f'ETag: {asset.etag}\r\nLast-Modified: {asset.last_modified}\r\n'
+    if not_modified(asset, request_headers):
+        writer.write(f'HTTP/1.1 304 Not Modified\r\n{headers}Cache-Control: max-age={max_age}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+                     .encode('ascii'))
+        await asyncio.wait_for(writer.drain(), config.CONNECTION_TIMEOUT)
+        return True
+    range_header = request_headers.get('range')
+    data = None if range_header else cache.get(path)
+    if data is None:    # Too big to keep in memory, or a range was asked for
+        return await send_file(writer, path, asset.content_type, max_age, keep_alive,
+                               range_header, headers)
+    await send_response(writer, '200 OK', asset.content_type, data, max_age, keep_alive,
+                        headers + 'Accept-Ranges: bytes\r\n')
+    return True
@@ -0,0 +1,265 @@
+"""
+Rolling-window statistics of the sensor samples.
+
+Every window (e.g. the last hour, day and week) splits its span into a
+ring of buckets. Each bucket summarizes its samples as count, min, max,
+mean and M2 (sum of squared deviations, Welford). Over the closed buckets
+the window keeps running totals for mean and variance (Chan's parallel
+formulas, adding a bucket as it closes and removing it as it expires),
+and per value a monotonic queue of bucket indices whose mins increase
+(and one whose maxs decrease). The front of a queue is always the extreme
+of the window, so reading the statistics costs the same however many
+samples the window holds.
+
+The rings are checkpointed to flash, so a reboot keeps the extremes of
+the last week instead of starting from nothing.
+"""
+
+import uos
+import struct
+from array import array
+from micropython import const
+
+# Value fields, in sampler order
+TEMPERATURE = const(0)
+HUMIDITY = const(1)
+PRESSURE = const(2)
+GAS = const(3)
+AQI = const(4)
+NUM_VALUES = const(5)
+_STATS = const(4)       # min, max, mean, M2 per value and bucket
+_MAGIC = b'BMES'
+VERSION = const(1)
+_HEADER = '<4sBBH'      # magic, version, values, windows
+HEADER_SIZE = const(8)
+_WINDOW = '<IHHI'       # span, buckets, used, head
+_WINDOW_SIZE = const(12)
+
+
+class Window:
+    """Statistics of the samples taken in the last 'span' seconds, kept in 'buckets'
+       buckets. The window slides one bucket width at a time."""
+    def __init__(self, span, buckets):
+        self.span = span
+        self.buckets = buckets
+        self.width = span // buckets
+        self._starts = array('I', bytes(4 * buckets))   # Bucket start times
+        self._counts = array('I', bytes(4 * buckets))
+        self._stats = array('f', bytes(4 * _STATS * NUM_VALUES * buckets))
+        self._head = 0      # Ring index of the open bucket
+        self._used = 0      # Buckets in the ring, the open one included
+        self._reset_totals()
+
+    def _reset_totals(self):
+        # Running count, mean and M2 per value of the closed buckets
+        self._count = 0
+        self._means = [0.0] * NUM_VALUES
+        self._m2s = [0.0] * NUM_VALUES
+        # Ring indices of closed buckets, mins increasing and maxs decreasing from the front
+        self._min_queues = [[] for i in range(NUM_VALUES)]
+        self._max_queues = [[] for i in range(NUM_VALUES)]
+
+    def add(self, timestamp, values):
+        """Add one sample, the values in sampler order"""
+        bucket = timestamp - timestamp % self.width
+        if not self._used or bucket > self._starts[self._head]:
+            self._open(bucket)
+        # Samples from before a clock change still go to the open bucket
+        head = self._head
+        count = self._counts[head] + 1
+        self._counts[head] = count
+        stats = self._stats
+        for i in range(NUM_VALUES):
+            value = values[i]
+            base = (head * NUM_VALUES + i) * _STATS
+            if count == 1:
+                stats[base] = stats[base + 1] = stats[base + 2] = value
+                stats[base + 3] = 0.0
+                continue
+            if value < stats[base]:
+                stats[base] = value
+            if value > stats[base + 1]:
+                stats[base + 1] = value
+            delta = value - stats[base + 2]
+            stats[base + 2] += delta / count
+            stats[base + 3] += delta * (value - stats[base + 2])
+
+    def _open(self, bucket):
+        """Close the open bucket, expire the ones that left the window and open 'bucket'"""
+        if self._used:
+            self._close(self._head)
+        while self._used and (self._used == self.buckets
+                              or self._starts[self._oldest()] <= bucket - self.span):
+            self._expire(self._oldest())
+        self._head = (self._head + 1) % self.buckets if self._used else self._head
+        self._used += 1
+        self._starts[self._head] = bucket
+        self._counts[self._head] = 0
+
+    def expire(self, now):
+        """Drop the buckets that left the window by 'now', as add() does when it opens a
+           bucket. For a restored checkpoint, whose buckets may be from long ago."""
+        bucket = now - now % self.width
+        if self._used and self._starts[self._head] <= bucket - self.span:
+            self._used = 0      # The open bucket is too old as well
+            self._reset_totals()
+            return
+        while self._used > 1 and self._starts[self._oldest()] <= bucket - self.span:
+            self._expire(self._oldest())
+
+    def _oldest(self):
+        return (self._head - self._used + 1) % self.buckets
+
+    def _close(self, index):
+        """Add bucket 'index' to the running totals and the min/max queues"""
+        count = self._counts[index]
+        if not count:
+            return
+        total = self._count + count
+        stats = self._stats
+        for i in range(NUM_VALUES):
+            base = (index * NUM_VALUES + i) * _STATS
+            delta = stats[base + 2] - self._means[i]
+            self._means[i] += delta * count / total
+            self._m2s[i] += stats[base + 3] + delta * delta * self._count * count / total
+            queue = self._min_queues[i]
+            while queue and stats[(queue[-1] * NUM_VALUES + i) * _STATS] >= stats[base]:
+                queue.pop()
+            queue.append(index)
+            queue = self._max_queues[i]
+            while queue and stats[(queue[-1] * NUM_VALUES + i) * _STATS + 1] <= stats[base + 1]:
+                queue.pop()
+            queue.append(index)
+        self._count = total
+
+    def _expire(self, index):
+        """Remove the oldest bucket, 'index', from the running totals and the queues"""
+        self._used -= 1
+        count = self._counts[index]
+        if not count:
+            return
+        remaining = self._count - count
+        stats = self._stats
+        for i in range(NUM_VALUES):
+            base = (index * NUM_VALUES + i) * _STATS
+            if remaining:
+                mean = (self._means[i] * self._count - stats[base + 2] * count) / remaining
+                delta = stats[base + 2] - mean
+                self._m2s[i] = max(0.0, self._m2s[i] - stats[base + 3]
+                                   - delta * delta * remaining * count / self._count)
+                self._means[i] = mean
+            for queue in (self._min_queues[i], self._max_queues[i]):
+                if queue and queue[0] == index:
+                    queue.pop(0)
+        if remaining:
+            self._count = remaining
+        else:
+            self._reset_totals()
+
+    def summary(self, field):
+        """Return (samples, min, max, mean, variance) of 'field' in the window, None when it
+           holds no samples"""
+        head = self._head
+        count = self._counts[head] if self._used else 0
+        total = self._count + count
+        if not total:
+            return None
+        stats = self._stats
+        low = high = None
+        mean, m2 = self._means[field], self._m2s[field]
+        if self._count:
+            low = stats[(self._min_queues[field][0] * NUM_VALUES + field) * _STATS]
+            high = stats[(self._max_queues[field][0] * NUM_VALUES + field) * _STATS + 1]
+        if count:   # Combine with the open bucket
+            base = (head * NUM_VALUES + field) * _STATS
+            if low is None or stats[base] < low:
+                low = stats[base]
+            if high is None or stats[base + 1] > high:
+                high = stats[base + 1]
+            delta = stats[base + 2] - mean
+            mean += delta * count / total
+            m2 += stats[base + 3] + delta * delta * self._count * count / total
+        return total, low, high, mean, m2 / (total - 1) if total > 1 else 0.0
+
+    def write(self, f):
+        f.write(struct.pack(_WINDOW, self.span, self.buckets, self._used, self._head))
+        f.write(self._starts)
+        f.write(self._counts)
+        f.write(self._stats)
+
+    def read(self, f):
+        """Restore the ring from a checkpoint and rebuild the totals and queues from it"""
+        header = f.read(_WINDOW_SIZE)
+        if len(header) < _WINDOW_SIZE:
+            raise ValueError('checkpoint truncated')
+        span, buckets, used, head = struct.unpack(_WINDOW, header)
+        if span != self.span or buckets != self.buckets:
+            raise ValueError('window size changed')
+        for data in (self._starts, self._counts, self._stats):
+            if f.readinto(data) != len(data) * 4:
+                raise ValueError('checkpoint truncated')
+        self._reset_totals()
+        self._used = 0
+        self._head = (head - used) % self.buckets
+        for n in range(used):
+            self._head = (self._head + 1) % self.buckets
+            self._used += 1
+            if n < used - 1:
+                self._close(self._head)
+
+
+class Stats:
+    """Rolling statistics over several windows.
+
+       :param windows: (span seconds, buckets) per window
+       :param str path: Checkpoint file, restored when it matches the windows"""
+    def __init__(self, windows=((3600, 30), (86400, 48), (604800, 56)), path=None):
+        self.windows = [Window(span, buckets) for span, buckets in windows]
+        self.path = path
+        if path:
+            self.load()
+
+    def add(self, timestamp, values):
+        """Add one sample to every window"""
+        for window in self.windows:
+            window.add(timestamp, values)
+
+    def expire(self, now):
+        """Drop the buckets of every window that are older than its span at 'now'"""
+        for window in self.windows:
+            window.expire(now)
+
+    def window(self, span):
+        """The window covering 'span' seconds"""
+        for window in self.windows:
+            if window.span == span:
+                return window
+        raise KeyError(span)
+
+    def save(self):
+        """Checkpoint every window to flash"""
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(struct.pack(_HEADER, _MAGIC, VERSION, NUM_VALUES, len(self.windows)))
+            for window in self.windows:
+                window.write(f)
+        uos.rename(temp, self.path)     # Replaces the old checkpoint only once complete
+
+    def load(self):
+        """Restore the windows from the checkpoint, if there is a usable one"""
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+                if len(header) < HEADER_SIZE:
+                    raise ValueError('checkpoint truncated')
+                magic, version, values, windows = struct.unpack(_HEADER, header)
+                if (magic != _MAGIC or version != VERSION or values != NUM_VALUES
+                        or windows != len(self.windows)):
+                    raise ValueError('unknown checkpoint format')
+                for window in self.windows:
+                    window.read(f)
+        except OSError:
+            pass    # No checkpoint yet
+        except ValueError as e:
+            print(f'Statistics checkpoint not usable ({e}), starting over')
+            self.windows = [Window(window.span, window.buckets) for window in self.windows]
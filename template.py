@@ -0,0 +1,96 @@
+"""
+Precompiled page templates.
+
+A template file is read once and split at its {VAR} placeholders into
+static byte chunks. Rendering streams those chunks and the formatted
+values straight to the client, so the page is never assembled in memory
+on every request.
+"""
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+# Placeholder names are upper case words, so css braces pass through untouched
+def _is_name(text):
+    return len(text) > 0 and all(c == '_' or 'A' <= c <= 'Z' or '0' <= c <= '9' for c in text)
+
+
+class Template:
+    """A page template with {VAR} placeholders.
+
+       :param str path: Template file, read and split once
+       :param bool cache: Keep the rendered bytes of the last ``key`` passed to ``render()``
+         and ``stream()``, so repeated requests for the same sample reuse them"""
+    def __init__(self, path, cache=False):
+        with open(path, 'r') as f:
+            text = f.read()
+        self._static = []   # Static byte chunks, one more than there are placeholders
+        self.names = []     # Placeholder names, in page order
+        start = 0
+        chunk = ''
+        while True:
+            i = text.find('{', start)
+            j = text.find('}', i + 1) if i >= 0 else -1
+            if j < 0:
+                break
+            if _is_name(text[i + 1:j]):
+                self._static.append((chunk + text[start:i]).encode('utf-8'))
+                self.names.append(text[i + 1:j])
+                chunk = ''
+                start = j + 1
+            else:
+                chunk += text[start:i + 1]
+                start = i + 1
+        self._static.append((chunk + text[start:]).encode('utf-8'))
+        self._static_len = sum(len(c) for c in self._static)
+        self._cache = cache
+        self._cache_key = None
+        self._cache_body = None
+
+    def _encode(self, values):
+        return [str(values[name]).encode('utf-8') for name in self.names]
+
+    def render(self, values, key=None):
+        """Return the page for the 'values' dict as bytes. With caching enabled, the result
+           is reused while 'key' stays the same."""
+        if self._cache and key is not None and key == self._cache_key:
+            return self._cache_body
+        encoded = self._encode(values)
+        parts = [self._static[0]]
+        for i in range(len(encoded)):
+            parts.append(encoded[i])
+            parts.append(self._static[i + 1])
+        body = b''.join(parts)
+        if self._cache and key is not None:
+            self._cache_key = key
+            self._cache_body = body
+        return body
+
+    def cached(self, key):
+        """True when the render cache holds the page for 'key'"""
+        return self._cache and key is not None and key == self._cache_key
+
+    async def stream(self, writer, values, send_headers=None, key=None):
+        """Write the page for the 'values' dict to the stream 'writer' chunk by chunk.
+
+           'send_headers' is called with the body length before the first chunk is written,
+           so the caller can send a Content-Length header. With caching enabled the rendered
+           bytes for 'key' are written in one go instead."""
+        if self._cache and key is not None:
+            body = self.render(values, key)
+            if send_headers is not None:
+                send_headers(len(body))
+            writer.write(body)
+            await writer.drain()
+            return
+        encoded = self._encode(values)
+        if send_headers is not None:
+            send_headers(self._static_len + sum(len(v) for v in encoded))
+        writer.write(self._static[0])
+        for i in range(len(encoded)):
+            writer.write(encoded[i])
+            writer.write(self._static[i + 1])
+            await writer.drain()
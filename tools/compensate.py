@@ -0,0 +1,233 @@
+"""
+Batch recompensation of captured raw BME680 samples, run on a host.
+
+The server logs the sensor's raw ADC values when config.RAW_CAPTURE is
+set, with the calibration of the chip in calibration.json next to the
+segments. This module reads a copy of that directory into NumPy arrays
+and computes temperature, pressure, humidity and gas resistance for all
+samples at once, with the same formulas as the driver's
+``_compensate_*`` methods, vectorized. Like the server with the default
+config.INTEGER_COMPENSATION, it uses Bosch's fixed-point formulas, so the
+values match the logged ones; --float uses the floating point formulas,
+which differ from them in the last digits.
+
+    python tools/compensate.py [--float] raw/ > recompensated.csv
+
+Needs NumPy, which isn't available on the Pico.
+"""
+
+import json
+import os
+import sys
+import numpy as np
+
+HEADER_SIZE = 16    # As tsdb.HEADER_SIZE
+_MAGIC = b'BMEA'    # tsdb raw log segments
+RAW_RECORD = np.dtype([('timestamp', '<u4'), ('adc_temp', '<u4'), ('adc_pres', '<u4'),
+                       ('adc_hum', '<u2'), ('adc_gas', '<u2')])
+
+# Same as the driver's gas lookup tables, indexed by gas range
+_LOOKUP_TABLE_1 = np.array((
+    2147483647.0, 2147483647.0, 2147483647.0, 2147483647.0, 2147483647.0, 2126008810.0,
+    2147483647.0, 2130303777.0, 2147483647.0, 2147483647.0, 2143188679.0, 2136746228.0,
+    2147483647.0, 2126008810.0, 2147483647.0, 2147483647.0))
+_LOOKUP_TABLE_2 = np.array((
+    4096000000.0, 2048000000.0, 1024000000.0, 512000000.0, 255744255.0, 127110228.0,
+    64000000.0, 32258064.0, 16016016.0, 8000000.0, 4000000.0, 2000000.0, 1000000.0,
+    500000.0, 250000.0, 125000.0))
+
+
+def read_raw(directory):
+    """Read every raw log segment in 'directory', oldest first, into an array of samples
+       with fields timestamp, adc_temp, adc_pres, adc_hum, adc_gas, gas_range and gas_step,
+       the heater profile step of the gas reading"""
+    parts = []
+    for name in sorted(os.listdir(directory)):
+        if not (name.endswith('.bin') and name[:-4].isdigit()):
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            if header[:4] != _MAGIC:
+                raise ValueError(f'{name} is not a raw sample log')
+            data = f.read()
+        parts.append(np.frombuffer(data[:len(data) // RAW_RECORD.itemsize * RAW_RECORD.itemsize],
+                                   RAW_RECORD))
+    records = np.concatenate(parts) if parts else np.empty(0, RAW_RECORD)
+    samples = np.empty(len(records), [('timestamp', '<u4'), ('adc_temp', '<f8'),
+                                      ('adc_pres', '<f8'), ('adc_hum', '<f8'),
+                                      ('adc_gas', '<i4'), ('gas_range', '<i4'),
+                                      ('gas_step', '<i4')])
+    samples['timestamp'] = records['timestamp']
+    samples['adc_temp'] = (records['adc_temp'] & 0xFFFFFF) / 16
+    samples['adc_pres'] = records['adc_pres'] / 16
+    samples['adc_hum'] = records['adc_hum']
+    samples['adc_gas'] = records['adc_gas'] >> 4
+    samples['gas_range'] = records['adc_gas'] & 0x0F
+    samples['gas_step'] = records['adc_temp'] >> 24
+    return samples
+
+
+def read_calibrations(directory):
+    """The calibrations in 'directory'/calibration.json, oldest first, each a dict with the
+       timestamp it is valid from in 'since'"""
+    with open(os.path.join(directory, 'calibration.json')) as f:
+        return json.load(f)
+
+
+def _div(a, b):
+    """Integer division truncating toward zero, like C and the driver's _div"""
+    q = np.abs(a) // np.abs(b)
+    return np.where((a < 0) == (b < 0), q, -q)
+
+
+def compensate(samples, calibration):
+    """Compensate the raw 'samples' with one chip's 'calibration' dict. Returns a dict of
+       arrays: temperature (C), pressure (hPa), humidity (RH %) and gas (ohms)."""
+    t_cal = calibration['temperature']
+    p_cal = calibration['pressure']
+    h_cal = calibration['humidity']
+    adc_temp = samples['adc_temp']
+    adc_pres = samples['adc_pres']
+    adc_hum = samples['adc_hum']
+
+    var1 = (adc_temp / 8) - (t_cal[0] * 2)
+    var2 = (var1 * t_cal[1]) / 2048
+    var3 = ((var1 / 2) * (var1 / 2)) / 4096
+    var3 = (var3 * t_cal[2] * 16) / 16384
+    t_fine = np.trunc(var2 + var3)
+    temperature = (((t_fine * 5) + 128) / 256) / 100
+
+    var1 = (t_fine / 2) - 64000
+    var2 = ((var1 / 4) * (var1 / 4)) / 2048
+    var2 = (var2 * p_cal[5]) / 4
+    var2 = var2 + (var1 * p_cal[4] * 2)
+    var2 = (var2 / 4) + (p_cal[3] * 65536)
+    var1 = (((((var1 / 4) * (var1 / 4)) / 8192) * (p_cal[2] * 32) / 8) +
+            ((p_cal[1] * var1) / 2))
+    var1 = var1 / 262144
+    var1 = ((32768 + var1) * p_cal[0]) / 32768
+    calc_pres = 1048576 - adc_pres
+    calc_pres = (calc_pres - (var2 / 4096)) * 3125
+    calc_pres = (calc_pres / var1) * 2
+    var1 = (p_cal[8] * (((calc_pres / 8) * (calc_pres / 8)) / 8192)) / 4096
+    var2 = ((calc_pres / 4) * p_cal[7]) / 8192
+    var3 = (((calc_pres / 256) ** 3) * p_cal[9]) / 131072
+    calc_pres = calc_pres + ((var1 + var2 + var3 + (p_cal[6] * 128)) / 16)
+    pressure = calc_pres / 100
+
+    temp_scaled = ((t_fine * 5) + 128) / 256
+    var1 = ((adc_hum - (h_cal[0] * 16)) - ((temp_scaled * h_cal[2]) / 200))
+    var2 = (h_cal[1] * (((temp_scaled * h_cal[3]) / 100) +
+                        (((temp_scaled * ((temp_scaled * h_cal[4]) / 100)) / 64) / 100) +
+                        16384)) / 1024
+    var3 = var1 * var2
+    var4 = h_cal[5] * 128
+    var4 = (var4 + ((temp_scaled * h_cal[6]) / 100)) / 16
+    var5 = ((var3 / 16384) * (var3 / 16384)) / 1024
+    var6 = (var4 * var5) / 2
+    humidity = np.clip((((var3 + var6) / 1024) * 1000) / 4096 / 1000, 0, 100)
+
+    gas_range = samples['gas_range']
+    var1 = ((1340 + (5 * calibration['sw_err'])) * _LOOKUP_TABLE_1[gas_range]) / 65536
+    var2 = ((samples['adc_gas'] * 32768) - 16777216) + var1
+    var3 = (_LOOKUP_TABLE_2[gas_range] * var1) / 512
+    gas = np.trunc((var3 + (var2 / 2)) / var2)
+
+    return {'temperature': temperature, 'pressure': pressure, 'humidity': humidity,
+            'gas': gas}
+
+
+def compensate_int(samples, calibration):
+    """compensate() with the driver's fixed-point formulas, in 64 bit integers"""
+    t1, t2, t3 = (int(x) for x in calibration['temperature'])
+    p1, p2, p3, p4, p5, p6, p7, p8, p9, p10 = (int(x) for x in calibration['pressure'])
+    h1, h2, h3, h4, h5, h6, h7 = (int(x) for x in calibration['humidity'])
+    h1 = int(calibration['humidity'][0] * 16)
+    adc_temp = samples['adc_temp'].astype(np.int64)
+    adc_pres = samples['adc_pres'].astype(np.int64)
+    adc_hum = samples['adc_hum'].astype(np.int64)
+
+    var1 = (adc_temp >> 3) - (t1 << 1)
+    var2 = (var1 * t2) >> 11
+    var3 = ((var1 >> 1) * (var1 >> 1)) >> 12
+    var3 = (var3 * (t3 << 4)) >> 14
+    t_fine = var2 + var3
+    temperature = (((t_fine * 5) + 128) >> 8) / 100
+
+    var1 = (t_fine >> 1) - 64000
+    var2 = ((((var1 >> 2) * (var1 >> 2)) >> 11) * p6) >> 2
+    var2 = var2 + ((var1 * p5) << 1)
+    var2 = (var2 >> 2) + (p4 << 16)
+    var1 = (((((var1 >> 2) * (var1 >> 2)) >> 13) * (p3 << 5)) >> 3) + ((p2 * var1) >> 1)
+    var1 = var1 >> 18
+    var1 = ((32768 + var1) * p1) >> 15
+    calc_pres = 1048576 - adc_pres
+    calc_pres = (calc_pres - (var2 >> 12)) * 3125
+    calc_pres = np.where(calc_pres >= 0x40000000, _div(calc_pres, var1) << 1,
+                         _div(calc_pres << 1, var1))
+    var1 = (p9 * (((calc_pres >> 3) * (calc_pres >> 3)) >> 13)) >> 12
+    var2 = ((calc_pres >> 2) * p8) >> 13
+    var3 = ((calc_pres >> 8) * (calc_pres >> 8) * (calc_pres >> 8) * p10) >> 17
+    pressure = (calc_pres + ((var1 + var2 + var3 + (p7 << 7)) >> 4)) / 100
+
+    temp_scaled = ((t_fine * 5) + 128) >> 8
+    var1 = (adc_hum - h1) - (_div(temp_scaled * h3, 100) >> 1)
+    var2 = (h2 * (_div(temp_scaled * h4, 100) +
+                  _div((temp_scaled * _div(temp_scaled * h5, 100)) >> 6, 100) +
+                  (1 << 14))) >> 10
+    var3 = var1 * var2
+    var4 = ((h6 << 7) + _div(temp_scaled * h7, 100)) >> 4
+    var5 = ((var3 >> 14) * (var3 >> 14)) >> 10
+    var6 = (var4 * var5) >> 1
+    humidity = np.clip((((var3 + var6) >> 10) * 1000) >> 12, 0, 100000) / 1000
+
+    gas_range = samples['gas_range']
+    var1 = (((1340 + (5 * int(calibration['sw_err']))) *
+             _LOOKUP_TABLE_1.astype(np.int64)[gas_range]) >> 16)
+    var2 = ((samples['adc_gas'].astype(np.int64) << 15) - 16777216) + var1
+    var3 = (_LOOKUP_TABLE_2.astype(np.int64)[gas_range] * var1) >> 9
+    gas = _div(var3 + (var2 >> 1), var2)
+
+    return {'temperature': temperature, 'pressure': pressure, 'humidity': humidity,
+            'gas': gas}
+
+
+def compensate_log(directory, integer=True):
+    """Read and compensate a whole raw log directory, using for every sample the calibration
+       that was valid when it was taken, with the fixed-point formulas when 'integer' is
+       set. Returns (timestamps, dict of arrays), the arrays include the heater step of
+       each gas value in 'gas_step'."""
+    formulas = compensate_int if integer else compensate
+    samples = read_raw(directory)
+    calibrations = read_calibrations(directory)
+    result = {name: np.empty(len(samples)) for name in
+              ('temperature', 'pressure', 'humidity', 'gas')}
+    # Samples from before the first recorded calibration use that one
+    since = np.array([entry['since'] for entry in calibrations])
+    which = np.maximum(np.searchsorted(since, samples['timestamp'], side='right') - 1, 0)
+    for n, calibration in enumerate(calibrations):
+        selected = which == n
+        if selected.any():
+            for name, values in formulas(samples[selected], calibration).items():
+                result[name][selected] = values
+    result['gas_step'] = samples['gas_step']
+    return samples['timestamp'], result
+
+
+def main(argv):
+    integer = '--float' not in argv
+    args = [arg for arg in argv[1:] if arg != '--float']
+    if len(args) != 1:
+        print(f'usage: {argv[0]} [--float] RAW_LOG_DIRECTORY', file=sys.stderr)
+        return 2
+    timestamps, values = compensate_log(args[0], integer)
+    columns = np.column_stack((timestamps, values['temperature'], values['pressure'],
+                               values['humidity'], values['gas'], values['gas_step']))
+    np.savetxt(sys.stdout, columns, fmt=('%d', '%.4f', '%.4f', '%.4f', '%d', '%d'),
+               delimiter=',', header='timestamp,temperature,pressure,humidity,gas,gas_step',
+               comments='')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
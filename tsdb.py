@@ -0,0 +1,481 @@
+"""
+Compact binary sample log.
+
+Every sample is a fixed-size, struct-packed record: an epoch timestamp
+plus scaled integer temperature, humidity, pressure, gas and AQI. The
+records are appended to one file after a small header, so an append
+never parses anything and the n-th sample is found by arithmetic. CSV
+is only rendered on export, streamed record by record. SegmentedLog
+splits the log into size-bounded segment files with retention. The raw
+variants store the sensor's ADC values instead, for recompensation on a
+host.
+
+The exported CSV is fixed width (rows padded with spaces at the end), so
+its size and any byte range of it are also known without rendering the
+whole file.
+"""
+
+import uos
+import time
+import struct
+import json
+from micropython import const
+
+_MAGIC = b'BMEL'
+VERSION = const(1)
+_HEADER = '<4sBBHII'    # magic, version, record size, reserved, sample interval, created
+HEADER_SIZE = const(16)
+# timestamp, temperature C * 100, humidity % * 100, pressure Pa - _PRESSURE_OFFSET, gas ohms,
+# aqi * 100
+_RECORD = '<IhHHIh'
+_PRESSURE_OFFSET = const(50000)     # Stored pressures cover 500 to 1155.35 hPa
+RECORD_SIZE = const(16)
+_READ_RECORDS = const(32)   # Records read from flash per block when streaming
+_RAW_MAGIC = b'BMEA'
+# timestamp, gas heater step << 24 | temperature ADC * 16, pressure ADC * 16, humidity ADC,
+# gas ADC << 4 | gas range. The 20 bit temperature ADC * 16 leaves the top byte for the step.
+_RAW_RECORD = '<IIIHH'
+
+CSV_HEADER = b'date,time,Temp_C,Temp_F,Humidity,Pressure,Gas,AQI\r\n'
+CSV_ROW_SIZE = const(66)
+
+
+def _clamp(value, low, high):
+    return low if value < low else high if value > high else value
+
+
+def _pack(buf, offset, timestamp, temperature, humidity, pressure, gas, aqi):
+    struct.pack_into(_RECORD, buf, offset, int(timestamp),
+                     int(_clamp(round(temperature * 100), -32768, 32767)),
+                     int(_clamp(round(humidity * 100), 0, 65535)),
+                     int(_clamp(round(pressure * 100) - _PRESSURE_OFFSET, 0, 65535)),
+                     int(_clamp(round(gas * 1000), 0, 0xFFFFFFFF)),
+                     int(_clamp(round(aqi * 100), -32768, 32767)))
+
+
+def _unpack(buf, offset):
+    timestamp, temperature, humidity, pressure, gas, aqi = struct.unpack_from(_RECORD, buf, offset)
+    return (timestamp, temperature / 100, humidity / 100, (pressure + _PRESSURE_OFFSET) / 100,
+            gas / 1000, aqi / 100)
+
+
+def _pack_raw(buf, offset, timestamp, adc_temp, adc_pres, adc_hum, adc_gas, gas_range,
+              gas_step=0):
+    struct.pack_into(_RAW_RECORD, buf, offset, int(timestamp),
+                     (int(gas_step) << 24) | int(adc_temp * 16), int(adc_pres * 16),
+                     int(adc_hum), (int(adc_gas) << 4) | int(gas_range))
+
+
+def _unpack_raw(buf, offset):
+    timestamp, temp, adc_pres, adc_hum, gas = struct.unpack_from(_RAW_RECORD, buf, offset)
+    return (timestamp, (temp & 0xFFFFFF) / 16, adc_pres / 16, adc_hum, gas >> 4, gas & 0x0F,
+            temp >> 24)
+
+
+def _read_records(f, start, stop, unpack=_unpack):
+    """Yield records start..stop-1 of the open log file 'f', reading flash in blocks"""
+    # Own buffer, other readers may run while this generator is suspended
+    buf = bytearray(RECORD_SIZE * _READ_RECORDS)
+    n = start
+    while n < stop:
+        f.seek(HEADER_SIZE + n * RECORD_SIZE)
+        got = f.readinto(buf) // RECORD_SIZE
+        if not got:
+            return
+        for i in range(min(got, stop - n)):
+            yield unpack(buf, i * RECORD_SIZE)
+        n += got
+
+
+def _bisect_file(f, count, timestamp):
+    """Index of the first of 'count' records in the open log file 'f' taken at or after
+       'timestamp'. Only the timestamps of about log2(count) records are read."""
+    low, high = 0, count
+    stamp = bytearray(4)
+    while low < high:
+        mid = (low + high) // 2
+        f.seek(HEADER_SIZE + mid * RECORD_SIZE)
+        f.readinto(stamp)
+        if struct.unpack('<I', stamp)[0] < timestamp:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+def csv_row(record):
+    """Render a (timestamp, temperature, humidity, pressure, gas, aqi) record as one fixed
+       width CSV row of CSV_ROW_SIZE bytes"""
+    timestamp, temperature, humidity, pressure, gas, aqi = record
+    year, month, mday, hour, minute, second = time.localtime(timestamp)[:6]
+    row = '%02d/%02d/%04d,%02d:%02d:%02d,%.2f,%.2f,%.2f,%.2f,%.2f,%.2f' % (
+        month, mday, year, hour, minute, second,
+        _clamp(temperature, -99.99, 999.99),
+        _clamp(temperature * 9 / 5 + 32, -99.99, 999.99),
+        _clamp(humidity, 0, 100),
+        _clamp(pressure, 0, 9999.99),
+        _clamp(gas, 0, 99999.99),
+        _clamp(aqi, -99.99, 999.99))
+    return (row + ' ' * (CSV_ROW_SIZE - 2 - len(row)) + '\r\n').encode('ascii')
+
+
+class _Log:
+    """CSV export shared by the log classes, built on ``__len__()`` and ``records()``"""
+    def csv_size(self):
+        """Length in bytes of the CSV export"""
+        return len(CSV_HEADER) + len(self) * CSV_ROW_SIZE
+
+    def csv_chunks(self, first=0, last=None):
+        """Yield bytes 'first' to 'last' (inclusive) of the CSV export"""
+        header_size = len(CSV_HEADER)
+        size = self.csv_size()
+        last = size - 1 if last is None or last >= size else last
+        if first < header_size:
+            yield CSV_HEADER[first:last + 1]
+            first = header_size
+        if first > last:
+            return
+        row = (first - header_size) // CSV_ROW_SIZE
+        stop = (last - header_size) // CSV_ROW_SIZE + 1
+        for record in self.records(row, stop):
+            row_start = header_size + row * CSV_ROW_SIZE
+            data = csv_row(record)
+            if first > row_start or last + 1 < row_start + CSV_ROW_SIZE:
+                data = data[max(0, first - row_start):last + 1 - row_start]
+            yield data
+            row += 1
+
+
+class SampleLog(_Log):
+    """Append-only log of samples in fixed-size binary records.
+
+       :param str path: Log file, created when missing
+       :param int interval: Seconds between samples, recorded in the header
+       :param int batch: Records buffered in memory before they are written to flash"""
+    _magic = _MAGIC
+    _pack = staticmethod(_pack)
+    _unpack = staticmethod(_unpack)
+
+    def __init__(self, path, interval, batch=1):
+        self.path = path
+        self.interval = interval
+        self._batch = batch
+        self._buf = bytearray(RECORD_SIZE * batch)
+        self._mv = memoryview(self._buf)
+        self._pending = 0   # Records in _buf not written yet
+        self._read_buf = bytearray(RECORD_SIZE * _READ_RECORDS)
+        self._f = None
+        self._count = self._open()
+
+    def _open(self):
+        """Open the log file, creating it if needed, and return the number of records in it"""
+        try:
+            size = uos.stat(self.path)[6]
+            with open(self.path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise ValueError('truncated header')   # Power cut while it was created
+            magic, version, record_size, reserved, interval, created = struct.unpack(_HEADER,
+                                                                                     header)
+            if magic != self._magic or version != VERSION or record_size != RECORD_SIZE:
+                raise ValueError('unknown log format')
+            self.interval = interval
+        except OSError:
+            self._create()
+            size = HEADER_SIZE
+        except ValueError as e:
+            print(f'Sample log {self.path} not readable ({e}), starting a new one')
+            uos.rename(self.path, self.path + '.old')
+            self._create()
+            size = HEADER_SIZE
+        self._f = open(self.path, 'r+b')
+        # A record torn by a power cut is ignored and overwritten by the next append
+        return (size - HEADER_SIZE) // RECORD_SIZE
+
+    def _create(self):
+        with open(self.path, 'wb') as f:
+            f.write(struct.pack(_HEADER, self._magic, VERSION, RECORD_SIZE, 0, int(self.interval),
+                                int(time.time())))
+
+    def __len__(self):
+        return self._count + self._pending
+
+    def append(self, timestamp, *values):
+        """Add one sample: temperature, humidity, pressure, gas and aqi. Gas is in KOhms,
+           like the page shows it"""
+        self._pack(self._buf, self._pending * RECORD_SIZE, timestamp, *values)
+        self._pending += 1
+        if self._pending == self._batch:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to flash"""
+        if self._pending:
+            self._f.seek(HEADER_SIZE + self._count * RECORD_SIZE)
+            self._f.write(self._mv[:self._pending * RECORD_SIZE])
+            self._f.flush()
+            self._count += self._pending
+            self._pending = 0
+
+    def close(self):
+        """Write buffered records and close the file"""
+        self.flush()
+        self._f.close()
+
+    def clear(self):
+        """Drop every sample and start an empty log"""
+        self._f.close()
+        self._pending = 0
+        self._create()
+        self._f = open(self.path, 'r+b')
+        self._count = 0
+
+    def record(self, n):
+        """Return sample 'n' as (timestamp, temperature, humidity, pressure, gas, aqi)"""
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError('record out of range')
+        if n >= self._count:
+            return self._unpack(self._buf, (n - self._count) * RECORD_SIZE)
+        self._f.seek(HEADER_SIZE + n * RECORD_SIZE)
+        self._f.readinto(self._read_buf)
+        return self._unpack(self._read_buf, 0)
+
+    def records(self, start=0, stop=None):
+        """Yield samples start..stop-1 as (timestamp, temperature, humidity, pressure, gas,
+           aqi), reading flash in blocks"""
+        self.flush()
+        stop = self._count if stop is None else min(stop, self._count)
+        for record in _read_records(self._f, start, stop, self._unpack):
+            yield record
+
+    def bisect(self, timestamp):
+        """Index of the first sample taken at or after 'timestamp', len(self) if there is
+           none. Samples are appended in time order, so this is a binary search."""
+        self.flush()
+        return _bisect_file(self._f, self._count, timestamp)
+
+
+class RawSampleLog(SampleLog):
+    """SampleLog of the raw ADC values behind each sample. Records are (timestamp,
+       adc_temp, adc_pres, adc_hum, adc_gas, gas_range, gas_step) as the driver's
+       ``Reading`` has them; compensating them again needs the sensor's calibration too."""
+    _magic = _RAW_MAGIC
+    _pack = staticmethod(_pack_raw)
+    _unpack = staticmethod(_unpack_raw)
+
+
+class SegmentedLog(_Log):
+    """Sample log stored as a series of segment files, with retention.
+
+       Records are appended to the newest segment until it holds ``segment_records``; then
+       it is sealed and a new one started. When the log exceeds ``max_bytes``, or the oldest
+       segment only holds samples older than ``max_age`` seconds, the oldest segment is
+       deleted. A manifest file lists the segments and is rebuilt from the directory when
+       missing. Readers see the segments stitched together as one log.
+
+       :param str directory: Directory holding the segments and manifest
+       :param int interval: Seconds between samples, recorded in each segment header
+       :param int batch: Records buffered in memory before they are written to flash
+       :param int segment_records: Records per segment
+       :param int max_bytes: Size budget of all segments, 0 for no limit
+       :param int max_age: Seconds samples are kept for, 0 for no limit"""
+    _segment_class = SampleLog
+
+    def __init__(self, directory, interval, batch=1, segment_records=512, max_bytes=0,
+                 max_age=0):
+        self.directory = directory
+        self.interval = interval
+        self._batch = batch
+        self._segment_records = segment_records
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._manifest_path = directory + '/manifest.json'
+        try:
+            uos.mkdir(directory)
+        except OSError:
+            pass    # Already exists
+        # Sealed segments, oldest first: [id, first timestamp, last timestamp, records]
+        self._segments = []
+        self._next_id = 1
+        active_id = self._load_manifest()
+        if active_id is None:
+            active_id = self._rebuild_manifest()
+        self._sealed_count = sum(seg[3] for seg in self._segments)
+        self._active_id = active_id
+        self._active = self._segment_class(self._segment_path(active_id), interval, batch)
+        self._save_manifest()
+        self._enforce_retention(int(time.time()))
+
+    def _segment_path(self, segment_id):
+        return '%s/%08d.bin' % (self.directory, segment_id)
+
+    def _load_manifest(self):
+        """Read the manifest and return the active segment id, None if it isn't usable"""
+        try:
+            with open(self._manifest_path, 'r') as f:
+                manifest = json.load(f)
+            self._segments = [list(seg) for seg in manifest['segments']]
+            self._next_id = manifest['next']
+            return manifest['active']
+        except OSError:
+            return None     # No manifest yet
+        except (ValueError, KeyError, TypeError) as e:
+            print(f'Log manifest not usable ({e}), rebuilding it')
+            self._segments = []
+            return None
+
+    def _rebuild_manifest(self):
+        """Recreate the segment list from the files in the directory, return the active id"""
+        ids = sorted(int(name[:-4]) for name in uos.listdir(self.directory)
+                     if name.endswith('.bin') and name[:-4].isdigit())
+        if not ids:
+            self._next_id = 2
+            return 1
+        for segment_id in ids[:-1]:
+            segment = self._segment_class(self._segment_path(segment_id), self.interval)
+            if len(segment):
+                self._segments.append([segment_id, segment.record(0)[0], segment.record(-1)[0],
+                                       len(segment)])
+            segment.close()
+        self._next_id = ids[-1] + 1
+        return ids[-1]
+
+    def _save_manifest(self):
+        with open(self._manifest_path, 'w') as f:
+            json.dump({'next': self._next_id, 'active': self._active_id,
+                       'segments': self._segments}, f)
+
+    def __len__(self):
+        return self._sealed_count + len(self._active)
+
+    def size_bytes(self):
+        """Flash used by the segments"""
+        sealed = len(self._segments) * HEADER_SIZE + self._sealed_count * RECORD_SIZE
+        return sealed + HEADER_SIZE + len(self._active) * RECORD_SIZE
+
+    @property
+    def segments(self):
+        """Number of segment files, including the one being written"""
+        return len(self._segments) + 1
+
+    def append(self, timestamp, *values):
+        """Add one sample, the values as the segments take them"""
+        if len(self._active) >= self._segment_records:
+            self._seal()
+        self._active.append(timestamp, *values)
+        if self._max_age and self._segments and self._segments[0][2] < timestamp - self._max_age:
+            self._enforce_retention(timestamp)
+
+    def _seal(self):
+        """Close the active segment and start a new one"""
+        active = self._active
+        if len(active):
+            self._segments.append([self._active_id, active.record(0)[0], active.record(-1)[0],
+                                   len(active)])
+            self._sealed_count += len(active)
+        active.close()
+        self._active_id = self._next_id
+        self._next_id += 1
+        self._active = self._segment_class(self._segment_path(self._active_id), self.interval,
+                                           self._batch)
+        self._enforce_retention(int(time.time()))
+        self._save_manifest()
+
+    def _enforce_retention(self, now):
+        """Delete the oldest sealed segments while over the size or age budget"""
+        dropped = False
+        while self._segments:
+            oldest = self._segments[0]
+            if not ((self._max_bytes and self.size_bytes() > self._max_bytes) or
+                    (self._max_age and oldest[2] < now - self._max_age)):
+                break
+            try:
+                uos.remove(self._segment_path(oldest[0]))
+            except OSError as e:
+                print(f'Could not remove log segment {oldest[0]}: {e}')
+            self._segments.pop(0)
+            self._sealed_count -= oldest[3]
+            dropped = True
+        if dropped:
+            self._save_manifest()
+
+    def flush(self):
+        """Write the buffered records to flash"""
+        self._active.flush()
+
+    def clear(self):
+        """Drop every sample: delete the sealed segments and empty the active one"""
+        for segment in self._segments:
+            try:
+                uos.remove(self._segment_path(segment[0]))
+            except OSError as e:
+                print(f'Could not remove log segment {segment[0]}: {e}')
+        self._segments = []
+        self._sealed_count = 0
+        self._active.clear()
+        self._save_manifest()
+
+    def record(self, n):
+        """Return sample 'n', counted from the oldest kept sample, as (timestamp,
+           temperature, humidity, pressure, gas, aqi)"""
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError('record out of range')
+        for record in self.records(n, n + 1):
+            return record
+
+    def bisect(self, timestamp):
+        """Index of the first sample taken at or after 'timestamp', len(self) if there is
+           none. The manifest narrows it down to one segment, which is binary searched."""
+        offset = 0
+        for segment in self._segments:
+            if segment[2] >= timestamp:
+                with open(self._segment_path(segment[0]), 'rb') as f:
+                    return offset + _bisect_file(f, segment[3], timestamp)
+            offset += segment[3]
+        return offset + self._active.bisect(timestamp)
+
+    def records(self, start=0, stop=None):
+        """Yield samples start..stop-1 across all segments, oldest first"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        offset = 0  # Index of the first record of the segment being looked at
+        for segment in list(self._segments):
+            count = segment[3]
+            if start < offset + count and offset < stop:
+                with open(self._segment_path(segment[0]), 'rb') as f:
+                    for record in _read_records(f, max(0, start - offset),
+                                                min(count, stop - offset),
+                                                self._segment_class._unpack):
+                        yield record
+            offset += count
+            if offset >= stop:
+                return
+        if start < stop:
+            for record in self._active.records(max(0, start - offset), stop - offset):
+                yield record
+
+
+class RawSegmentedLog(SegmentedLog):
+    """SegmentedLog of RawSampleLog segments, with the sensor calibration they need kept in
+       calibration.json next to them"""
+    _segment_class = RawSampleLog
+
+    def set_calibration(self, calibration, timestamp):
+        """Record the sensor's 'calibration' dict as valid from 'timestamp' on. The file keeps
+           a list of calibrations, a new entry is only added when it changed (new sensor)."""
+        path = self.directory + '/calibration.json'
+        try:
+            with open(path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+        if entries and {k: v for k, v in entries[-1].items() if k != 'since'} == calibration:
+            return
+        entry = {'since': timestamp}
+        entry.update(calibration)
+        entries.append(entry)
+        with open(path, 'w') as f:
+            json.dump(entries, f)
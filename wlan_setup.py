@@ -1,12 +1,16 @@
 import network
 import time
 from machine import Pin
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 led = Pin("LED", Pin.OUT)
 
-# Initialize and connect wireless lan
-def connect():
-    led.on()
+
+# Activate the interface and start connecting, returns the WLAN
+def _start():
     wlan = network.WLAN(network.STA_IF)
     if not wlan.active():
         wlan.active(True)
@@ -16,6 +20,13 @@ def connect():
         ssid = wifi_info[0].strip()
         password = wifi_info[1].strip()
         wlan.connect(ssid, password)
+    return wlan
+
+
+# Initialize and connect wireless lan
+def connect():
+    led.on()
+    wlan = _start()
 
     max_wait = 10
     while max_wait > 0:
@@ -37,6 +48,23 @@ def connect():
     led.off()
 
 
+# Connect without blocking other tasks, polls the link every 100 ms for up to 'timeout'
+# seconds
+async def connect_async(timeout=10):
+    led.on()
+    wlan = _start()
+    waited = 0
+    while not (wlan.status() < 0 or wlan.status() >= 3) and waited < timeout * 1000:
+        await asyncio.sleep(0.1)
+        waited += 100
+        led.toggle()    # Blinks while connecting
+    led.off()
+    if wlan.status() != network.STAT_GOT_IP:
+        raise RuntimeError('network connection failed')
+    print(f'\nHost Address: {wlan.ifconfig()[0]}')
+    print()
+
+
 # Check if network is active
 def isactive():
     return network.WLAN().active()